@@ -0,0 +1,150 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embeddings import get_embedding_engine
+from metrics import register_gauges
+
+DEFAULT_ANSWER_CACHE_ENTRIES = 1000
+DEFAULT_ANSWER_CACHE_TTL = 24 * 3600             # Seconds
+DEFAULT_ANSWER_CACHE_SIMILARITY = 0.95          # Min cosine similarity of two questions sharing an answer
+_QUERY_VECTORS = 256                            # Question embeddings kept between a miss and its store()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.lower()).strip(" ?!.")
+
+# Index directory of a scope: the directory itself, or (directory, file IDs searched)
+def _directory(scope):
+    return scope[0] if isinstance(scope, tuple) else scope
+
+# Answers of a knowledge base version: scope (user's index directory [+ files searched]) + version (index content) + question
+# Matches the same normalized question, or a near-duplicate one (embedding similarity >= threshold) of the same scope
+# A new version of an index directory drops the previous answers of all its scopes; entries expire after ttl_seconds
+# (LRU past max_entries)
+class AnswerCache:
+    def __init__(self, embeddings, max_entries=DEFAULT_ANSWER_CACHE_ENTRIES, ttl_seconds=DEFAULT_ANSWER_CACHE_TTL,
+                 similarity=DEFAULT_ANSWER_CACHE_SIMILARITY):
+        self.embeddings = embeddings
+        self.max_entries = int(max_entries)
+        self.ttl_seconds = float(ttl_seconds)
+        self.similarity = float(similarity)
+        self._entries = OrderedDict()           # (scope, normalized question) -> {"version", "answer", "vector", "created_at"}
+        self._query_vectors = OrderedDict()     # normalized question -> unit vector
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _query_vector(self, normalized):
+        with self._lock:
+            vector = self._query_vectors.get(normalized)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+            vector /= max(float(np.linalg.norm(vector)), 1e-12)
+            with self._lock:
+                self._query_vectors[normalized] = vector
+                while len(self._query_vectors) > _QUERY_VECTORS:
+                    self._query_vectors.popitem(last=False)
+        return vector
+
+    def _live(self, entry, version, now):
+        return entry["version"] == version and now - entry["created_at"] < self.ttl_seconds
+
+    # -> {"answer", "match": "exact" | "similar", "similarity"} or None
+    def lookup(self, scope, version, question):
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((scope, normalized))
+            if entry is not None and self._live(entry, version, now):
+                self._entries.move_to_end((scope, normalized))
+                self.exact_hits += 1
+                return {"answer": entry["answer"], "match": "exact", "similarity": 1.0}
+            candidates = [(key, entry) for key, entry in self._entries.items() if key[0] == scope and self._live(entry, version, now)]
+        if candidates:
+            query = self._query_vector(normalized)
+            similarities = np.stack([entry["vector"] for _, entry in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity:
+                key, entry = candidates[best]
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.similar_hits += 1
+                return {"answer": entry["answer"], "match": "similar", "similarity": round(float(similarities[best]), 3)}
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, scope, version, question, answer):
+        normalized = normalize_question(question)
+        vector = self._query_vector(normalized)
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if (_directory(key[0]) == _directory(scope) and entry["version"] != version) or now - entry["created_at"] >= self.ttl_seconds]:
+                del self._entries[key]              # Answers of an older knowledge base version / expired
+            self._entries.pop((scope, normalized), None)
+            self._entries[(scope, normalized)] = {"version": version, "answer": answer, "vector": vector, "created_at": now}
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Knowledge base changed (upload/removal): every answer of the index directory dropped (all file scopes)
+    def invalidate(self, directory):
+        with self._lock:
+            for key in [key for key in self._entries if _directory(key[0]) == directory]:
+                del self._entries[key]
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+# Shared cache built from the environment (RAGIFY_ANSWER_CACHE_ENTRIES=0 disables it -> None)
+def get_answer_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_entries = int(os.getenv("RAGIFY_ANSWER_CACHE_ENTRIES", DEFAULT_ANSWER_CACHE_ENTRIES))
+                if max_entries <= 0:
+                    return None
+                _cache = AnswerCache(
+                    get_embedding_engine(), max_entries,
+                    float(os.getenv("RAGIFY_ANSWER_CACHE_TTL", DEFAULT_ANSWER_CACHE_TTL)),
+                    float(os.getenv("RAGIFY_ANSWER_CACHE_SIMILARITY", DEFAULT_ANSWER_CACHE_SIMILARITY))
+                )
+                register_gauges("answer_cache", _cache.get_stats)
+    return _cache
+
+# Cache key of a question asked on a user's saved index: (scope = (index directory, files searched), version = content
+# version of the index, unchanged by compaction). None for questions that depend on the conversation (chat_history
+# not empty and the question rewritten with the previous one: "and its price?") and for indexes not saved (guests)
+def get_answer_cache_key(user_faiss_dir_path, vectorstore, question, file_ids=None, chat_history=None):
+    from answer_modes import depends_on_history
+
+    manifest = getattr(vectorstore, "manifest", None)
+    if manifest is None or depends_on_history(question, chat_history):
+        return None
+    return (user_faiss_dir_path, tuple(sorted(file_ids or ()))), manifest.get("content_version", manifest["generation"])
+
+def invalidate_cached_answers(user_faiss_dir_path):
+    if _cache is not None:
+        _cache.invalidate(user_faiss_dir_path)
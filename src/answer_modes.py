@@ -0,0 +1,111 @@
+import os
+import re
+import time
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import CallbackManagerForChainRun
+
+from metrics import observe
+
+# How a follow-up question is turned into the retrieval query:
+#   condense     -> llama3 rewrites it into a standalone question (2 LLM calls per turn)
+#   small_model  -> same rewrite done by a smaller model (RAGIFY_CONDENSE_MODEL)
+#   last_turn    -> retrieval on the previous question + the raw question (1 LLM call)
+#   rule_rewrite -> previous question prepended only when the question looks like a follow-up (1 LLM call)
+# The answer LLM gets the conversation history + the question (the rewritten one in the LLM modes)
+ANSWER_MODES = ("condense", "small_model", "last_turn", "rule_rewrite")
+DEFAULT_ANSWER_MODE = "condense"
+DEFAULT_CONDENSE_MODEL = "llama3.2:1b"
+LLM_ANSWER_MODES = ("condense", "small_model")              # Modes with a rewrite LLM call
+
+# Words of a question referring to the previous turn ("what about its price?", "and the second one?")
+_FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "his", "her",
+    "there", "one", "ones", "above", "previous", "same", "former", "latter", "also", "else", "more",
+}
+_SHORT_QUESTION_WORDS = 4
+
+def get_answer_mode():
+    answer_mode = os.getenv("RAGIFY_ANSWER_MODE", DEFAULT_ANSWER_MODE)
+    return answer_mode if answer_mode in ANSWER_MODES else DEFAULT_ANSWER_MODE
+
+def get_condense_model(answer_mode):
+    return os.getenv("RAGIFY_CONDENSE_MODEL", DEFAULT_CONDENSE_MODEL) if answer_mode == "small_model" else "llama3"
+
+def _previous_question(chat_history):
+    for message in reversed(chat_history or []):
+        if isinstance(message, tuple):              # (human, ai) pairs
+            return message[0]
+        if getattr(message, "type", None) == "human":
+            return message.content
+    return None
+
+# Question referring to the previous turn (meaningless without the conversation)
+def refers_to_previous_turn(question):
+    return bool(_FOLLOW_UP_WORDS.intersection(re.findall(r"\w+", question.lower())))
+
+def rule_rewrite(question, previous_question):
+    short_question = len(re.findall(r"\w+", question)) <= _SHORT_QUESTION_WORDS
+    if previous_question and (short_question or refers_to_previous_turn(question)):
+        return f"{previous_question}\n{question}"
+    return question
+
+# Question whose answer depends on the conversation so far (messages or (question, answer) pairs): there is one
+# and rule_rewrite would prepend its last question (a standalone "what is this contract about?" opening a chat does not)
+def depends_on_history(question, chat_history):
+    return rule_rewrite(question, _previous_question(chat_history)) != question
+
+# ConversationalRetrievalChain whose condense step depends on answer_mode; output["timings"] = seconds per stage
+class TimedConversationalRetrievalChain(ConversationalRetrievalChain):
+    answer_mode: str = DEFAULT_ANSWER_MODE
+
+    @property
+    def output_keys(self):
+        return super().output_keys + ["timings"]
+
+    def _retrieval_query(self, question, chat_history, chat_history_str, run_manager):
+        if not chat_history_str:
+            return question
+        if self.answer_mode in LLM_ANSWER_MODES:
+            return self.question_generator.run(question=question, chat_history=chat_history_str, callbacks=run_manager.get_child())
+        previous_question = _previous_question(chat_history)
+        if self.answer_mode == "last_turn":
+            return f"{previous_question}\n{question}" if previous_question else question
+        return rule_rewrite(question, previous_question)
+
+    def _call(self, inputs, run_manager=None):
+        run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        timings = {"mode": self.answer_mode}
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+
+        t0 = time.perf_counter()
+        retrieval_query = self._retrieval_query(question, inputs["chat_history"], chat_history_str, run_manager)
+        timings["condense"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        docs = self._get_docs(retrieval_query, inputs, run_manager=run_manager)
+        timings["retrieval"] = time.perf_counter() - t0
+
+        output = {}
+        t0 = time.perf_counter()
+        if self.response_if_no_docs_found is not None and len(docs) == 0:
+            output[self.output_key] = self.response_if_no_docs_found
+        else:
+            new_inputs = inputs.copy()
+            if self.rephrase_question and self.answer_mode in LLM_ANSWER_MODES:
+                new_inputs["question"] = retrieval_query
+            new_inputs["chat_history"] = chat_history_str
+            output[self.output_key] = self.combine_docs_chain.run(input_documents=docs, callbacks=run_manager.get_child(), **new_inputs)
+        timings["generation"] = time.perf_counter() - t0
+
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = retrieval_query
+        output["timings"] = timings
+        for stage in ("condense", "retrieval", "generation"):
+            observe(stage, timings[stage])
+        return output
@@ -0,0 +1,138 @@
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import LLM_TAG_PREFIX, count, observe
+
+ANSWER_LLM_TAG = "ragify_answer"            # Tag of the LLM writing the answer (the question rephrasing LLM is not streamed)
+_RECENT_ANSWERS = 1000                      # Answers kept for the latency percentiles
+_DONE = object()
+
+_latencies = deque(maxlen=_RECENT_ANSWERS)  # {"mode", "time_to_first_token", "total_time", "condense", "retrieval", "generation"} (seconds), process-wide
+_latencies_lock = threading.Lock()
+_STAGES = ("time_to_first_token", "total_time", "condense", "retrieval", "generation")
+
+# Forwards the tokens of the answer LLM to a queue (read by the Streamlit script thread)
+class _AnswerTokenHandler(BaseCallbackHandler):
+    def __init__(self, token_queue):
+        self._queue = token_queue
+
+    def on_llm_new_token(self, token, *, tags=None, **kwargs):
+        if token and ANSWER_LLM_TAG in (tags or []):
+            self._queue.put(token)
+
+# LLM calls (duration, time to first token, tokens reported by Ollama) -> stage "llm_<tag>" (see metrics.LLM_TAG_PREFIX)
+class LLMMetricsHandler(BaseCallbackHandler):
+    def __init__(self):
+        self._runs = {}                     # run_id -> {"stage", "model", "started", "first_token"}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, tags, metadata, kwargs):
+        name = next((tag[len(LLM_TAG_PREFIX):] for tag in tags or [] if tag.startswith(LLM_TAG_PREFIX)), "other")
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("invocation_params", {}).get("model", "unknown")
+        with self._lock:
+            self._runs[run_id] = {"stage": f"llm_{name}", "model": model, "started": time.perf_counter(), "first_token": None}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, tags, metadata, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, tags, metadata, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run["first_token"] is not None:
+                return
+            run["first_token"] = time.perf_counter() - run["started"]
+        observe(f"{run['stage']}_first_token", run["first_token"])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        observe(run["stage"], time.perf_counter() - run["started"])
+        generation_info = {}
+        if response.generations and response.generations[0]:
+            generation_info = response.generations[0][0].generation_info or {}
+        count("llm_tokens", generation_info.get("prompt_eval_count") or 0, model=run["model"], type="prompt")
+        count("llm_tokens", generation_info.get("eval_count") or 0, model=run["model"], type="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            count("llm_errors", stage=run["stage"])
+
+llm_metrics_handler = LLMMetricsHandler()          # Shared by every LLM of the app (stateless between calls)
+
+# Runs the conversation chain in a worker thread and yields the answer tokens as Ollama generates them
+# After the iteration: .response = chain output (as conversation({'question': ...})), .time_to_first_token / .total_time in seconds
+# and .latency = both + the time per stage of the chain (response["timings"], see answer_modes.py)
+class StreamedAnswer:
+    def __init__(self, conversation, question):
+        self.conversation = conversation
+        self.question = question
+        self.response = None
+        self.time_to_first_token = None
+        self.total_time = None
+        self.latency = None
+        self._queue = queue.Queue()
+        self._error = None
+
+    def _run(self):
+        try:
+            self.response = self.conversation({'question': self.question}, callbacks=[_AnswerTokenHandler(self._queue)])
+        except Exception as e:
+            self._error = e
+        finally:
+            self._queue.put(_DONE)
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        # Started with the caller's context: LLM/retrieval timings are attached to its metrics trace
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), name="answer-stream", daemon=True)
+        worker.start()
+        while True:
+            token = self._queue.get()
+            if token is _DONE:
+                break
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - t0         # Retrieval + question rephrasing included
+            yield token
+        worker.join()
+        if self._error is not None:
+            raise self._error
+        self.total_time = time.perf_counter() - t0
+        if self.time_to_first_token is None:           # Nothing streamed (LLM without token callbacks)
+            self.time_to_first_token = self.total_time
+        self.latency = dict(self.response.get("timings", {}), time_to_first_token=self.time_to_first_token, total_time=self.total_time)
+        with _latencies_lock:
+            _latencies.append(self.latency)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def _summarize(latencies):
+    summary = {"answers": len(latencies)}
+    for stage in _STAGES:
+        values = [latency[stage] for latency in latencies if stage in latency]
+        if values:
+            summary[f"{stage}_p50"] = round(_percentile(values, 0.5), 3)
+            summary[f"{stage}_p95"] = round(_percentile(values, 0.95), 3)
+    return summary
+
+# Answer latency over the recent answers of this process (seconds), overall and per answer mode
+def get_answer_stats():
+    with _latencies_lock:
+        latencies = list(_latencies)
+    stats = _summarize(latencies)
+    modes = sorted({latency["mode"] for latency in latencies if "mode" in latency})
+    stats["by_mode"] = {mode: _summarize([latency for latency in latencies if latency.get("mode") == mode]) for mode in modes}
+    return stats
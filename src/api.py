@@ -0,0 +1,354 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from aiohttp import web
+from dotenv import load_dotenv
+from werkzeug.security import check_password_hash
+
+import database
+from index_cache import FAISS_INDEX_NAME
+from ingestion_jobs import get_ingestion_runner
+from metrics import count, observe, start_metrics_server, trace
+from utils import clear_user_vectorstore, get_conversation_chain, get_vectorstore, remove_file_vectors, set_retrieval_files
+
+# Headless HTTP API (asyncio) over the same database/utils functions as the Streamlit app:
+#   python src/api.py [--host 127.0.0.1] [--port 8600]
+#   POST /login {"username", "password"} -> {"token"}, then "Authorization: Bearer <token>" on every call; POST /logout
+#   POST /ask {"question", "file_ids", "answer_mode", "stream"} -> {"answer", "cached", "latency", "turn_id"}
+#        (stream: NDJSON lines {"token"} as Ollama generates them, then the answer line)
+#   GET /files, DELETE /files/{id}, POST /files (multipart, "files" fields) -> {"job_id"}, GET /jobs/{id}
+#   GET /health
+# Shared by every client: the embedding engine, the index cache (one copy of a user's index) and the answer cache.
+# Conversation chains (-> Ollama) run in a bounded pool: at most RAGIFY_API_LLM_CONCURRENCY at once, other
+# questions wait for a slot up to RAGIFY_API_QUEUE_TIMEOUT seconds (then 503)
+DEFAULT_API_HOST = "127.0.0.1"
+DEFAULT_API_PORT = 8600
+DEFAULT_LLM_CONCURRENCY = 4
+DEFAULT_QUEUE_TIMEOUT = 60                  # Seconds
+DEFAULT_TOKEN_TTL_HOURS = 24 * 7
+DEFAULT_MAX_UPLOAD_MB = 200                 # Per upload request
+_UPLOAD_CHUNK_BYTES = 1024 * 1024
+_UPLOAD_MEMORY_BYTES = 8 * 1024 * 1024      # Larger uploaded files are buffered on disk until spooled by the job runner
+_PUBLIC_PATHS = ("/login", "/health")
+
+_LLM_SLOTS = web.AppKey("llm_slots", asyncio.Semaphore)
+_LLM_EXECUTOR = web.AppKey("llm_executor", ThreadPoolExecutor)
+_INGESTION_RUNNER = web.AppKey("ingestion_runner", object)
+_SETTINGS = web.AppKey("settings", dict)
+
+def _error(status, message):
+    return status(text=json.dumps({"error": message}), content_type="application/json")
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+# Blocking call (DB, index, LLM) in a worker thread, with the caller's context (metrics trace)
+async def _in_thread(executor, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(contextvars.copy_context().run, func, *args))
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise _error(web.HTTPBadRequest, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise _error(web.HTTPBadRequest, "Body must be a JSON object")
+    return body
+
+# st_feedback_obj of get_vectorstore: errors become HTTP 500 (the UI falls back to a new, empty index instead)
+class _Feedback:
+    def error(self, message):
+        raise _error(web.HTTPInternalServerError, message)
+
+def _get_user_vectorstore(user_id, for_update=False):
+    return get_vectorstore(
+        user_id=user_id, db_get_user_faiss_path_func=database.get_user_faiss_path, faiss_index_name_const=FAISS_INDEX_NAME,
+        session_state=SimpleNamespace(vectorstore_loaded_for_user=False), st_feedback_obj=_Feedback(), for_update=for_update
+    )
+
+@web.middleware
+async def auth_middleware(request, handler):
+    if request.path in _PUBLIC_PATHS:
+        return await handler(request)
+    authorization = request.headers.get("Authorization", "")
+    token = authorization[len("Bearer "):].strip() if authorization.startswith("Bearer ") else ""
+    user_id = None
+    if token:
+        user_id = await _in_thread(None, database.get_api_token_user, _hash_token(token), request.app[_SETTINGS]["token_ttl_hours"])
+    if user_id is None:
+        raise _error(web.HTTPUnauthorized, "Missing, invalid or expired token")
+    request["user_id"] = user_id
+    request["token_hash"] = _hash_token(token)
+    return await handler(request)
+
+# Login
+def _check_login(username, password):
+    user = database.get_user(username)
+    return user if user and check_password_hash(user["password_hash"], password) else None
+
+async def login(request):
+    body = await _json_body(request)
+    user = await _in_thread(None, _check_login, str(body.get("username") or ""), str(body.get("password") or ""))
+    if user is None:
+        raise _error(web.HTTPUnauthorized, "Invalid username or password")
+    token = secrets.token_urlsafe(32)
+    await _in_thread(None, database.add_api_token, user["id"], _hash_token(token))
+    return web.json_response({"token": token, "user_id": user["id"], "expires_in_hours": request.app[_SETTINGS]["token_ttl_hours"]})
+
+async def logout(request):
+    await _in_thread(None, database.delete_api_token, request["token_hash"])
+    return web.json_response({"logged_out": True})
+
+async def health(request):
+    return web.json_response({"status": "ok", "llm_slots_busy": request.app[_LLM_SLOTS].locked()})
+
+# Questions
+async def _acquire_llm_slot(app):
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(app[_LLM_SLOTS].acquire(), app[_SETTINGS]["queue_timeout"])
+    except asyncio.TimeoutError:
+        count("api_rejected_questions")
+        raise _error(web.HTTPServiceUnavailable, "Too many questions in progress, retry later")
+    observe("llm_queue_wait", time.perf_counter() - t0)
+
+# Conversation chain of one question (memory loaded from the user's history), run on an acquired LLM slot
+# The slot is released when the chain finishes, even if the client went away meanwhile -> StreamedAnswer
+async def _generate(app, vectorstore, user_id, question, file_ids, answer_mode, on_token):
+    from answer_streaming import StreamedAnswer
+
+    def run():
+        conversation = get_conversation_chain(vectorstore, answer_mode=answer_mode, user_id=user_id)
+        set_retrieval_files(conversation, file_ids)
+        streamed_answer = StreamedAnswer(conversation, question)
+        for token in streamed_answer:
+            if on_token:
+                on_token(token)
+        return streamed_answer
+
+    future = asyncio.get_running_loop().run_in_executor(app[_LLM_EXECUTOR], functools.partial(contextvars.copy_context().run, run))
+    future.add_done_callback(lambda _: app[_LLM_SLOTS].release())
+    return await asyncio.shield(future)
+
+def _lookup_cached_answer(user_id, vectorstore, question, file_ids):
+    from answer_cache import get_answer_cache, get_answer_cache_key
+
+    answer_cache = get_answer_cache()
+    cache_key = None
+    if answer_cache:
+        last_turn = [(row["user_message"], row["ai_response"]) for row in database.load_chat_page(user_id, limit=1)]
+        cache_key = get_answer_cache_key(database.get_user_faiss_path(user_id), vectorstore, question, file_ids, last_turn)
+    cached = answer_cache.lookup(*cache_key, question) if cache_key else None
+    count("answer_cache_lookups", result="hit" if cached else "miss" if cache_key else "bypass")
+    return cached, cache_key
+
+def _store_answer(cache_key, question, answer):
+    from answer_cache import get_answer_cache
+
+    if cache_key:
+        get_answer_cache().store(*cache_key, question, answer)
+
+def _parse_file_ids(value):
+    if value in (None, []):
+        return None
+    if not isinstance(value, list) or not all(isinstance(file_id, int) for file_id in value):
+        raise _error(web.HTTPBadRequest, "file_ids must be a list of file IDs")
+    return value
+
+async def ask(request):
+    body = await _json_body(request)
+    question = str(body.get("question") or "").strip()
+    if not question:
+        raise _error(web.HTTPBadRequest, "Missing question")
+    file_ids = _parse_file_ids(body.get("file_ids"))
+    user_id = request["user_id"]
+
+    with trace("question", user="api") as request_trace:
+        t0 = time.perf_counter()
+        vectorstore = await _in_thread(None, _get_user_vectorstore, user_id)
+        if vectorstore is None:
+            raise _error(web.HTTPConflict, "No documents processed yet: upload files first")
+        cached, cache_key = await _in_thread(None, _lookup_cached_answer, user_id, vectorstore, question, file_ids)
+
+        response = None
+        if cached:              # Same (or near-duplicate) question already answered on this knowledge base version
+            answer = cached["answer"]
+            elapsed = time.perf_counter() - t0
+            latency = {"mode": "cache", "cached": cached["match"], "time_to_first_token": elapsed, "total_time": elapsed}
+        else:
+            await _acquire_llm_slot(request.app)
+            generation_args = (request.app, vectorstore, user_id, question, file_ids, body.get("answer_mode"))
+            if body.get("stream"):
+                response, streamed_answer = await _stream_tokens(request, generation_args)
+                if streamed_answer is None:
+                    return response
+            else:
+                try:
+                    streamed_answer = await _generate(*generation_args, None)
+                except Exception as e:
+                    raise _error(web.HTTPBadGateway, f"Answer generation failed: {e}")
+            answer, latency = streamed_answer.response["answer"], streamed_answer.latency
+            await _in_thread(None, _store_answer, cache_key, question, answer)
+
+        turn_id = await _in_thread(None, database.save_chat_message, user_id, question, answer)
+        request_trace.labels["mode"] = latency.get("mode", "unknown")
+        observe("time_to_first_token", latency["time_to_first_token"])
+
+    result = {"answer": answer, "cached": cached["match"] if cached else None, "latency": latency, "turn_id": turn_id}
+    if response is None:
+        return web.json_response(result)
+    await response.write((json.dumps(result) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+# NDJSON response: one {"token"} line per generated token -> (response, StreamedAnswer or None after an error line)
+async def _stream_tokens(request, generation_args):
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    generation = asyncio.ensure_future(_generate(*generation_args, lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token)))
+    generation.add_done_callback(lambda _: tokens.put_nowait(None))
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    while (token := await tokens.get()) is not None:
+        await response.write((json.dumps({"token": token}) + "\n").encode("utf-8"))
+    try:
+        return response, await generation
+    except Exception as e:              # Status already sent -> error reported in the stream
+        await response.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response, None
+
+# Files
+async def list_files(request):
+    rows = await _in_thread(None, database.get_user_files, request["user_id"])
+    return web.json_response({"files": [{"id": row["id"], "filename": row["filename"], "processed_at": row["processed_at"]} for row in rows]})
+
+# Removes one file's vectors from the user's index (whole index cleared if built before vectors were linked to files)
+def _remove_file(runner, user_id, file_id):
+    with runner.user_lock(user_id):             # No ingestion job of this user running meanwhile
+        if file_id not in {row["id"] for row in database.get_user_files(user_id)}:
+            return None
+        vector_ids = database.get_file_vector_ids(file_id)
+        tracked_vectors = database.count_user_vectors(user_id)
+        database.delete_user_file(file_id)
+        user_faiss_dir_path = database.get_user_faiss_path(user_id)
+        vectorstore = _get_user_vectorstore(user_id, for_update=True)           # Private copy of the saved index
+        if vectorstore is not None and vectorstore.count_vectors() <= tracked_vectors:
+            remove_file_vectors(vectorstore, vector_ids, user_faiss_dir_path, FAISS_INDEX_NAME)
+            return {"deleted": True, "cleared": False}
+        if vectorstore is not None:
+            clear_user_vectorstore(user_faiss_dir_path, FAISS_INDEX_NAME)
+        return {"deleted": True, "cleared": vectorstore is not None}
+
+async def delete_file(request):
+    try:
+        file_id = int(request.match_info["file_id"])
+    except ValueError:
+        raise _error(web.HTTPBadRequest, "Invalid file ID")
+    result = await _in_thread(None, _remove_file, request.app[_INGESTION_RUNNER], request["user_id"], file_id)
+    if result is None:
+        raise _error(web.HTTPNotFound, "File not found")
+    return web.json_response(result)
+
+# Uploaded file buffered by the API (same interface as Streamlit's UploadedFile for IngestionJobRunner.submit)
+class _UploadedFile:
+    def __init__(self, name, buffer):
+        self.name = name
+        self._buffer = buffer
+
+    def read(self, size=-1):
+        return self._buffer.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._buffer.seek(offset, whence)
+
+    def close(self):
+        self._buffer.close()
+
+async def upload_files(request):
+    if not request.content_type.startswith("multipart/"):
+        raise _error(web.HTTPBadRequest, "Expected a multipart/form-data body")
+    reader = await request.multipart()
+    max_bytes = request.app[_SETTINGS]["max_upload_bytes"]
+    files, total_bytes = [], 0
+    try:
+        while (part := await reader.next()) is not None:
+            if part.name != "files" or not part.filename:
+                continue
+            buffer = tempfile.SpooledTemporaryFile(max_size=_UPLOAD_MEMORY_BYTES)
+            files.append(_UploadedFile(os.path.basename(part.filename), buffer))
+            while chunk := await part.read_chunk(_UPLOAD_CHUNK_BYTES):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise _error(web.HTTPRequestEntityTooLarge, f"Upload larger than {max_bytes // (1024 * 1024)} MB")
+                buffer.write(chunk)
+        if not files:
+            raise _error(web.HTTPBadRequest, "No files in the \"files\" field")
+        job_id = await _in_thread(None, request.app[_INGESTION_RUNNER].submit, request["user_id"], files)
+    finally:
+        for file in files:
+            file.close()
+    return web.json_response({"job_id": job_id, "files": [file.name for file in files]}, status=202)
+
+async def get_job(request):
+    try:
+        job_id = int(request.match_info["job_id"])
+    except ValueError:
+        raise _error(web.HTTPBadRequest, "Invalid job ID")
+    job = await _in_thread(None, database.get_ingestion_job, job_id)
+    if job is None or job["user_id"] != request["user_id"]:
+        raise _error(web.HTTPNotFound, "Job not found")
+    job_files = await _in_thread(None, database.get_ingestion_job_files, job_id)
+    result = {key: job[key] for key in ("id", "status", "progress", "message", "error", "created_at", "started_at", "finished_at")}
+    result["files"] = [{key: job_file[key] for key in ("filename", "status", "chunks", "error")} for job_file in job_files]
+    return web.json_response(result)
+
+async def _shutdown(app):
+    app[_LLM_EXECUTOR].shutdown(wait=False)
+
+def create_app(ingestion_runner=None):
+    concurrency = max(1, int(os.getenv("RAGIFY_API_LLM_CONCURRENCY", DEFAULT_LLM_CONCURRENCY)))
+    app = web.Application(middlewares=[auth_middleware])
+    app[_SETTINGS] = {
+        "queue_timeout": float(os.getenv("RAGIFY_API_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+        "token_ttl_hours": float(os.getenv("RAGIFY_API_TOKEN_TTL_HOURS", DEFAULT_TOKEN_TTL_HOURS)),
+        "max_upload_bytes": int(float(os.getenv("RAGIFY_API_MAX_UPLOAD_MB", DEFAULT_MAX_UPLOAD_MB)) * 1024 * 1024),
+    }
+    app[_LLM_SLOTS] = asyncio.Semaphore(concurrency)
+    app[_LLM_EXECUTOR] = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="api-llm")
+    app[_INGESTION_RUNNER] = ingestion_runner or get_ingestion_runner(FAISS_INDEX_NAME)
+    app.router.add_post("/login", login)
+    app.router.add_post("/logout", logout)
+    app.router.add_get("/health", health)
+    app.router.add_post("/ask", ask)
+    app.router.add_get("/files", list_files)
+    app.router.add_post("/files", upload_files)
+    app.router.add_delete("/files/{file_id}", delete_file)
+    app.router.add_get("/jobs/{job_id}", get_job)
+    app.on_cleanup.append(_shutdown)
+    return app
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="RAGIFY HTTP API (login, ask, upload/list/delete files)")
+    parser.add_argument("--host", default=os.getenv("RAGIFY_API_HOST", DEFAULT_API_HOST))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RAGIFY_API_PORT", DEFAULT_API_PORT)))
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    start_metrics_server()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
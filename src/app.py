@@ -1,16 +1,25 @@
 import streamlit as st
 from dotenv import load_dotenv
-import os
-from datetime import datetime
 
-from langchain_core.messages import HumanMessage, AIMessage
-
-from html_templates import css, user_template, bot_template
+from html_templates import css
 import database
-from utils import extract_text_from_files, get_text_chunks, get_conversation_chain, get_vectorstore
-from ui_handlers import display_auth_ui, handle_user_input, display_uploaded_files_ui, handle_file_removal_logic
-
-FAISS_INDEX_NAME = "index"          # FAISS index (Const)
+from utils import extract_text_per_file, report_extraction_error, get_file_chunks, get_conversation_chain, get_vectorstore
+from ingestion import should_stream, ingest_files_streaming
+from ingestion_jobs import get_ingestion_runner
+from index_cache import FAISS_INDEX_NAME
+from ui_handlers import (display_auth_ui, handle_user_input, display_uploaded_files_ui, handle_file_removal_logic, display_ingestion_jobs_ui,
+                         display_chat_history, load_recent_chat_history, display_file_scope_ui, display_metrics_panel)
+from metrics import start_metrics_server
+
+# Reloads the user's knowledge (new index version) keeping the current chat history
+def reload_user_knowledge(user_id):
+    vectorstore = get_vectorstore(
+        user_id=user_id, db_get_user_faiss_path_func=database.get_user_faiss_path,
+        faiss_index_name_const=FAISS_INDEX_NAME, session_state=st.session_state, st_feedback_obj=st
+    )
+    if vectorstore:
+        st.session_state.conversation = get_conversation_chain(vectorstore, initial_chat_history=st.session_state.chat_history, user_id=user_id)
+        st.session_state.vectorstore_loaded_for_user = True
 
 def main():
     load_dotenv()
@@ -22,19 +31,18 @@ def main():
     if "chat_history" not in st.session_state: st.session_state.chat_history = []
     if "vectorstore_loaded_for_user" not in st.session_state: st.session_state.vectorstore_loaded_for_user = False
     if "processed_files_session" not in st.session_state: st.session_state.processed_files_session = []
+    if "watched_ingestion_jobs" not in st.session_state: st.session_state.watched_ingestion_jobs = []
+
+    database.init_db()                              # Tables + data directory (once per process, not at import time)
+    get_ingestion_runner(FAISS_INDEX_NAME)          # Worker pool (resumes jobs interrupted by a restart)
+    start_metrics_server()                          # Prometheus /metrics endpoint (RAGIFY_METRICS_PORT)
 
     display_auth_ui()           # Sign UP/Login Sidear -> ui_handlers
 
     if st.session_state.get("logged_in_user_id") and (st.session_state.conversation is None or not st.session_state.vectorstore_loaded_for_user):
         with st.spinner("Carregando dados do usuário..."):
             user_id = st.session_state.logged_in_user_id
-            loaded_chat_history_messages = []
-            db_history_tuples = database.load_chat_history(user_id)
-            if db_history_tuples:
-                for u_msg, ai_msg in db_history_tuples:
-                    if u_msg: loaded_chat_history_messages.append(HumanMessage(content=u_msg))
-                    if ai_msg: loaded_chat_history_messages.append(AIMessage(content=ai_msg))
-            st.session_state.chat_history = loaded_chat_history_messages 
+            load_recent_chat_history(user_id)              # Last page only ("Load older messages" for the rest)
 
             # VectorStore usage
             vectorstore = get_vectorstore(
@@ -42,7 +50,7 @@ def main():
                 faiss_index_name_const=FAISS_INDEX_NAME, session_state=st.session_state, st_feedback_obj=st
             )
             if vectorstore:
-                st.session_state.conversation = get_conversation_chain(vectorstore, initial_chat_history=st.session_state.chat_history)
+                st.session_state.conversation = get_conversation_chain(vectorstore, initial_chat_history=st.session_state.chat_history, user_id=user_id)
                 
                 if not st.session_state.vectorstore_loaded_for_user : 
                      st.success("Conhecimento anterior carregado. Pronto para conversar!")
@@ -55,20 +63,19 @@ def main():
     # IF chat_history
     if st.session_state.chat_history:
         st.subheader("Chat History:")
-        # Shows chat history, using template (html_templates.py)
-        for i, message in enumerate(st.session_state.chat_history):
-            msg_content = getattr(message, 'content', str(message))
-            timestamp = datetime.now().strftime("%H:%M")            # -> Current time
-
-            if isinstance(message, HumanMessage) or (i % 2 == 0 and not isinstance(message, AIMessage)):            # USER message
-                st.write(user_template.replace("{{MSG}}", msg_content).replace("{{MSG_ID}}", f"user_{i}")
-                        .replace("{{TIMESTAMP}}", timestamp), unsafe_allow_html=True)
-            elif isinstance(message, AIMessage) or (i % 2 != 0):                                                    # LLM message
-                st.write(bot_template.replace("{{MSG}}", msg_content).replace("{{MSG_ID}}", f"bot_{i}")
-                        .replace("{{TIMESTAMP}}", timestamp), unsafe_allow_html=True)
+        display_chat_history()          # Shows chat history, using template (html_templates.py)
+        if st.session_state.get("last_answer_latency"):
+            latency = st.session_state.last_answer_latency
+            if latency.get("cached"):
+                st.caption(f"Last answer: from the answer cache ({latency['cached']} question) in {latency['total_time'] * 1000:.0f} ms")
+            else:
+                stages = ", ".join(f"{stage} {latency[stage]:.2f}s" for stage in ("condense", "retrieval", "generation") if stage in latency)
+                st.caption(f"Last answer: first token after {latency['time_to_first_token']:.2f}s, complete after {latency['total_time']:.2f}s"
+                           + (f" ({latency.get('mode')} mode: {stages})" if stages else ""))
         st.markdown("---")
 
     # User Input
+    question_file_ids = display_file_scope_ui()            # Optional restriction to some of the user's files
     with st.form(key="chat_input_form", clear_on_submit=True):
         user_question_typed = st.text_input("Ask a question about your documents:", key="user_question_input_field")
         submitted = st.form_submit_button("Send")
@@ -80,7 +87,8 @@ def main():
                 handle_user_input(
                     user_question_typed,
                     get_conversation_chain_func=get_conversation_chain,
-                    save_chat_message_func=database.save_chat_message
+                    save_chat_message_func=database.save_chat_message,
+                    file_ids=question_file_ids
                 )
             st.rerun() 
         else:
@@ -101,9 +109,13 @@ def main():
         # Processing of new files
         if st.button("Process Files 📂", key="process_button"):
             if pdf_docs:
-                with st.spinner("Processing Files... ⚙️"):
-                    current_user_id = st.session_state.get("logged_in_user_id")
-                    if not current_user_id:
+                current_user_id = st.session_state.get("logged_in_user_id")
+                if current_user_id:         # Background job (the chat keeps working on the current knowledge meanwhile)
+                    job_id = get_ingestion_runner(FAISS_INDEX_NAME).submit(current_user_id, pdf_docs)
+                    st.session_state.watched_ingestion_jobs.append(job_id)
+                    st.success("Files queued for processing. You can keep chatting meanwhile!")
+                else:
+                    with st.spinner("Processing Files... ⚙️"):
                         st.session_state.processed_files_session = [] 
                         for doc in pdf_docs:
                             doc_bytes = doc.getvalue() 
@@ -111,73 +123,57 @@ def main():
                                 {'name': doc.name, 'id': doc.name, 'bytes': doc_bytes}
                             )
                             doc.seek(0)
-                    
-                    raw_text = extract_text_from_files(pdf_docs)
-                    text_chunks = []
-
-                    if not raw_text or not raw_text.strip():
-                        st.warning("No text extracted from the files. Check the formats or content.")            # File format no supported
-                    else:
-                        text_chunks = get_text_chunks(raw_text)
-
-                    # VectorStore usage                                  
-                    vectorstore = get_vectorstore(
-                        text_chunks=text_chunks if text_chunks else None, 
-                        user_id=current_user_id,
-                        db_get_user_faiss_path_func=database.get_user_faiss_path,
-                        faiss_index_name_const=FAISS_INDEX_NAME,
-                        session_state=st.session_state,
-                        st_feedback_obj=st
-                    )
-
-                    if vectorstore: 
-                        chat_hist_for_chain = [] 
-                        if current_user_id: 
-                            db_history_tuples = database.load_chat_history(current_user_id)         # conversation_chain fetching chat history
-                            if db_history_tuples:
-                                for u_msg, ai_msg in db_history_tuples:
-                                    if u_msg: chat_hist_for_chain.append(HumanMessage(content=u_msg))           # USER messages
-                                    if ai_msg: chat_hist_for_chain.append(AIMessage(content=ai_msg))            # LLM messages
-                        st.session_state.chat_history = chat_hist_for_chain
-                        
-                        st.session_state.conversation = get_conversation_chain(
-                            vectorstore, initial_chat_history=st.session_state.chat_history
-                        )
-                        st.session_state.vectorstore_loaded_for_user = True
-                        
-                        if current_user_id:
-                            user_faiss_dir_path = database.get_user_faiss_path(current_user_id)
-                            # Add it to DB
-                            for doc in pdf_docs: 
-                                database.add_user_file_record(current_user_id, doc.name, user_faiss_dir_path)
-                            st.success("Files processed and knowledge saved/updated!")
+
+                        if should_stream(pdf_docs):          # Large files -> streamed into the index in bounded batches
+                            progress_bar = st.progress(0.0, text="Streaming files...")
+                            vectorstore, chunk_ids_by_file = ingest_files_streaming(
+                                pdf_docs, on_progress=progress_bar.progress, on_error=report_extraction_error
+                            )
+                            has_new_chunks = any(chunk_ids_by_file.values())
                         else:
+                            # Chunking per file (source/page/sheet metadata in every chunk)
+                            text_chunks, chunk_metadatas = [], []
+                            for file_result in extract_text_per_file(pdf_docs):
+                                file_chunks, file_chunk_metadatas = get_file_chunks(file_result["segments"], file_result["name"])
+                                text_chunks.extend(file_chunks)
+                                chunk_metadatas.extend(file_chunk_metadatas)
+                            has_new_chunks = bool(text_chunks)
+
+                            # VectorStore usage                                  
+                            vectorstore = get_vectorstore(
+                                text_chunks=text_chunks if text_chunks else None, 
+                                user_id=None,
+                                chunk_metadatas=chunk_metadatas
+                            )
+                        if not has_new_chunks:
+                            st.warning("No text extracted from the files. Check the formats or content.")            # File format no supported
+
+                        if vectorstore: 
+                            st.session_state.chat_history = []
+                            st.session_state.conversation = get_conversation_chain(vectorstore, initial_chat_history=[])
+                            st.session_state.vectorstore_loaded_for_user = True
                             st.success("Files processed for this session!")
-                        st.rerun()
-                    elif current_user_id and not text_chunks and \
-                         not (database.get_user_faiss_path(current_user_id) and \
-                              os.path.exists(os.path.join(database.get_user_faiss_path(current_user_id), f"{FAISS_INDEX_NAME}.faiss"))):
-                         st.warning("No text processed from the files and no previous knowledge found.")
-                         st.session_state.conversation = None 
-                         st.session_state.vectorstore_loaded_for_user = False
-                    elif current_user_id and not text_chunks: 
-                        st.info("No new files processed. Previous knowledge (if any) is active.")
-                    else: 
-                        if not current_user_id and not text_chunks:                     # User logged in without text (edge-case)
-                             st.warning("No text available for this session.")
-                        else:
-                            st.error("There was a failure creating or loading the vector knowledge base. Please try again later.")
-                        st.session_state.conversation = None
-                        st.session_state.vectorstore_loaded_for_user = False
+                            st.rerun()
+                        else: 
+                            if not has_new_chunks:
+                                 st.warning("No text available for this session.")
+                            else:
+                                st.error("There was a failure creating or loading the vector knowledge base. Please try again later.")
+                            st.session_state.conversation = None
+                            st.session_state.vectorstore_loaded_for_user = False
             else:
                 st.warning("Please upload at least one file.")
+
+        # Background ingestion jobs (progress; knowledge reloaded once they finish)
+        display_ingestion_jobs_ui(on_jobs_finished=lambda: reload_user_knowledge(st.session_state.logged_in_user_id))
+        display_metrics_panel()
         
         # UI to display uploaded files (using helper functions) -> Refactor ASAP! 
-        display_uploaded_files_ui(handle_file_removal_func=lambda file_id, file_name, source: handle_file_removal_logic(
-                file_id, file_name, source, FAISS_INDEX_NAME,
+        display_uploaded_files_ui(handle_file_removal_func=lambda file_id, file_name, source, faiss_index_name_const: handle_file_removal_logic(
+                file_id, file_name, source, faiss_index_name_const,
                 lambda **kwargs: get_vectorstore(
                     db_get_user_faiss_path_func=database.get_user_faiss_path,
-                    faiss_index_name_const=FAISS_INDEX_NAME,
+                    faiss_index_name_const=faiss_index_name_const,
                     session_state=st.session_state,
                     st_feedback_obj=st,
                     **kwargs
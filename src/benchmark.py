@@ -0,0 +1,504 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Offline end-to-end benchmark of the RAG pipeline (no model download, no Ollama needed):
+#   python src/benchmark.py --sizes 50,500 --files 2 [--compare previous_results.json]
+# Synthetic corpora in every supported format -> extraction, chunking, embedding, index build/load/search
+# and full handle_user_input turns, with a stub embedder and a local fake Ollama server standing in for the models
+# Results (throughput, p50/p95 latency, peak RSS) are written as JSON to compare runs over time
+FORMATS = ("pdf", "docx", "xlsx", "csv", "txt", "md")
+DEFAULT_SIZES_KB = (50, 500)                # Text per file
+DEFAULT_FILES_PER_FORMAT = 2
+DEFAULT_QUERIES = 200
+DEFAULT_TURNS = 10
+DEFAULT_LOAD_REPEATS = 5
+DEFAULT_ANSWER_TOKENS = 40                  # Fake Ollama answer length
+DEFAULT_TOKEN_DELAY = 0.0                   # Seconds between fake Ollama tokens (0: LLM time excluded)
+STUB_DIMENSION = 768                        # Same as nomic-embed-text-v1
+RESULTS_DIR = "benchmark_results"
+_INDEX_NAME = "index"
+_TURN_TIMEOUT = 120                         # Seconds
+_PDF_LINES_PER_PAGE = 60
+_PDF_LINE_CHARS = 90
+
+_WORDS = (
+    "contract invoice payment deadline supplier customer report revenue budget quarter policy employee "
+    "project delivery warranty clause amount tax order shipment product service support agreement renewal "
+    "meeting schedule risk audit compliance security access account balance forecast growth market region "
+    "sales cost margin target review approval request manager team office training document version release"
+).split()
+
+# Deterministic embedder: hashed bag of words (texts sharing words are close), no model to load
+class StubEmbeddings(Embeddings):
+    def __init__(self, dimension=STUB_DIMENSION):
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            word_hash = zlib.crc32(word.encode("utf-8"))
+            vector[word_hash % self.dimension] += 1.0 if word_hash & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+# Ollama API stand-in (/api/chat, /api/generate): every answer is answer_tokens words streamed as NDJSON
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._send_json({"models": [{"name": "llama3"}]})           # /api/tags
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        is_chat = self.path.rstrip("/").endswith("/chat")
+        tokens = [random.Random(server.requests).choice(_WORDS) + " " for _ in range(server.answer_tokens)]
+        if not request.get("stream", True):
+            self._send_json(self._message(request, "".join(tokens), is_chat, done=True))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")           # Tokens reach the client as they are written
+        self.end_headers()
+        for token in tokens:
+            if server.token_delay:
+                time.sleep(server.token_delay)
+            self._write_chunk(self._message(request, token, is_chat, done=False))
+        self._write_chunk(self._message(request, "", is_chat, done=True))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _message(self, request, text, is_chat, done):
+        message = {"model": request.get("model", "llama3"), "created_at": datetime.now().isoformat(), "done": done}
+        if is_chat:
+            message["message"] = {"role": "assistant", "content": text}
+        else:
+            message["response"] = text
+        if done:
+            prompt = json.dumps(request.get("messages") or request.get("prompt", ""))
+            message.update(done_reason="stop", prompt_eval_count=len(prompt.split()), eval_count=self.server.answer_tokens)
+        return message
+
+    def _write_chunk(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, message):
+        data = json.dumps(message).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class FakeOllamaServer:
+    def __init__(self, port=0, answer_tokens=DEFAULT_ANSWER_TOKENS, token_delay=DEFAULT_TOKEN_DELAY):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _FakeOllamaHandler)
+        self._server.daemon_threads = True
+        self._server.answer_tokens = answer_tokens
+        self._server.token_delay = token_delay
+        self._server.requests = 0
+        self._server.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# Synthetic corpus
+def _sentence(rng):
+    words = rng.choices(_WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+def _paragraphs(rng, target_bytes):
+    paragraphs, size = [], 0
+    while size < target_bytes:
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 1
+    return paragraphs
+
+def _rows(rng, target_bytes):
+    rows, size = [], 0
+    while size < target_bytes:
+        row = [len(rows) + 1, rng.choice(_WORDS).title(), _sentence(rng), round(rng.uniform(1, 10000), 2)]
+        rows.append(row)
+        size += sum(len(str(cell)) for cell in row) + 3
+    return rows
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+# Minimal PDF (Helvetica text pages) written by hand: PyPDF2 only reads PDFs
+def _make_pdf(paragraphs):
+    lines = []
+    for paragraph in paragraphs:
+        words, line = paragraph.split(), ""
+        for word in words:
+            if line and len(line) + 1 + len(word) > _PDF_LINE_CHARS:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for start in range(0, len(lines), _PDF_LINES_PER_PAGE):
+        content = "BT /F1 9 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines[start:start + _PDF_LINES_PER_PAGE]) + " ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    data, offsets = b"%PDF-1.4\n", []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref_offset = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return data
+
+def _make_docx(paragraphs):
+    from docx import Document
+    doc = Document()
+    for number, paragraph in enumerate(paragraphs):
+        if number % 10 == 0:
+            doc.add_heading(paragraph.split(".")[0][:60], level=2)
+        doc.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def _make_xlsx(rows):
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet("Data")
+    sheet.append(["id", "name", "description", "amount"])
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def _make_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["id", "name", "description", "amount"])
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+def _make_md(paragraphs):
+    parts = []
+    for number, paragraph in enumerate(paragraphs):
+        if number % 10 == 0:
+            parts.append("## " + paragraph.split(".")[0][:60])
+        if number % 7 == 3:
+            parts.append("\n".join("- " + sentence.strip() for sentence in paragraph.split(".") if sentence.strip()))
+        else:
+            parts.append(paragraph)
+    return "\n\n".join(parts).encode("utf-8")
+
+# [(file name, bytes)]: files_per_format files of ~size_kb KB of text in each format (same seed -> same corpus)
+def generate_corpus(size_kb, files_per_format=DEFAULT_FILES_PER_FORMAT, formats=FORMATS, seed=0):
+    rng = random.Random(seed)
+    target_bytes = int(size_kb * 1024)
+    files = []
+    for file_format in formats:
+        for number in range(files_per_format):
+            if file_format in ("xlsx", "csv"):
+                rows = _rows(rng, target_bytes)
+                data = _make_xlsx(rows) if file_format == "xlsx" else _make_csv(rows)
+            else:
+                paragraphs = _paragraphs(rng, target_bytes)
+                if file_format == "pdf":
+                    data = _make_pdf(paragraphs)
+                elif file_format == "docx":
+                    data = _make_docx(paragraphs)
+                elif file_format == "md":
+                    data = _make_md(paragraphs)
+                else:
+                    data = "\n\n".join(paragraphs).encode("utf-8")
+            files.append((f"bench_{size_kb}kb_{number}.{file_format}", data))
+    return files
+
+def generate_questions(count, seed=0):
+    rng = random.Random(seed + 1)
+    return [f"What does the {rng.choice(_WORDS)} {rng.choice(_WORDS)} say about the {rng.choice(_WORDS)} {rng.choice(_WORDS)}?"
+            for _ in range(count)]
+
+# Streamlit UploadedFile stand-in (.name + .getvalue())
+class _UploadedFile(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+# Measurements
+# Peak resident set size of this process so far (None where the resource module is missing, e.g. Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)          # Bytes on macOS, KB elsewhere
+
+def latency_stats(seconds):
+    if not seconds:
+        return {}
+    ms = np.array(seconds) * 1000
+    return {"count": len(ms), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3), "max_ms": round(float(ms.max()), 3)}
+
+def _stage(seconds, items, unit, latencies=None, **extra):
+    stage = {"seconds": round(seconds, 4), "items": items, "unit": unit,
+             "throughput": round(items / seconds, 2) if seconds > 0 else None}
+    stage.update(latency_stats(latencies))
+    stage.update(extra)
+    stage["peak_rss_mb"] = peak_rss_mb()
+    return stage
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+# Streamlit script of a chat turn (run by AppTest: same session state + widgets as the app)
+_TURN_SCRIPT = """
+import streamlit as st
+import database
+from ui_handlers import handle_user_input
+handle_user_input(st.session_state.benchmark_question, None, database.save_chat_message)
+"""
+
+def _run_turns(conversation, user_id, questions):
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_string(_TURN_SCRIPT, default_timeout=_TURN_TIMEOUT)
+    app.session_state["logged_in_user_id"] = user_id
+    app.session_state["conversation"] = conversation
+    app.session_state["chat_history"] = []
+    turn_seconds, first_token_seconds = [], []
+    for question in questions:
+        app.session_state["benchmark_question"] = question
+        _, seconds = _timed(app.run)
+        if app.exception:
+            raise RuntimeError(f"Chat turn failed: {app.exception[0].value}")
+        turn_seconds.append(seconds)
+        latency = app.session_state["last_answer_latency"]
+        if "time_to_first_token" in latency:
+            first_token_seconds.append(latency["time_to_first_token"])
+    return turn_seconds, first_token_seconds
+
+# One pass of the pipeline on a corpus of size_kb files -> {"stages": {stage: measurements}, ...}
+def run_suite(size_kb, files_per_format=DEFAULT_FILES_PER_FORMAT, queries=DEFAULT_QUERIES, turns=DEFAULT_TURNS,
+              load_repeats=DEFAULT_LOAD_REPEATS, seed=0):
+    import database
+    from embeddings import get_embedding_engine
+    from extraction import extract_file
+    from index_cache import create_vectorstore, load_vectorstore, save_vectorstore
+    from segments import compact_segments
+    from utils import extract_text_from_files, get_conversation_chain, get_text_chunks
+    from vector_index import get_index_type
+
+    database.init_db()
+    files = generate_corpus(size_kb, files_per_format, seed=seed)
+    corpus_mb = sum(len(data) for _, data in files) / (1024 * 1024)
+    stages = {}
+
+    # Extraction: whole batch as uploaded (process pool past MIN_POOL_BYTES) + each format parsed inline
+    text, seconds = _timed(extract_text_from_files, [_UploadedFile(name, data) for name, data in files])
+    stages["extract"] = _stage(seconds, round(corpus_mb, 3), "MB", chars=len(text))
+    for file_format in FORMATS:
+        format_files = [(name, data) for name, data in files if name.endswith("." + file_format)]
+        file_seconds = []
+        for name, data in format_files:
+            result, file_time = _timed(extract_file, name, data)
+            if result["status"] != "ok":
+                raise RuntimeError(f"Extraction of {name} failed: {result['error']}")
+            file_seconds.append(file_time)
+        stages[f"extract_{file_format}"] = _stage(sum(file_seconds), round(sum(len(data) for _, data in format_files) / (1024 * 1024), 3),
+                                                 "MB", file_seconds)
+
+    chunks, seconds = _timed(get_text_chunks, text)
+    stages["chunk"] = _stage(seconds, len(chunks), "chunks")
+
+    engine = get_embedding_engine()
+    vectors, seconds = _timed(engine.embed_documents, chunks)
+    stages["embed"] = _stage(seconds, len(chunks), "chunks")
+
+    # Index build: new segment saved + compacted into a base index of the type chosen for its size
+    user_id = database.add_user(f"bench_{size_kb}kb_{seed}_{time.time_ns()}", "x")
+    user_faiss_dir_path = database.get_user_faiss_path(user_id)
+    t0 = time.perf_counter()
+    vectorstore = create_vectorstore(user_faiss_dir_path, _INDEX_NAME, engine)
+    vectorstore.add_embeddings(list(zip(chunks, vectors)), metadatas=[{"source": "benchmark"} for _ in chunks])
+    save_vectorstore(vectorstore, user_faiss_dir_path, _INDEX_NAME)
+    compact_segments(user_faiss_dir_path, _INDEX_NAME, engine)
+    seconds = time.perf_counter() - t0
+    vectorstore.docstore.close()
+
+    load_seconds = []
+    for _ in range(load_repeats):
+        vectorstore, load_time = _timed(load_vectorstore, user_faiss_dir_path, _INDEX_NAME, engine)
+        load_seconds.append(load_time)
+    stages["index_build"] = _stage(seconds, len(chunks), "vectors", index_type=get_index_type(vectorstore.parts()[0]))
+    stages["index_load"] = _stage(sum(load_seconds), load_repeats, "loads", load_seconds)
+
+    search_seconds = []
+    for question in generate_questions(queries, seed):
+        _, search_time = _timed(vectorstore.similarity_search, question, k=4)
+        search_seconds.append(search_time)
+    stages["search"] = _stage(sum(search_seconds), queries, "queries", search_seconds)
+
+    if turns:
+        conversation = get_conversation_chain(vectorstore, user_id=user_id)
+        turn_seconds, first_token_seconds = _run_turns(conversation, user_id, generate_questions(turns, seed + 1))
+        stages["turn"] = _stage(sum(turn_seconds), turns, "turns", turn_seconds,
+                                time_to_first_token=latency_stats(first_token_seconds))
+    vectorstore.docstore.close()
+    return {"size_kb": size_kb, "files": len(files), "corpus_mb": round(corpus_mb, 3), "chunks": len(chunks), "stages": stages}
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+# Stage-by-stage ratios current / baseline (throughput: > 1 faster, p50: < 1 faster)
+def compare_results(baseline, current):
+    rows = []
+    baseline_runs = {run["size_kb"]: run for run in baseline.get("runs", [])}
+    for run in current.get("runs", []):
+        baseline_run = baseline_runs.get(run["size_kb"])
+        if baseline_run is None:
+            continue
+        for stage_name, stage in run["stages"].items():
+            baseline_stage = baseline_run["stages"].get(stage_name)
+            if baseline_stage is None:
+                continue
+            row = {"size_kb": run["size_kb"], "stage": stage_name}
+            if stage.get("throughput") and baseline_stage.get("throughput"):
+                row["throughput_ratio"] = round(stage["throughput"] / baseline_stage["throughput"], 3)
+            if stage.get("p50_ms") and baseline_stage.get("p50_ms"):
+                row["p50_ratio"] = round(stage["p50_ms"] / baseline_stage["p50_ms"], 3)
+            rows.append(row)
+    return rows
+
+def _print_results(results):
+    for run in results["runs"]:
+        print(f"\n{run['size_kb']} KB/file: {run['files']} files, {run['corpus_mb']} MB, {run['chunks']} chunks")
+        for stage_name, stage in run["stages"].items():
+            latency = f"  p50 {stage['p50_ms']} ms  p95 {stage['p95_ms']} ms" if "p50_ms" in stage else ""
+            print(f"  {stage_name:<14} {stage['seconds']:>9.3f} s  {stage['throughput'] or 0:>12.2f} {stage['unit']}/s{latency}"
+                  f"  rss {stage['peak_rss_mb']} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the RAGIFY pipeline")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES_KB), help="KB of text per file, comma-separated")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES_PER_FORMAT, help="Files per format")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="Searches timed per size")
+    parser.add_argument("--turns", type=int, default=DEFAULT_TURNS, help="Chat turns timed per size (0: skipped)")
+    parser.add_argument("--load-repeats", type=int, default=DEFAULT_LOAD_REPEATS)
+    parser.add_argument("--answer-tokens", type=int, default=DEFAULT_ANSWER_TOKENS)
+    parser.add_argument("--token-delay", type=float, default=DEFAULT_TOKEN_DELAY, help="Seconds between fake LLM tokens")
+    parser.add_argument("--dimension", type=int, default=STUB_DIMENSION, help="Stub embedding size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"Results JSON (default: {RESULTS_DIR}/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous results JSON to compare with")
+    parser.add_argument("--workdir", help="Directory for the benchmark DB/indexes (default: temporary, removed afterwards)")
+    args = parser.parse_args(argv)
+    sizes = [float(size) if "." in size else int(size) for size in args.sizes.split(",") if size.strip()]
+
+    started_at = datetime.now()
+    output_path = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{started_at:%Y%m%d-%H%M%S}.json"))
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="ragify-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)           # database.init_db() creates its DB + index directory in the working directory
+
+    server = FakeOllamaServer(answer_tokens=args.answer_tokens, token_delay=args.token_delay).start()
+    os.environ["RAGIFY_OLLAMA_URL"] = server.url
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)     # st.* called outside `streamlit run`
+    from embeddings import EmbeddingEngine, set_embedding_engine
+    set_embedding_engine(EmbeddingEngine(model_name="stub", base_embeddings=StubEmbeddings(args.dimension)))
+    try:
+        runs = []
+        for size_kb in sizes:
+            print(f"Running {size_kb} KB/file...", flush=True)
+            runs.append(run_suite(size_kb, args.files, args.queries, args.turns, args.load_repeats, args.seed))
+    finally:
+        server.stop()
+        os.chdir(previous_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")},
+        "env": {key: value for key, value in os.environ.items() if key.startswith("RAGIFY_") and key != "RAGIFY_OLLAMA_URL"},
+        "llm_requests": server.requests,
+        "peak_rss_mb": peak_rss_mb(),           # Extraction workers (process pool) not included
+        "runs": runs,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = {"baseline": args.compare, "stages": compare_results(json.load(f), results)}
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+
+    _print_results(results)
+    for row in results.get("comparison", {}).get("stages", []):
+        print(f"  vs baseline {row['size_kb']} KB {row['stage']:<14} throughput x{row.get('throughput_ratio', '-')}  p50 x{row.get('p50_ratio', '-')}")
+    print(f"\nResults: {output_path}")
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import database
+from extraction import extract_files, is_supported
+from index_cache import FAISS_INDEX_NAME
+from metrics import count, trace
+from utils import get_file_chunks, get_vectorstore
+
+# Headless bulk ingestion into a user's knowledge base (no browser upload limit, no Streamlit session):
+#   python src/bulk_ingest.py --user alice docs/ more_docs/ [--manifest files.txt] [--workers 4]
+# Run from the app's working directory (same sqlite3.db / faiss_user_index). Files are read, hashed and parsed
+# (process pool) one batch ahead while the current batch is chunked, embedded and saved.
+# Checkpoint = the DB: a batch's files get their content hash once its vectors are saved (files without text:
+# once parsed), so an interrupted run started again skips everything already ingested or parsed as empty
+# (as do later runs over the same directories)
+DEFAULT_BATCH_FILES = 64
+DEFAULT_BATCH_MB = 64
+
+class BulkIngestError(Exception):
+    pass
+
+# st_feedback_obj of get_vectorstore: errors stop the run (the UI falls back to a new, empty index instead;
+# a bulk load must not drop the existing knowledge base)
+class _Feedback:
+    def error(self, message):
+        raise BulkIngestError(message)
+
+    def warning(self, message):
+        print(f"WARNING: {message}", file=sys.stderr)
+
+# Supported files under the given paths + manifest lines -> [(path on disk, name in the knowledge base)]
+# Names: path relative to the walked directory's parent ("docs/contracts/a.pdf"), manifest entries as written
+def collect_files(paths, manifest=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            root = os.path.dirname(os.path.abspath(path))
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(dir_path, file_name)
+                    files.append((file_path, os.path.relpath(os.path.abspath(file_path), root).replace(os.sep, "/")))
+        else:
+            files.append((path, os.path.basename(path)))
+    if manifest:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                entry = line.strip()
+                if entry and not entry.startswith("#"):         # One path per line, relative to the manifest
+                    files.append((os.path.join(manifest_dir, entry), entry.replace(os.sep, "/")))
+    return list({name: (file_path, name) for file_path, name in files}.values())
+
+# Batches of at most batch_files files / batch_mb MB (a larger file is a batch of its own)
+def _batches(files, batch_files, batch_mb):
+    batch, batch_bytes = [], 0
+    for file_path, name in files:
+        size = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+        if batch and (len(batch) >= batch_files or batch_bytes + size > batch_mb * 1024 * 1024):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append((file_path, name))
+        batch_bytes += size
+    if batch:
+        yield batch
+
+# Reads + hashes a batch, drops files already ingested (same content), parses the rest
+# -> (extraction results with "hash" and "bytes", skipped count)
+def _load_batch(batch, known_hashes, workers):
+    loaded, unreadable, skipped = [], [], 0
+    for file_path, name in batch:
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+        except OSError as e:                # Removed/unreadable since the walk
+            unreadable.append({"name": name, "status": "error", "segments": [], "error": str(e), "hash": None, "bytes": 0})
+            continue
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash in known_hashes:
+            skipped += 1
+            continue
+        known_hashes.add(content_hash)          # Same content twice in this run -> ingested once
+        loaded.append((name, data, content_hash))
+    results = extract_files([(name, data) for name, data, _ in loaded], workers=workers)
+    for result, (_, data, content_hash) in zip(results, loaded):
+        result["hash"], result["bytes"] = content_hash, len(data)
+    return results + unreadable, skipped
+
+# Chunks, embeds and saves the parsed files of one batch, then records their hashes (checkpoint)
+# -> (chunks added, dedup stats: duplicate chunks are only referenced, see dedup.py)
+def _ingest_batch(user_id, results):
+    file_ids = database.add_user_file_records(user_id, [result["name"] for result in results], database.get_user_faiss_path(user_id))
+    text_chunks, chunk_metadatas, chunk_ids, replace_vector_ids, chunk_ids_by_file = [], [], [], [], {}
+    for result in results:
+        file_id = file_ids[result["name"]]
+        file_chunks, file_chunk_metadatas = get_file_chunks(result["segments"], result["name"], file_id)
+        file_chunk_ids = [str(uuid.uuid4()) for _ in file_chunks]
+        text_chunks.extend(file_chunks)
+        chunk_metadatas.extend(file_chunk_metadatas)
+        chunk_ids.extend(file_chunk_ids)
+        chunk_ids_by_file[file_id] = file_chunk_ids
+        replace_vector_ids.extend(database.get_file_vector_ids(file_id))          # Changed file -> old vectors replaced
+    if not text_chunks:
+        return 0, {}
+
+    vectorstore = get_vectorstore(
+        text_chunks=text_chunks, user_id=user_id, db_get_user_faiss_path_func=database.get_user_faiss_path,
+        faiss_index_name_const=FAISS_INDEX_NAME, session_state=SimpleNamespace(vectorstore_loaded_for_user=False),
+        st_feedback_obj=_Feedback(), chunk_metadatas=chunk_metadatas, chunk_ids=chunk_ids, replace_vector_ids=replace_vector_ids
+    )
+    for file_id, file_chunk_ids in chunk_ids_by_file.items():
+        database.set_file_vectors(file_id, file_chunk_ids)
+    database.set_file_hashes({file_ids[result["name"]]: result["hash"] for result in results})
+    return len(text_chunks), vectorstore.dedup_stats
+
+def _throughput(stats):
+    seconds = max(stats["seconds"], 1e-9)
+    return (f"{stats['ingested']} ingested, {stats['skipped']} skipped, {stats['failed']} failed of {stats['files']} files | "
+            f"{stats['mb']:.1f} MB, {stats['chunks']} chunks ({stats['duplicates']} duplicates) | {stats['ingested'] / seconds:.2f} files/s, "
+            f"{stats['mb'] / seconds:.2f} MB/s, {stats['chunks'] / seconds:.1f} chunks/s")
+
+# Ingests the files into the user's knowledge base
+# -> stats (files, ingested/skipped/empty/failed, MB, chunks, duplicates (chunks not embedded again), seconds, errors)
+def bulk_ingest(user_id, files, workers=None, batch_files=DEFAULT_BATCH_FILES, batch_mb=DEFAULT_BATCH_MB, on_batch=None):
+    unsupported = [name for _, name in files if not is_supported(name)]
+    files = [(file_path, name) for file_path, name in files if is_supported(name)]
+    stats = {"files": len(files), "unsupported": len(unsupported), "ingested": 0, "skipped": 0, "empty": 0, "failed": 0,
+             "mb": 0.0, "chunks": 0, "duplicates": 0, "batches": 0, "seconds": 0.0, "errors": {}}
+    known_hashes = database.get_user_file_hashes(user_id)
+    t0 = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-ingest-reader") as reader:
+        batches = iter(list(_batches(files, batch_files, batch_mb)))
+        batch = next(batches, None)
+        pending = reader.submit(_load_batch, batch, known_hashes, workers) if batch else None
+        while pending is not None:
+            results, skipped = pending.result()
+            batch = next(batches, None)         # Next batch read + parsed while this one is embedded
+            pending = reader.submit(_load_batch, batch, known_hashes, workers) if batch else None
+
+            for result in results:
+                if result["status"] != "ok":
+                    stats["errors"][result["name"]] = result["error"] or result["status"]
+            parsed = [result for result in results if result["status"] == "ok" and any(segment["text"].strip() for segment in result["segments"])]
+            empty = [result for result in results if result["status"] == "ok" and result not in parsed]
+            with trace("ingestion", source="bulk"):
+                chunks, dedup_stats = _ingest_batch(user_id, parsed)
+                count("ingested_chunks", chunks)
+            database.add_empty_file_hashes(user_id, [result["hash"] for result in empty])
+
+            stats["batches"] += 1
+            stats["skipped"] += skipped
+            stats["failed"] += sum(1 for result in results if result["status"] != "ok")
+            stats["empty"] += len(empty)
+            stats["ingested"] += len(parsed)
+            stats["mb"] += sum(result["bytes"] for result in results) / (1024 * 1024)
+            stats["chunks"] += chunks
+            stats["duplicates"] += dedup_stats.get("exact", 0) + dedup_stats.get("near", 0)
+            stats["seconds"] = time.perf_counter() - t0
+            if on_batch:
+                on_batch(stats)
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    stats["mb"] = round(stats["mb"], 3)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load directories of documents into a RAGIFY user's knowledge base")
+    parser.add_argument("paths", nargs="*", help="Directories (walked recursively) and files")
+    parser.add_argument("--user", help="Username (existing account)")
+    parser.add_argument("--user-id", type=int, help="User ID (instead of --user)")
+    parser.add_argument("--manifest", help="Text file listing one path per line (relative to the manifest, # comments)")
+    parser.add_argument("--workers", type=int, help="Parsing processes (default: RAGIFY_EXTRACTION_WORKERS)")
+    parser.add_argument("--batch-files", type=int, default=DEFAULT_BATCH_FILES, help="Files per batch (saved + checkpointed together)")
+    parser.add_argument("--batch-mb", type=float, default=DEFAULT_BATCH_MB, help="MB of files per batch")
+    parser.add_argument("--json", help="Also write the final stats to this JSON file")
+    args = parser.parse_args(argv)
+    if not args.paths and not args.manifest:
+        parser.error("give at least one directory/file or --manifest")
+    if (args.user is None) == (args.user_id is None):
+        parser.error("give either --user or --user-id")
+
+    database.init_db()
+    if args.user is not None:
+        user = database.get_user(args.user)
+        if user is None:
+            parser.error(f"unknown user: {args.user}")
+        user_id = user["id"]
+    else:
+        user_id = args.user_id
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f"not found: {', '.join(missing)}")
+
+    files = collect_files(args.paths, args.manifest)
+    print(f"{len(files)} files found", flush=True)
+    try:
+        stats = bulk_ingest(user_id, files, args.workers, args.batch_files, args.batch_mb,
+                            on_batch=lambda stats: print(f"[batch {stats['batches']}] {_throughput(stats)}", flush=True))
+    except BulkIngestError as e:
+        print(f"Stopped: {e}\nBatches already saved are kept; run the same command again to resume.", file=sys.stderr)
+        return 1
+
+    print(f"\nDone in {stats['seconds']:.1f} s: {_throughput(stats)}")
+    if stats["unsupported"] or stats["empty"]:
+        print(f"{stats['unsupported']} unsupported files ignored, {stats['empty']} files without text")
+    for name, error in stats["errors"].items():
+        print(f"  failed: {name}: {error}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
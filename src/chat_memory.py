@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+from typing import Any, Optional
+
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.prompts import PromptTemplate
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from pydantic import PrivateAttr
+
+import database
+
+# Conversation memory given to the chain ({chat_history} of the prompt):
+#   buffer  -> every turn verbatim (prompt grows with the conversation)
+#   summary -> last RAGIFY_MEMORY_TURNS turns verbatim + a summary of the older ones (bounded prompt)
+MEMORY_MODES = ("buffer", "summary")
+DEFAULT_MEMORY_MODE = "summary"
+DEFAULT_MEMORY_TURNS = 6
+_FOLD_BATCH_TURNS = 4               # Turns folded into the summary per LLM call
+_CATCH_UP_BATCH_TURNS = 16          # Same, for the older unsummarized turns (history saved before summaries)
+_MAX_SUMMARY_WORDS = 300            # Asked of the LLM
+_MAX_SUMMARY_CHARS = 3000           # Longer summaries are cut at a sentence boundary
+
+# Langchain's progressive summary prompt, with a length bound
+_BOUNDED_SUMMARY_PROMPT = PromptTemplate(
+    input_variables=SUMMARY_PROMPT.input_variables,
+    template=SUMMARY_PROMPT.template.replace(
+        "New summary:", f"New summary (at most {_MAX_SUMMARY_WORDS} words: merge or shorten details, never drop the earliest facts):"
+    )
+)
+
+logger = logging.getLogger(__name__)
+
+def get_memory_mode():
+    memory_mode = os.getenv("RAGIFY_MEMORY_MODE", DEFAULT_MEMORY_MODE)
+    return memory_mode if memory_mode in MEMORY_MODES else DEFAULT_MEMORY_MODE
+
+# Last resort for a summary over _MAX_SUMMARY_CHARS: whole sentences from the start (oldest facts), or whole words
+def _bound_summary(summary):
+    if len(summary) <= _MAX_SUMMARY_CHARS:
+        return summary
+    cut = summary[:_MAX_SUMMARY_CHARS]
+    sentence_end = max(cut.rfind(end) for end in (". ", "! ", "? ", "\n"))
+    if sentence_end >= _MAX_SUMMARY_CHARS // 2:
+        return cut[:sentence_end + 1].strip()
+    return cut.rsplit(None, 1)[0]
+
+# [HumanMessage, AIMessage, ...] -> [(question, answer)]
+def _to_turns(messages):
+    turns = []
+    for message in messages or []:
+        if isinstance(message, HumanMessage):
+            turns.append([message.content, ""])
+        elif isinstance(message, AIMessage) and turns and not turns[-1][1]:
+            turns[-1][1] = message.content
+    return [tuple(turn) for turn in turns]
+
+# Last max_turns turns verbatim, older turns folded into a rolling summary by the LLM in a background thread
+# (answers never wait for it). Logged-in users: summary saved in "chat_summaries", covering their first
+# summarized_turns rows of "chat_history"; the catch_up_turns rows after them (older than the turns loaded) are
+# read back from the DB and folded first
+class RollingSummaryMemory(BaseMemory):
+    llm: Any
+    user_id: Optional[int] = None
+    memory_key: str = "chat_history"
+    max_turns: int = DEFAULT_MEMORY_TURNS
+    summary: str = ""
+    summarized_turns: int = 0
+    catch_up_turns: int = 0
+    turns: list = []                    # [(question, answer)] not in the summary yet, oldest first
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _folding: bool = PrivateAttr(default=False)
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    # Summary + recent turns (the turns waiting to be folded are kept too: nothing disappears from the prompt meanwhile)
+    def load_memory_variables(self, inputs):
+        with self._lock:
+            messages = [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] if self.summary else []
+            for question, answer in self.turns[-(self.max_turns + _FOLD_BATCH_TURNS):]:
+                messages += [HumanMessage(content=question), AIMessage(content=answer)]
+        return {self.memory_key: messages}
+
+    def save_context(self, inputs, outputs):
+        with self._lock:
+            self.turns.append((inputs["question"], outputs["answer"]))
+        self.schedule_fold()
+
+    def clear(self):
+        with self._lock:
+            self.summary, self.summarized_turns, self.catch_up_turns, self.turns = "", 0, 0, []
+
+    def schedule_fold(self):
+        with self._lock:
+            if self._folding or (not self.catch_up_turns and len(self.turns) - self.max_turns < _FOLD_BATCH_TURNS):
+                return False
+            self._folding = True
+        threading.Thread(target=self._fold, name="chat-summary", daemon=True).start()
+        return True
+
+    def _fold(self):
+        try:
+            while True:
+                with self._lock:
+                    catch_up_turns, summarized_turns, summary = self.catch_up_turns, self.summarized_turns, self.summary
+                    if not catch_up_turns and len(self.turns) - self.max_turns < _FOLD_BATCH_TURNS:
+                        break
+                    batch = self.turns[:_FOLD_BATCH_TURNS]
+                if catch_up_turns:
+                    batch = [(question or "", answer or "") for question, answer in database.load_chat_history(
+                        self.user_id, offset=summarized_turns, limit=min(catch_up_turns, _CATCH_UP_BATCH_TURNS))]
+                    if not batch:               # History removed meanwhile
+                        with self._lock:
+                            self.catch_up_turns = 0
+                        continue
+                new_lines = "\n".join(f"Human: {question}\nAI: {answer}" for question, answer in batch)
+                new_summary = self.llm.invoke(_BOUNDED_SUMMARY_PROMPT.format(summary=summary, new_lines=new_lines)).content.strip()
+                with self._lock:
+                    self.summary = _bound_summary(new_summary)
+                    if catch_up_turns:
+                        self.catch_up_turns = max(0, catch_up_turns - len(batch))
+                    else:
+                        del self.turns[:len(batch)]
+                    self.summarized_turns += len(batch)
+                    summary, summarized_turns = self.summary, self.summarized_turns
+                if self.user_id:
+                    database.save_chat_summary(self.user_id, summary, summarized_turns)
+        except Exception:
+            logger.exception("Chat summary update failed")          # Retried on the next turn
+        finally:
+            with self._lock:
+                self._folding = False
+
+# Memory of a conversation chain (RAGIFY_MEMORY_MODE). Logged-in users: loaded from the database
+# (summary + turns after it), guests: from initial_chat_history
+def create_chat_memory(llm, user_id=None, initial_chat_history=None):
+    if get_memory_mode() == "buffer":
+        memory = ConversationBufferMemory(memory_key='chat_history', return_messages=True, output_key='answer')
+        if user_id:                     # The displayed history may only hold the last page
+            initial_chat_history = []
+            for question, answer in database.load_chat_history(user_id):
+                initial_chat_history += [HumanMessage(content=question or ""), AIMessage(content=answer or "")]
+        if initial_chat_history:
+            memory.chat_memory.messages = initial_chat_history
+        return memory
+
+    max_turns = int(os.getenv("RAGIFY_MEMORY_TURNS", DEFAULT_MEMORY_TURNS))
+    if user_id:
+        summary, summarized_turns = database.get_chat_summary(user_id)
+        # Only the turns that can reach the prompt are loaded, older ones are read back in batches while folded
+        catch_up_turns = max(0, database.count_chat_turns(user_id) - summarized_turns - max_turns - _FOLD_BATCH_TURNS)
+        turns = [(question or "", answer or "") for question, answer in database.load_chat_history(user_id, offset=summarized_turns + catch_up_turns)]
+    else:
+        summary, summarized_turns, catch_up_turns, turns = "", 0, 0, _to_turns(initial_chat_history)
+    memory = RollingSummaryMemory(llm=llm, user_id=user_id, max_turns=max_turns, summary=summary,
+                                  summarized_turns=summarized_turns, catch_up_turns=catch_up_turns, turns=turns)
+    memory.schedule_fold()
+    return memory
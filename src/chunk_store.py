@@ -0,0 +1,391 @@
+import json
+import operator
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy, maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from dedup import content_hash, find_duplicates, lsh_buckets, record_dedup_stats, similarity
+from metrics import timed
+from vector_index import create_index, index_labels, reconstruct_labels, selection_params
+
+_LOOKUP_BATCH = 500                                 # Max "?" per SELECT ... IN (...)
+_MAX_TOMBSTONE_FETCH = 64                           # Extra hits fetched to make up for tombstoned vectors
+_BACKFILL_BATCH = 1000                              # Chunks hashed per step when upgrading an older store
+_HASH_VERSION = 1                                   # PRAGMA user_version: 0 = no or lowercased content hashes
+
+# On-disk docstore (one Sqlite3 file per user index): chunk text + metadata, fetched by ID only when needed
+# label = integer ID of the chunk's vector in the FAISS index (never reused, see AUTOINCREMENT)
+# vector_id = docstore ID (uuid, the one linked to files in file_vectors)
+# Deduplicated chunks (see dedup.py): content hash per chunk; a duplicate added later is a row of chunk_aliases
+# (its own vector_id/metadata/file_id -> the stored chunk's label).
+# A chunk lives as long as one of its references (own vector_id or aliases) does
+class ChunkStore(Docstore, AddableMixin):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            label INTEGER PRIMARY KEY AUTOINCREMENT,
+            vector_id TEXT UNIQUE NOT NULL,
+            text TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            file_id INTEGER
+        )
+        """)
+        if "file_id" not in [row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")]:        # Store created before file scopes
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN file_id INTEGER")
+            self._conn.execute("UPDATE chunks SET file_id = json_extract(metadata, '$.file_id')")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks (file_id)")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_aliases (
+            vector_id TEXT PRIMARY KEY,
+            label INTEGER NOT NULL,
+            metadata TEXT NOT NULL,
+            file_id INTEGER
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_aliases_label ON chunk_aliases (label)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_aliases_file_id ON chunk_aliases (file_id)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")]
+        if "content_hash" not in columns:                                                                 # Store created before dedup
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+        if "minhash" not in columns:                                                                      # ... or before near checks of stored chunks
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN minhash BLOB")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _HASH_VERSION:
+            self._backfill_hashes()
+            self._conn.execute(f"PRAGMA user_version = {_HASH_VERSION}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_content_hash ON chunks (content_hash)")
+        # LSH bands of the chunks added in near mode (see dedup.py): band -> labels
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunk_bands (band INTEGER NOT NULL, label INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_bands_band ON chunk_bands (band)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_bands_label ON chunk_bands (label)")
+        self._conn.commit()
+
+    # One-time hashing of the chunks stored before dedup or with lowercased hashes (later uploads are compared with them too)
+    def _backfill_hashes(self):
+        last_label = 0
+        while True:
+            rows = self._conn.execute("SELECT label, text FROM chunks WHERE label > ? ORDER BY label LIMIT ?",
+                                      (last_label, _BACKFILL_BATCH)).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("UPDATE chunks SET content_hash = ? WHERE label = ?", [(content_hash(text), label) for label, text in rows])
+            last_label = rows[-1][0]
+
+    @staticmethod
+    def _to_document(vector_id, text, metadata):
+        return Document(id=vector_id, page_content=text, metadata=json.loads(metadata))
+
+    def _select(self, column, values, fields, table="chunks"):
+        rows = []
+        values = list(values)
+        with self._lock:
+            for start in range(0, len(values), _LOOKUP_BATCH):
+                batch = values[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._conn.execute(f"SELECT {fields} FROM {table} WHERE {column} IN ({placeholders})", batch).fetchall())
+        return rows
+
+    # {vector_id: Document} (+ their content hashes, computed when missing, and MinHash signatures in near mode)
+    # -> labels of the new chunks (same order)
+    def add(self, texts, hashes=None, signatures=None):
+        if hashes is None:
+            hashes = [content_hash(doc.page_content) for doc in texts.values()]
+        signatures = signatures or [None] * len(hashes)
+        labels = []
+        with self._lock:
+            for (vector_id, doc), text_hash, signature in zip(texts.items(), hashes, signatures):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (vector_id, text, metadata, file_id, content_hash, minhash) VALUES (?, ?, ?, ?, ?, ?)",
+                    (vector_id, doc.page_content, json.dumps(doc.metadata), doc.metadata.get("file_id"), text_hash,
+                     signature.tobytes() if signature is not None else None)
+                )
+                labels.append(cursor.lastrowid)
+                if signature is not None:
+                    self._conn.executemany("INSERT INTO chunk_bands (band, label) VALUES (?, ?)",
+                                           [(band, cursor.lastrowid) for band in lsh_buckets(signature)])
+            self._conn.commit()
+        return labels
+
+    # [(vector_id, label, metadata)] -> the vector IDs become references to the stored chunks (deduplicated chunks)
+    def add_aliases(self, aliases):
+        if not aliases:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunk_aliases (vector_id, label, metadata, file_id) VALUES (?, ?, ?, ?)",
+                                   [(vector_id, int(label), json.dumps(metadata), metadata.get("file_id"))
+                                    for vector_id, label, metadata in aliases])
+            self._conn.commit()
+
+    # Stored chunks with the same content hashes -> [label | None] (same order); labels in exclude_labels are ignored (tombstones)
+    def find_duplicates(self, hashes, exclude_labels=()):
+        exclude_labels = set(exclude_labels)
+        labels_by_hash = {}
+        for text_hash, label in self._select("content_hash", set(hashes), "content_hash, label"):
+            if label not in exclude_labels:
+                labels_by_hash.setdefault(text_hash, label)
+        return [labels_by_hash.get(text_hash) for text_hash in hashes]
+
+    # Stored chunks of the same file (file_ids[i]) sharing an LSH band with signatures[i] and at least `threshold`
+    # similar -> [label | None] (same order, most similar chunk); labels in exclude_labels are ignored
+    def find_near_duplicates(self, signatures, file_ids, exclude_labels=(), threshold=0.9):
+        buckets = [lsh_buckets(signature) if file_id is not None else [] for signature, file_id in zip(signatures, file_ids)]
+        labels_by_band = {}
+        for band, label in self._select("band", {band for text_buckets in buckets for band in text_buckets}, "band, label", table="chunk_bands"):
+            labels_by_band.setdefault(band, []).append(label)
+        candidates = {label for labels in labels_by_band.values() for label in labels} - set(exclude_labels)
+        stored = {label: (file_id, np.frombuffer(signature, dtype=np.uint32))
+                  for label, file_id, signature in self._select("label", candidates, "label, file_id, minhash")}
+        matches = []
+        for signature, file_id, text_buckets in zip(signatures, file_ids, buckets):
+            scores = {label: similarity(signature, stored[label][1]) for band in text_buckets for label in labels_by_band.get(band, ())
+                      if label in stored and stored[label][0] == file_id}
+            best = max(scores, key=scores.get, default=None)
+            matches.append(best if best is not None and scores[best] >= threshold else None)
+        return matches
+
+    def search(self, search):
+        rows = self._select("vector_id", [search], "vector_id, text, metadata")
+        if not rows:
+            return f"ID {search} not found."
+        return self._to_document(*rows[0])
+
+    # Top-k fetch after a search: {label: Document} for the labels still stored
+    def get_by_labels(self, labels):
+        rows = self._select("label", [int(label) for label in labels], "label, vector_id, text, metadata")
+        return {label: self._to_document(vector_id, text, metadata) for label, vector_id, text, metadata in rows}
+
+    # {vector_id: label} for the vector IDs still stored (aliases -> label of the chunk they reference)
+    def labels_for(self, vector_ids):
+        vector_ids = list(dict.fromkeys(vector_ids))
+        labels = dict(self._select("vector_id", vector_ids, "vector_id, label"))
+        labels.update(self._select("vector_id", vector_ids, "vector_id, label", table="chunk_aliases"))
+        return labels
+
+    # {label: references (own vector_id + aliases)}
+    def reference_counts(self, labels):
+        counts = Counter(int(label) for label in labels)
+        counts.update(label for (label,) in self._select("label", list(counts), "label", table="chunk_aliases"))
+        return dict(counts)
+
+    def texts_for(self, labels):
+        return {label: text for label, text in self._select("label", [int(label) for label in labels], "label, text")}
+
+    # Drops references: a chunk whose own vector_id goes is taken over by one of its aliases if any (shared
+    # with another file), removed otherwise
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), _LOOKUP_BATCH):
+                batch = ids[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunk_aliases WHERE vector_id IN ({placeholders})", batch)
+                for (label,) in self._conn.execute(f"SELECT label FROM chunks WHERE vector_id IN ({placeholders})", batch).fetchall():
+                    alias = self._conn.execute("SELECT vector_id, metadata, file_id FROM chunk_aliases WHERE label = ? LIMIT 1", (label,)).fetchone()
+                    if alias is not None:
+                        self._conn.execute("UPDATE chunks SET vector_id = ?, metadata = ?, file_id = ? WHERE label = ?", alias + (label,))
+                        self._conn.execute("DELETE FROM chunk_aliases WHERE vector_id = ?", (alias[0],))
+                    else:
+                        self._conn.execute("DELETE FROM chunks WHERE label = ?", (label,))
+                        self._conn.execute("DELETE FROM chunk_bands WHERE label = ?", (label,))
+            self._conn.commit()
+
+    # Labels of the chunks of some user_files (file ID from the chunk metadata, deduplicated chunks included)
+    def labels_for_files(self, file_ids):
+        file_ids = [int(file_id) for file_id in file_ids]
+        labels = [row[0] for row in self._select("file_id", file_ids, "label")]
+        labels += [row[0] for row in self._select("file_id", file_ids, "label", table="chunk_aliases")]
+        return np.unique(np.array(labels, dtype=np.int64))
+
+    # Labels of every stored chunk (compaction: vectors whose label is missing are tombstones)
+    def all_labels(self):
+        with self._lock:
+            return np.array([row[0] for row in self._conn.execute("SELECT label FROM chunks")], dtype=np.int64)
+
+    # Drops every chunk (labels keep increasing: a stale index never points to a new chunk)
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_aliases")
+            self._conn.execute("DELETE FROM chunk_bands")
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# FAISS vectorstore whose index vectors are labeled with chunk store labels
+# Only the indexes live in RAM; search results are fetched from the chunk store (one query for the top-k)
+# Parts searched together: the base index + the saved segments (immutable, shared between copies)
+# + the segment of the vectors added since the last save
+class ChunkStoreFAISS(FAISS):
+    def __init__(self, embedding_function, index, chunk_store, segments=None, manifest=None):
+        super().__init__(embedding_function, index, chunk_store, {})
+        self.segments = list(segments or [])           # [(file name, index)]
+        self.manifest = manifest
+        self.new_segment = None
+        self.pending_deletes = {}           # vector_id -> label, references dropped on the next save
+        self.pending_tombstones = set()     # Labels whose last reference is in pending_deletes (vector in a saved part)
+        self.pending_removed = set()        # Same, vector only in new_segment: removed from it for real
+        self.dedup_stats = {"unique": 0, "exact": 0, "near": 0}         # Chunks added to this copy (see dedup.py)
+
+    # Private copy for an update: shares the (never modified) saved parts, adds/deletes stay local until saved
+    def for_update(self):
+        return ChunkStoreFAISS(self.embedding_function, self.index, self.docstore, self.segments, self.manifest)
+
+    def parts(self):
+        parts = [self.index] + [index for _, index in self.segments] + [self.new_segment]
+        return [part for part in parts if part is not None and part.ntotal > 0]
+
+    def _deleted(self):
+        return (self.manifest or {}).get("deleted", 0) + len(self.pending_tombstones)
+
+    # Live vectors (tombstoned ones are still in the parts until compaction)
+    def count_vectors(self):
+        return sum(part.ntotal for part in self.parts()) - self._deleted()
+
+    # Duplicates (of stored chunks or of the batch) are only embedded when unique
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self._add(texts, metadatas, ids, lambda positions: self._embed_documents([texts[position] for position in positions]))
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        text_embeddings = list(text_embeddings)
+        texts = [text for text, _ in text_embeddings]
+        return self._add(texts, metadatas, ids, lambda positions: [text_embeddings[position][1] for position in positions])
+
+    # Unique chunks are stored + indexed (vectors from embed(positions)), duplicates become aliases of the chunk
+    # they duplicate (their file keeps a reference to it, no vector added) -> ids (all of them)
+    def _add(self, texts, metadatas, ids, embed):
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        hashes, signatures, matches = find_duplicates(texts, metadatas, self.docstore, self.pending_tombstones | self.pending_removed)
+        for result, value in record_dedup_stats(matches).items():
+            self.dedup_stats[result] += value
+
+        keep = [position for position, match in enumerate(matches) if match is None]
+        labels_by_position = {}
+        if keep:
+            vectors = np.array(embed(keep), dtype=np.float32)
+            if self.new_segment is None:
+                self.new_segment, _ = create_index("flat", vectors)
+            # Chunk rows are written first: a crash before the segment is saved leaves rows no vector points to (harmless)
+            labels = self.docstore.add({ids[position]: Document(id=ids[position], page_content=texts[position], metadata=metadatas[position])
+                                        for position in keep}, [hashes[position] for position in keep],
+                                        [signatures[position] for position in keep])
+            self.new_segment.add_with_ids(vectors, np.array(labels, dtype=np.int64))
+            labels_by_position = dict(zip(keep, labels))
+        aliases = []
+        for position, match in enumerate(matches):
+            if match is not None:
+                source, target, _ = match
+                aliases.append((ids[position], labels_by_position[target] if source == "batch" else target, metadatas[position]))
+        self.docstore.add_aliases(aliases)
+        return ids
+
+    # Removes vectors by docstore ID, ignoring IDs that are no longer stored -> number of references removed
+    # Saved parts are immutable: the vectors become tombstones (skipped by searches, dropped by compaction)
+    # A chunk shared by several files (deduplicated) only becomes a tombstone with its last reference
+    def delete(self, ids=None, **kwargs):
+        labels = {vector_id: label for vector_id, label in self.docstore.labels_for(ids or []).items()
+                  if vector_id not in self.pending_deletes}
+        if not labels:
+            return 0
+        references = self.docstore.reference_counts(set(labels.values()))
+        pending = Counter(self.pending_deletes.values())
+        self.pending_deletes.update(labels)
+        tombstones = {label for label, dropped in Counter(labels.values()).items()
+                      if pending[label] + dropped >= references[label]} - self.pending_tombstones - self.pending_removed
+        if tombstones and self.new_segment is not None:            # Not saved yet -> removed for real, not a tombstone
+            removed = tombstones & set(index_labels(self.new_segment).tolist())
+            if removed:
+                self.new_segment.remove_ids(np.fromiter(removed, dtype=np.int64))
+                self.pending_removed.update(removed)
+                tombstones -= removed
+        self.pending_tombstones.update(tombstones)
+        return len(labels)
+
+    def apply_pending_deletes(self):
+        if self.pending_deletes:
+            self.docstore.delete(list(self.pending_deletes))
+            self.pending_deletes = {}
+            self.pending_tombstones = set()
+            self.pending_removed = set()
+
+    # Nearest live chunks of every part -> [(doc, score, label, part)]
+    # file_ids (search kwarg) -> only the chunks of these user_files are searched (ID selector inside each index)
+    def _search(self, embedding, k, filter, fetch_k, file_ids=None):
+        parts = self.parts()
+        if not parts:
+            return []
+        selector = None
+        if file_ids is not None:
+            selected_labels = self.docstore.labels_for_files(file_ids)
+            if not len(selected_labels):
+                return []
+            selector = faiss.IDSelectorBatch(selected_labels)
+            selectivity = len(selected_labels) / sum(part.ntotal for part in parts)
+        query = np.array([embedding], dtype=np.float32)
+        search_k = (k if filter is None else fetch_k) + min(self._deleted(), _MAX_TOMBSTONE_FETCH)
+        hits = []
+        for part_number, part in enumerate(parts):
+            params = selection_params(part, selector, selectivity) if selector is not None else None
+            scores, labels = part.search(query, min(search_k, part.ntotal), params=params)
+            hits.extend((float(score), int(label), part_number) for label, score in zip(labels[0], scores[0]) if label != -1)
+        hits = sorted(hits)[:search_k]              # L2 distances of every part are comparable
+        docs_by_label = self.docstore.get_by_labels([label for _, label, _ in hits if label not in self.pending_tombstones])
+        filter_func = self._create_filter_func(filter) if filter is not None else None
+
+        docs = []
+        for score, label, part_number in hits:
+            doc = docs_by_label.get(label)
+            if doc is None:                 # Tombstone (or removed after this copy was loaded)
+                continue
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, score, label, parts[part_number]))
+        return docs[:k]
+
+    @timed("vector_search")
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        docs = [(doc, score) for doc, score, _, _ in self._search(embedding, k, filter, fetch_k, kwargs.get("file_ids"))]
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            cmp = operator.ge if self.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT else operator.le
+            docs = [(doc, score) for doc, score in docs if cmp(score, score_threshold)]
+        return docs
+
+    # MMR among the fetch_k nearest chunks, their vectors read back from the parts holding them
+    @timed("vector_search")
+    def max_marginal_relevance_search_with_score_by_vector(self, embedding, *, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        candidates = self._search(embedding, fetch_k, filter, fetch_k * 2, kwargs.get("file_ids"))
+        if not candidates:
+            return []
+        vectors = {}
+        for part in {id(part): part for _, _, _, part in candidates}.values():
+            labels = [label for _, _, label, candidate_part in candidates if candidate_part is part]
+            vectors.update(zip(labels, reconstruct_labels(part, labels)))
+        selected = maximal_marginal_relevance(np.array([embedding], dtype=np.float32),
+                                              [vectors[label] for _, _, label, _ in candidates], k=k, lambda_mult=lambda_mult)
+        return [candidates[position][:2] for position in selected]
+
+    # The base class drops the search kwargs (file_ids) on the way
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return [doc for doc, _ in self.max_marginal_relevance_search_with_score_by_vector(
+            embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter, **kwargs)]
@@ -0,0 +1,127 @@
+import os
+import re
+
+DEFAULT_CHUNK_TOKENS = 256
+DEFAULT_CHUNK_OVERLAP_TOKENS = 0
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Approximate token count (words + punctuation, close to the WordPiece count of nomic-embed)
+def count_tokens(text):
+    return len(_TOKEN_RE.findall(text))
+
+# Chunks never cross these boundaries (PDF pages, spreadsheet sheets)
+def _boundary(segment):
+    if "page" in segment:
+        return ("page", segment["page"])
+    if "sheet" in segment:
+        return ("sheet", segment["sheet"])
+    return None
+
+# A "word" over the budget (numbers joined by commas, long URLs, base64...) -> windows of max_tokens tokens
+def _split_word(word, max_tokens):
+    starts = [match.start() for match in _TOKEN_RE.finditer(word)]
+    if len(starts) <= max_tokens:
+        return [word]
+    return [word[starts[i]:starts[i + max_tokens] if i + max_tokens < len(starts) else None] for i in range(0, len(starts), max_tokens)]
+
+# Splits a unit that alone is over the budget (sentences first, then words, then token windows)
+# Every piece is within the budget
+def _split_long(text, max_tokens):
+    pieces, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_RE.split(text):
+        words = sentence.split() if count_tokens(sentence) > max_tokens else [sentence]
+        for word in (part for word in words for part in _split_word(word, max_tokens)):
+            tokens = count_tokens(word)
+            if current and current_tokens + tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+# Packs units (lines, paragraphs, rows) into chunks of at most max_tokens
+class _ChunkAccumulator:
+    def __init__(self, base_metadata, max_tokens, overlap_tokens):
+        self.base_metadata = base_metadata
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.units = []             # [(text, tokens, segment)]
+        self.tokens = 0
+
+    def add(self, text, segment):
+        text = text.strip()
+        if not text:                # Paragraph break -> preferred place to end a chunk
+            if self.tokens >= self.max_tokens // 2:
+                yield from self.flush()
+            return
+        tokens = count_tokens(text)
+        if tokens > self.max_tokens:            # Pieces are added as they are (never split again)
+            for piece in _split_long(text, self.max_tokens):
+                yield from self._append(piece, count_tokens(piece), segment)
+            return
+        yield from self._append(text, tokens, segment)
+
+    def _append(self, text, tokens, segment):
+        if self.units and self.tokens + tokens > self.max_tokens:
+            yield from self.flush(keep_overlap=True)
+        self.units.append((text, tokens, segment))
+        self.tokens += tokens
+
+    def flush(self, keep_overlap=False):
+        if not self.units:
+            return
+        segments = [segment for _, _, segment in self.units]
+        metadata = dict(self.base_metadata)
+        if "page" in segments[0]:
+            metadata["page"] = segments[0]["page"]
+        if "sheet" in segments[0]:
+            metadata["sheet"] = segments[0]["sheet"]
+        rows = [segment["row"] for segment in segments if "row" in segment]
+        if rows:
+            metadata["row_start"], metadata["row_end"] = min(rows), max(rows)
+        yield "\n".join(text for text, _, _ in self.units), metadata
+
+        kept, kept_tokens = [], 0           # Overlap: trailing units carried into the next chunk
+        if keep_overlap and self.overlap_tokens > 0:
+            for unit in reversed(self.units):
+                if kept_tokens + unit[1] > self.overlap_tokens:
+                    break
+                kept.insert(0, unit)
+                kept_tokens += unit[1]
+        self.units, self.tokens = kept, kept_tokens
+
+# Structure-aware chunking: segments (from extraction.iter_segments) -> (chunk text, chunk metadata)
+# Works as a stream, so only the chunk being built is kept in memory
+def iter_chunks(segments, base_metadata=None, max_tokens=None, overlap_tokens=None):
+    if max_tokens is None:
+        max_tokens = int(os.getenv("RAGIFY_CHUNK_TOKENS", DEFAULT_CHUNK_TOKENS))
+    if overlap_tokens is None:
+        overlap_tokens = int(os.getenv("RAGIFY_CHUNK_OVERLAP_TOKENS", DEFAULT_CHUNK_OVERLAP_TOKENS))
+    accumulator = _ChunkAccumulator(dict(base_metadata or {}), max_tokens, overlap_tokens)
+    boundary = None
+    pending_line = ""               # Streamed text pieces may end in the middle of a line
+
+    for segment in segments:
+        segment_boundary = _boundary(segment)
+        if segment_boundary != boundary:
+            yield from accumulator.flush()
+            boundary = segment_boundary
+
+        if "row" in segment or "paragraph" in segment:          # Rows/paragraphs are whole units
+            yield from accumulator.add(segment["text"], segment)
+            continue
+        if "page" in segment:
+            lines = segment["text"].split("\n")
+        else:
+            lines = (pending_line + segment["text"]).split("\n")
+            pending_line = lines.pop()
+        for line in lines:
+            yield from accumulator.add(line, segment)
+
+    if pending_line:
+        yield from accumulator.add(pending_line, {})
+    yield from accumulator.flush()
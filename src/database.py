@@ -1,24 +1,57 @@
 import sqlite3
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 DB_NAME = "sqlite3.db"                          # Sqlite3 DB
 FAISS_BASE_PATH = "faiss_user_index"            # FAISS indexes
+DB_BUSY_TIMEOUT_MS = 5000                       # Wait for another writer instead of failing with "database is locked"
+_BULK_INSERT_BATCH = 500                        # Rows per executemany batch
 
-if not os.path.exists(FAISS_BASE_PATH):
-    os.makedirs(FAISS_BASE_PATH)
+_local = threading.local()                      # One connection per thread, reused by every call
+_initialized = False
+_init_lock = threading.Lock()
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# WAL: readers never block the writer (and vice versa), so concurrent sessions don't serialize on the file
+def _connect():
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")           # Durable at checkpoints, safe with WAL
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA cache_size=-16000")            # 16 MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-def create_tables():
+def get_db_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_name != DB_NAME:
+        conn = _connect()
+        _local.conn, _local.db_name = conn, DB_NAME
+    return conn
+
+# Connection of the current thread: committed at the end of the block, rolled back on error
+@contextmanager
+def _db():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _batches(rows):
+    rows = list(rows)
+    for start in range(0, len(rows), _BULK_INSERT_BATCH):
+        yield rows[start:start + _BULK_INSERT_BATCH]
+
+# Schema migrations, applied in order; PRAGMA user_version = number of migrations applied to the DB file
+# Version 1: tables created before migrations existed (CREATE IF NOT EXISTS -> also valid for older DB files)
+def _migration_1_tables(conn):
     # "users" table
-    cursor.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
@@ -27,7 +60,7 @@ def create_tables():
     """)
     
     # "chat_history" table (Stores user question and LLM answer pairs)
-    cursor.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS chat_history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -38,8 +71,19 @@ def create_tables():
     )
     """)
 
+    # "chat_summaries" table (Rolling summary of the user's first "summarized_turns" chat_history rows, see chat_memory.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_turns INTEGER NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+
     # "user_files" table
-    cursor.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS user_files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -49,83 +93,316 @@ def create_tables():
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     """)
-    conn.commit()
-    conn.close()
 
-def add_user(username, password_hash):
+    # "file_vectors" table (Links each FAISS vector/docstore ID to its "user_files" row)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS file_vectors (
+        file_id INTEGER NOT NULL,
+        vector_id TEXT NOT NULL,
+        FOREIGN KEY (file_id) REFERENCES user_files (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_file_vectors_file_id ON file_vectors (file_id)")
+
+    # "ingestion_jobs" table (Background file processing: queued -> running -> done/failed)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingestion_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        started_at DATETIME,
+        finished_at DATETIME,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_user_id ON ingestion_jobs (user_id)")
+
+    # "ingestion_job_files" table (Files of a job, spooled to disk until processed)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingestion_job_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        spool_path TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        chunks INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        FOREIGN KEY (job_id) REFERENCES ingestion_jobs (id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_job_files_job_id ON ingestion_job_files (job_id)")
+
+# Version 2: indexes for per-user queries, one "user_files" row per (user, file name)
+def _migration_2_indexes(conn):
+    # Duplicated file rows (older uploads) merged into the oldest one before the unique index
+    duplicates = conn.execute("""
+    SELECT MIN(id) AS kept_id, user_id, filename FROM user_files GROUP BY user_id, filename HAVING COUNT(*) > 1
+    """).fetchall()
+    for row in duplicates:
+        conn.execute("UPDATE file_vectors SET file_id = ? WHERE file_id IN (SELECT id FROM user_files WHERE user_id = ? AND filename = ?)",
+                     (row["kept_id"], row["user_id"], row["filename"]))
+        conn.execute("DELETE FROM user_files WHERE user_id = ? AND filename = ? AND id != ?", (row["user_id"], row["filename"], row["kept_id"]))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user_id_timestamp ON chat_history (user_id, timestamp)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_files_user_id_filename ON user_files (user_id, filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status)")
+
+# Version 3: content hash of the ingested file (bulk ingestion skips files already in the knowledge base, see bulk_ingest.py)
+def _migration_3_file_hashes(conn):
+    conn.execute("ALTER TABLE user_files ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_files_user_id_content_hash ON user_files (user_id, content_hash)")
+
+# Version 4: login tokens of the HTTP API (api.py), stored as SHA-256 hashes
+def _migration_4_api_tokens(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS api_tokens (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+
+# Version 5: content hashes of files parsed without any text (not in user_files; bulk ingestion skips them too)
+def _migration_5_empty_file_hashes(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS empty_file_hashes (
+        user_id INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        PRIMARY KEY (user_id, content_hash),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+
+_MIGRATIONS = [_migration_1_tables, _migration_2_indexes, _migration_3_file_hashes, _migration_4_api_tokens,
+               _migration_5_empty_file_hashes]
+
+# Brings the DB file to the latest schema version (several processes may start at once: one migrates, the others wait)
+def create_tables():
     conn = get_db_connection()
-    cursor = conn.cursor()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(_MIGRATIONS):
+        return
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migration_number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {migration_number}")
         conn.commit()
-        user_id = cursor.lastrowid
-        user_faiss_path = os.path.join(FAISS_BASE_PATH, str(user_id))           # Creates FAISS index by ID
-        if not os.path.exists(user_faiss_path):
-            os.makedirs(user_faiss_path)
-        return user_id
+    except BaseException:
+        conn.rollback()
+        raise
+
+def add_user(username, password_hash):
+    try:
+        with _db() as conn:
+            user_id = conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash)).lastrowid
     except sqlite3.IntegrityError:          # User already exists
         return None
-    finally:
-        conn.close()
+    user_faiss_path = os.path.join(FAISS_BASE_PATH, str(user_id))           # Creates FAISS index by ID
+    if not os.path.exists(user_faiss_path):
+        os.makedirs(user_faiss_path)
+    return user_id
 
 def get_user(username):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()            # Object or "None"
-    conn.close()
-    return user
+    with _db() as conn:
+        return conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()            # Object or "None"
+
+# API tokens (token hash -> user ID, valid for max_age_hours)
+def add_api_token(user_id, token_hash):
+    with _db() as conn:
+        conn.execute("INSERT INTO api_tokens (token_hash, user_id) VALUES (?, ?)", (token_hash, user_id))
+
+def get_api_token_user(token_hash, max_age_hours):
+    with _db() as conn:
+        row = conn.execute("SELECT user_id FROM api_tokens WHERE token_hash = ? AND created_at > datetime('now', ?)",
+                           (token_hash, f"-{float(max_age_hours)} hours")).fetchone()
+    return row["user_id"] if row else None
+
+def delete_api_token(token_hash):
+    with _db() as conn:
+        conn.execute("DELETE FROM api_tokens WHERE token_hash = ?", (token_hash,))
 
 # Chat History
 def save_chat_message(user_id, user_message, ai_response):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (?, ?, ?)",
-                   (user_id, user_message, ai_response))
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        return conn.execute("INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (?, ?, ?)",
+                            (user_id, user_message, ai_response)).lastrowid
 
-def load_chat_history(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_message, ai_response FROM chat_history WHERE user_id = ? ORDER BY timestamp ASC", (user_id,))
-    history_tuples = cursor.fetchall()          # tuple -> (AI_MESSAGE, USER_MESSAGE)
-    conn.close()
-    return history_tuples
+# offset -> skips the user's first rows (already summarized)
+def load_chat_history(user_id, offset=0, limit=-1):
+    with _db() as conn:
+        return conn.execute(
+            "SELECT user_message, ai_response FROM chat_history WHERE user_id = ? ORDER BY timestamp ASC, id ASC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        ).fetchall()          # tuple -> (AI_MESSAGE, USER_MESSAGE)
 
+# Keyset pagination (newest first): the user's `limit` last turns older than `before` = (timestamp, id) of the
+# oldest turn already loaded -> rows (id, timestamp, user_message, ai_response), cost ~ limit whatever the history size
+def load_chat_page(user_id, before=None, limit=20):
+    with _db() as conn:
+        if before is None:
+            return conn.execute("""
+            SELECT id, timestamp, user_message, ai_response FROM chat_history WHERE user_id = ?
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, (user_id, limit)).fetchall()
+        return conn.execute("""
+        SELECT id, timestamp, user_message, ai_response FROM chat_history WHERE user_id = ? AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+        """, (user_id, before[0], before[1], limit)).fetchall()
+
+def count_chat_turns(user_id):
+    with _db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM chat_history WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+# (summary, number of chat_history rows it covers)
+def get_chat_summary(user_id):
+    with _db() as conn:
+        row = conn.execute("SELECT summary, summarized_turns FROM chat_summaries WHERE user_id = ?", (user_id,)).fetchone()
+    return (row["summary"], row["summarized_turns"]) if row else ("", 0)
+
+def save_chat_summary(user_id, summary, summarized_turns):
+    with _db() as conn:
+        conn.execute("""
+        INSERT INTO chat_summaries (user_id, summary, summarized_turns, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, summarized_turns = excluded.summarized_turns, updated_at = excluded.updated_at
+        """, (user_id, summary, summarized_turns))
+
+# One row per (user, file name): a re-uploaded file keeps its ID (content hash reset until set_file_hashes) -> file ID
 def add_user_file_record(user_id, filename, faiss_index_subpath):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Prevents file name duplication
-    cursor.execute("SELECT id FROM user_files WHERE user_id = ? AND filename = ? AND faiss_index_subpath = ?", 
-                   (user_id, filename, faiss_index_subpath))
-    existing = cursor.fetchone()
-    if not existing:
-        cursor.execute("INSERT INTO user_files (user_id, filename, faiss_index_subpath) VALUES (?, ?, ?)",
-                       (user_id, filename, faiss_index_subpath))
-        conn.commit()
-    conn.close()
+    return add_user_file_records(user_id, [filename], faiss_index_subpath)[filename]
+
+# Several files in one transaction -> {filename: file ID}
+def add_user_file_records(user_id, filenames, faiss_index_subpath):
+    file_ids = {}
+    with _db() as conn:
+        for filename in dict.fromkeys(filenames):
+            file_ids[filename] = conn.execute("""
+            INSERT INTO user_files (user_id, filename, faiss_index_subpath) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, filename) DO UPDATE SET faiss_index_subpath = excluded.faiss_index_subpath, processed_at = CURRENT_TIMESTAMP,
+                                                          content_hash = NULL
+            RETURNING id
+            """, (user_id, filename, faiss_index_subpath)).fetchone()["id"]
+    return file_ids
+
+# {file ID: content hash}, set once the file's vectors are saved (a crash before -> no hash, file ingested again)
+def set_file_hashes(hashes_by_file_id):
+    with _db() as conn:
+        for batch in _batches((content_hash, file_id) for file_id, content_hash in hashes_by_file_id.items()):
+            conn.executemany("UPDATE user_files SET content_hash = ? WHERE id = ?", batch)
+
+def add_empty_file_hashes(user_id, content_hashes):
+    with _db() as conn:
+        for batch in _batches((user_id, content_hash) for content_hash in content_hashes):
+            conn.executemany("INSERT OR IGNORE INTO empty_file_hashes (user_id, content_hash) VALUES (?, ?)", batch)
+
+# Contents already processed for a user: ingested files + files without text
+def get_user_file_hashes(user_id):
+    with _db() as conn:
+        return {row["content_hash"] for row in conn.execute("""
+        SELECT content_hash FROM user_files WHERE user_id = ? AND content_hash IS NOT NULL
+        UNION SELECT content_hash FROM empty_file_hashes WHERE user_id = ?
+        """, (user_id, user_id))}
 
 def get_user_files(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, filename, faiss_index_subpath, processed_at FROM user_files WHERE user_id = ? ORDER BY processed_at DESC", (user_id,))
-    files = cursor.fetchall()
-    conn.close()
-    return files
+    with _db() as conn:
+        return conn.execute("SELECT id, filename, faiss_index_subpath, processed_at FROM user_files WHERE user_id = ? ORDER BY processed_at DESC",
+                            (user_id,)).fetchall()
 
 def delete_user_file(file_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM user_files WHERE id = ?", (file_id,))
-    conn.commit()
-    rows_deleted = cursor.rowcount
-    conn.close()
+    with _db() as conn:
+        conn.execute("DELETE FROM file_vectors WHERE file_id = ?", (file_id,))
+        rows_deleted = conn.execute("DELETE FROM user_files WHERE id = ?", (file_id,)).rowcount
     return rows_deleted > 0
 
+# File -> vector IDs (FAISS/docstore IDs of the file chunks)
+def set_file_vectors(file_id, vector_ids):
+    with _db() as conn:
+        conn.execute("DELETE FROM file_vectors WHERE file_id = ?", (file_id,))            # Re-uploaded file -> replaces old vectors
+        for batch in _batches((file_id, vector_id) for vector_id in vector_ids):
+            conn.executemany("INSERT INTO file_vectors (file_id, vector_id) VALUES (?, ?)", batch)
+
+def get_file_vector_ids(file_id):
+    with _db() as conn:
+        return [row["vector_id"] for row in conn.execute("SELECT vector_id FROM file_vectors WHERE file_id = ?", (file_id,))]
+
+def get_user_file_vector_ids(user_id, filename):
+    with _db() as conn:
+        return [row["vector_id"] for row in conn.execute("""
+        SELECT fv.vector_id FROM file_vectors fv
+        JOIN user_files uf ON uf.id = fv.file_id
+        WHERE uf.user_id = ? AND uf.filename = ?
+        """, (user_id, filename))]
+
+# Number of vectors linked to a file (vectors from older uploads have no link)
+def count_user_vectors(user_id):
+    with _db() as conn:
+        return conn.execute("""
+        SELECT COUNT(*) FROM file_vectors fv
+        JOIN user_files uf ON uf.id = fv.file_id
+        WHERE uf.user_id = ?
+        """, (user_id,)).fetchone()[0]
+
+# Ingestion jobs: files -> [(filename, spool path)] -> job ID
+def create_ingestion_job(user_id, files):
+    with _db() as conn:
+        job_id = conn.execute("INSERT INTO ingestion_jobs (user_id) VALUES (?)", (user_id,)).lastrowid
+        for batch in _batches((job_id, filename, spool_path) for filename, spool_path in files):
+            conn.executemany("INSERT INTO ingestion_job_files (job_id, filename, spool_path) VALUES (?, ?, ?)", batch)
+    return job_id
+
+def get_ingestion_job(job_id):
+    with _db() as conn:
+        return conn.execute("SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)).fetchone()
+
+def get_user_ingestion_jobs(user_id, limit=5):
+    with _db() as conn:
+        return conn.execute("SELECT * FROM ingestion_jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit)).fetchall()
+
+def get_ingestion_job_files(job_id):
+    with _db() as conn:
+        return conn.execute("SELECT * FROM ingestion_job_files WHERE job_id = ? ORDER BY id ASC", (job_id,)).fetchall()
+
+# Jobs interrupted by a restart (running) are queued again, in submission order
+def get_unfinished_ingestion_jobs():
+    with _db() as conn:
+        conn.execute("UPDATE ingestion_jobs SET status = 'queued' WHERE status = 'running'")
+        conn.execute("UPDATE ingestion_job_files SET status = 'queued' WHERE status = 'running'")
+        return [row["id"] for row in conn.execute("SELECT id FROM ingestion_jobs WHERE status = 'queued' ORDER BY id ASC")]
+
+def update_ingestion_job(job_id, status=None, progress=None, message=None, error=None):
+    with _db() as conn:
+        if status == "running":
+            conn.execute("UPDATE ingestion_jobs SET started_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+        elif status in ("done", "failed"):
+            conn.execute("UPDATE ingestion_jobs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?", (job_id,))
+        conn.execute("""
+        UPDATE ingestion_jobs SET status = COALESCE(?, status), progress = COALESCE(?, progress),
+                                  message = COALESCE(?, message), error = COALESCE(?, error)
+        WHERE id = ?
+        """, (status, progress, message, error, job_id))
+
+def update_ingestion_job_file(job_file_id, status, chunks=None, error=None):
+    with _db() as conn:
+        conn.execute("UPDATE ingestion_job_files SET status = ?, chunks = COALESCE(?, chunks), error = ? WHERE id = ?",
+                     (status, chunks, error, job_file_id))
+
 # Returns FAISS index path (Auxiliary Function)
 def get_user_faiss_path(user_id):
     return os.path.join(FAISS_BASE_PATH, str(user_id))
 
-# Creates tables on the first import, if necessary
-create_tables()
\ No newline at end of file
+# Startup step (explicit, idempotent): FAISS base directory + schema migrations, once per process
+# Importing this module has no side effect; entry points (app.py, CLIs) call this before using the DB
+def init_db():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            os.makedirs(FAISS_BASE_PATH, exist_ok=True)
+            create_tables()
+            _initialized = True
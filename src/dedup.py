@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import zlib
+
+import numpy as np
+
+from metrics import count
+
+# Ingest-time deduplication of chunks (files uploaded twice, exports of the same table, repeated boilerplate):
+#   exact -> same text once whitespace is collapsed (sha1; case kept: "US" is not "us"), within the batch and in
+#            the knowledge base
+#   near  -> exact + chunks of the same file, in the batch or already stored, whose MinHash (word 3-shingles, LSH
+#            bands) estimated Jaccard similarity reaches the threshold (near-identical spreadsheet rows)
+# Near-duplicates are never matched across files: a revision changing one amount or date is ~0.97 similar to
+# the old text and must be stored (answered from) as it is
+# A duplicate is not embedded nor indexed: its ID becomes a reference to the chunk already stored (see chunk_store.py)
+DEFAULT_DEDUP_MODE = "exact"            # off | exact | near
+DEFAULT_DEDUP_THRESHOLD = 0.9           # Min estimated Jaccard similarity of near-duplicates (same file)
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 8                           # 8 bands x 8 rows: chunks 90% similar share a band 99% of the time (80%: 83%)
+SHINGLE_WORDS = 3
+
+_WORD = re.compile(r"\w+")
+_random = np.random.RandomState(20240521)
+_HASH_A = _random.randint(1, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _random.randint(0, 2 ** 63, NUM_PERMUTATIONS, dtype=np.uint64)
+_ROWS_PER_BAND = NUM_PERMUTATIONS // LSH_BANDS
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+def get_dedup_mode():
+    mode = os.getenv("RAGIFY_DEDUP", DEFAULT_DEDUP_MODE).lower()
+    return mode if mode in ("off", "exact", "near") else DEFAULT_DEDUP_MODE
+
+def get_dedup_threshold():
+    return float(os.getenv("RAGIFY_DEDUP_THRESHOLD", DEFAULT_DEDUP_THRESHOLD))
+
+def content_hash(text):
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+# MinHash signature (NUM_PERMUTATIONS uint32) of the word shingles: word crc32s combined per shingle (numpy),
+# then multiply-shift hashes, one per permutation
+def minhash(text):
+    words = _WORD.findall(text.lower()) or [""]
+    word_hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64, count=len(words))
+    n_shingles = max(1, len(words) - SHINGLE_WORDS + 1)
+    shingles = np.zeros(n_shingles, dtype=np.uint64)
+    for offset in range(min(SHINGLE_WORDS, len(words))):
+        shingles = shingles * _SHINGLE_MULTIPLIER + word_hashes[offset:offset + n_shingles]
+    hashes = np.unique(shingles)
+    return ((hashes[:, None] * _HASH_A + _HASH_B) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+# LSH buckets of a signature (one signed 64-bit key per band, band number included)
+def lsh_buckets(signature):
+    return [int.from_bytes(hashlib.blake2b(bytes([band]) + signature[band * _ROWS_PER_BAND:(band + 1) * _ROWS_PER_BAND].tobytes(),
+                                           digest_size=8).digest(), "little", signed=True)
+            for band in range(LSH_BANDS)]
+
+def similarity(signature, other):
+    return float(np.mean(signature == other))
+
+# File of a chunk (near-duplicates are only looked for among the chunks of the same file)
+def _file_key(metadata):
+    metadata = metadata or {}
+    return metadata.get("file_id", metadata.get("source"))
+
+# Duplicates of a batch of texts, within the batch and among the chunks of `chunk_store` (labels in exclude_labels
+# ignored: tombstoned, about to be removed) -> (content hashes, MinHash signatures (near mode, else None), matches)
+# matches[i] = None (unique) | (source, position of the earlier text | stored label, kind),
+# source = "batch" | "store", kind = "exact" | "near"
+def find_duplicates(texts, metadatas=None, chunk_store=None, exclude_labels=(), mode=None, threshold=None):
+    mode = mode or get_dedup_mode()
+    threshold = get_dedup_threshold() if threshold is None else threshold
+    hashes = [content_hash(text) for text in texts]
+    signatures = [minhash(text) for text in texts] if mode == "near" else [None] * len(texts)
+    if mode == "off":
+        return hashes, signatures, [None] * len(texts)
+    metadatas = metadatas or [{} for _ in texts]
+    file_keys = [_file_key(metadata) for metadata in metadatas]
+    stored = stored_near = [None] * len(texts)
+    if chunk_store is not None:
+        stored = chunk_store.find_duplicates(hashes, exclude_labels)
+        if mode == "near":
+            stored_near = chunk_store.find_near_duplicates(signatures, [(metadata or {}).get("file_id") for metadata in metadatas],
+                                                           exclude_labels, threshold)
+
+    matches, positions_by_hash, positions_by_bucket = [], {}, {}
+    for position, (text_hash, stored_label) in enumerate(zip(hashes, stored)):
+        if text_hash in positions_by_hash:
+            matches.append(("batch", positions_by_hash[text_hash], "exact"))
+            continue
+        if stored_label is not None:
+            matches.append(("store", stored_label, "exact"))
+            continue
+        buckets = []
+        if mode == "near":
+            signature = signatures[position]
+            buckets = [(file_keys[position], bucket) for bucket in lsh_buckets(signature)]
+            candidates = {candidate for bucket in buckets for candidate in positions_by_bucket.get(bucket, ())}
+            best = max(candidates, key=lambda candidate: similarity(signature, signatures[candidate]), default=None)
+            if best is not None and similarity(signature, signatures[best]) >= threshold:
+                matches.append(("batch", best, "near"))
+                continue
+            if stored_near[position] is not None:
+                matches.append(("store", stored_near[position], "near"))
+                continue
+        matches.append(None)
+        positions_by_hash[text_hash] = position
+        for bucket in buckets:
+            positions_by_bucket.setdefault(bucket, []).append(position)
+    return hashes, signatures, matches
+
+# Counts the outcome of a dedup pass (ingestion trace + Prometheus) -> {"unique", "exact", "near"}
+def record_dedup_stats(matches):
+    stats = {"unique": 0, "exact": 0, "near": 0}
+    for match in matches:
+        stats["unique" if match is None else match[2]] += 1
+    for result, value in stats.items():
+        if value:
+            count("dedup_chunks", value, result=result)
+    return stats
+
+# In-memory (guest) indexes: duplicates inside the batch are dropped -> (texts, metadatas, ids) kept
+def drop_duplicates(texts, metadatas=None, ids=None):
+    _, _, matches = find_duplicates(texts, metadatas)
+    record_dedup_stats(matches)
+    keep = [position for position, match in enumerate(matches) if match is None]
+    return ([texts[position] for position in keep], [metadatas[position] for position in keep] if metadatas else metadatas,
+            [ids[position] for position in keep] if ids else ids)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+EMBEDDING_CACHE_DB = "embedding_cache.db"          # Sqlite3 DB (next to sqlite3.db)
+DEFAULT_EMBEDDING_CACHE_MB = 512
+_LOOKUP_BATCH = 500                                 # Max "?" per SELECT ... IN (...)
+
+# Content-addressed cache: sha256(model name + chunk text) -> float32 vector
+class EmbeddingCache:
+    def __init__(self, db_path=EMBEDDING_CACHE_DB, max_bytes=DEFAULT_EMBEDDING_CACHE_MB * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key BLOB PRIMARY KEY,
+            dim INTEGER NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+    # Returns {key: vector} for every key found (and refreshes their LRU timestamp)
+    def get_many(self, keys):
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), _LOOKUP_BATCH):
+                batch = unique_keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = {}
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows[key] = (key, len(blob) // 4, blob, now)
+        if not rows:
+            return
+        with self._lock:
+            keys = list(rows)
+            replaced_bytes = 0                  # Vectors overwritten by INSERT OR REPLACE (already counted)
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                replaced_bytes += self._conn.execute(f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                                                     batch).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)", list(rows.values()))
+            self._conn.commit()
+            self._size_bytes += sum(len(row[2]) for row in rows.values()) - replaced_bytes
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    # Drops least recently used vectors until the cache is back under 90% of its budget
+    def _evict(self):
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        while self._size_bytes > target:
+            oldest = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC LIMIT 1000").fetchall()
+            if not oldest:
+                break
+            to_delete = []
+            for key, size in oldest:
+                to_delete.append((key,))
+                self._size_bytes -= size
+                if self._size_bytes <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", to_delete)
+            self._conn.commit()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size_bytes": self._size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+# Builds the cache from the environment (RAGIFY_EMBEDDING_CACHE_MB=0 disables it)
+def create_embedding_cache():
+    max_mb = float(os.getenv("RAGIFY_EMBEDDING_CACHE_MB", DEFAULT_EMBEDDING_CACHE_MB))
+    if max_mb <= 0:
+        return None
+    return EmbeddingCache(os.getenv("RAGIFY_EMBEDDING_CACHE_DB", EMBEDDING_CACHE_DB), int(max_mb * 1024 * 1024))
@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import create_embedding_cache
+from metrics import count, observe_value, register_gauges, timed
+
+EMBEDDING_MODEL_NAME = "nomic-ai/nomic-embed-text-v1"
+DEFAULT_EMBEDDING_BATCH_SIZE = 32
+DEFAULT_QUERY_BATCH_SIZE = 32           # Questions embedded in one forward pass (1 disables the query batching)
+DEFAULT_QUERY_BATCH_WAIT_MS = 5         # Time a batch waits for more questions, only while questions arrive concurrently
+
+_engine = None                          # Process-wide engine (shared by every Streamlit session)
+_engine_lock = threading.Lock()
+
+# Query embeddings of every session, run as batched forward passes by one worker thread
+# Questions arriving while a batch is in the model form the next batch. Once questions arrive concurrently (last batch
+# held several), a batch also waits up to max_wait_ms for more; a lone question is embedded at once (no added latency)
+class QueryBatcher:
+    def __init__(self, embed_batch, max_batch_size=DEFAULT_QUERY_BATCH_SIZE, max_wait_ms=DEFAULT_QUERY_BATCH_WAIT_MS):
+        self._embed_batch = embed_batch         # [texts] -> [vectors] (one forward pass)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue = queue.Queue()             # {"text", "done", "vector", "error"}
+        self._under_load = False
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.batches_run = 0
+        self.queries_embedded = 0
+
+    def embed(self, text):
+        request = {"text": text, "done": threading.Event(), "vector": None, "error": None}
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-embedding", daemon=True)
+                    self._worker.start()
+        self._queue.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["vector"]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        observe_value("query_embedding_queue_depth", self._queue.qsize() + 1)
+        deadline = time.monotonic() + (self.max_wait if self._under_load else 0.0)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._under_load = len(batch) > 1
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            observe_value("query_embedding_batch_size", len(batch))
+            try:
+                vectors = self._embed_batch([request["text"] for request in batch])
+                for request, vector in zip(batch, vectors):
+                    request["vector"] = vector
+            except Exception as e:          # Raised in every caller of the batch
+                for request in batch:
+                    request["error"] = e
+            finally:
+                self.batches_run += 1
+                self.queries_embedded += len(batch)
+                for request in batch:
+                    request["done"].set()
+
+    def get_stats(self):
+        batches, queries = self.batches_run, self.queries_embedded
+        return {"max_batch_size": self.max_batch_size, "max_wait_ms": round(self.max_wait * 1000, 3), "batches_run": batches,
+                "queries_embedded": queries, "mean_batch_size": round(queries / batches, 2) if batches else 0.0,
+                "queue_depth": self._queue.qsize()}
+
+# Embedding engine: loads the model once and encodes in fixed-size batches
+# Query embeddings go through a QueryBatcher (concurrent questions share forward passes) unless query_batch_size is 1
+class EmbeddingEngine(Embeddings):
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, base_embeddings=None, cache=None,
+                 query_batch_size=DEFAULT_QUERY_BATCH_SIZE, query_batch_wait_ms=DEFAULT_QUERY_BATCH_WAIT_MS):
+        self.model_name = model_name
+        self.batch_size = max(1, int(batch_size))
+        self._base = base_embeddings            # Underlying model (loaded on first use if None)
+        self.cache = cache                      # Optional EmbeddingCache (checked before any chunk is embedded)
+        self.query_batcher = QueryBatcher(self._embed_queries, query_batch_size, query_batch_wait_ms) if int(query_batch_size) > 1 else None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.texts_embedded = 0
+        self.batches_run = 0
+        self.seconds_spent = 0.0
+
+    def _get_base(self):
+        if self._base is None:
+            with self._load_lock:
+                if self._base is None:
+                    from langchain_community.embeddings import HuggingFaceEmbeddings          # nomic-embed (loads torch)
+                    self._base = HuggingFaceEmbeddings(
+                        model_name=self.model_name,
+                        model_kwargs={"trust_remote_code": True},
+                        encode_kwargs={"batch_size": self.batch_size}
+                    )
+        return self._base
+
+    def _record(self, n_texts, seconds):
+        with self._stats_lock:
+            self.texts_embedded += n_texts
+            self.batches_run += 1
+            self.seconds_spent += seconds
+
+    def _embed_batches(self, texts):
+        base = self._get_base()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            t0 = time.perf_counter()
+            vectors.extend(base.embed_documents(batch))
+            self._record(len(batch), time.perf_counter() - t0)
+        return vectors
+
+    @timed("embedding")
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if self.cache is None:
+            return self._embed_batches(texts)
+
+        keys = [self.cache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Only texts not seen before go through the model (each distinct text once)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        count("embedding_cache_lookups", len(keys) - len(missing), result="hit")
+        count("embedding_cache_lookups", len(missing), result="miss")
+        if missing:
+            new_vectors = self._embed_batches(list(missing.values()))
+            new_items = list(zip(missing.keys(), new_vectors))
+            self.cache.put_many(new_items)
+            found.update(new_items)
+        return [found[key] for key in keys]
+
+    # One forward pass for several questions (HuggingFaceEmbeddings.embed_query(text) is embed_documents([text])[0])
+    def _embed_queries(self, texts):
+        base = self._get_base()
+        t0 = time.perf_counter()
+        vectors = base.embed_documents(texts) if len(texts) > 1 else [base.embed_query(texts[0])]
+        self._record(len(texts), time.perf_counter() - t0)
+        return vectors
+
+    @timed("query_embedding")
+    def embed_query(self, text):
+        if self.query_batcher is not None:
+            return self.query_batcher.embed(text)
+        return self._embed_queries([text])[0]
+
+    # Throughput counter (texts/s measured over the time spent inside the model)
+    def get_stats(self):
+        with self._stats_lock:
+            texts, batches, seconds = self.texts_embedded, self.batches_run, self.seconds_spent
+        stats = {
+            "model_name": self.model_name,
+            "batch_size": self.batch_size,
+            "texts_embedded": texts,
+            "batches_run": batches,
+            "seconds_spent": round(seconds, 3),
+            "texts_per_second": round(texts / seconds, 2) if seconds > 0 else 0.0,
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.get_stats()
+        if self.query_batcher is not None:
+            stats["query_batching"] = self.query_batcher.get_stats()
+        return stats
+
+# Returns the shared engine, creating it on the first call
+def get_embedding_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                batch_size = int(os.getenv("RAGIFY_EMBEDDING_BATCH_SIZE", DEFAULT_EMBEDDING_BATCH_SIZE))
+                _engine = EmbeddingEngine(batch_size=batch_size, cache=create_embedding_cache(),
+                                          query_batch_size=int(os.getenv("RAGIFY_QUERY_BATCH_SIZE", DEFAULT_QUERY_BATCH_SIZE)),
+                                          query_batch_wait_ms=float(os.getenv("RAGIFY_QUERY_BATCH_WAIT_MS", DEFAULT_QUERY_BATCH_WAIT_MS)))
+                register_gauges("embedding_engine", _engine.get_stats)
+    return _engine
+
+# Replaces the shared engine (offline runs: benchmark.py installs a stub model)
+def set_embedding_engine(engine):
+    global _engine
+    with _engine_lock:
+        _engine = engine
+    register_gauges("embedding_engine", engine.get_stats)
@@ -0,0 +1,158 @@
+import codecs
+import csv
+import io
+import multiprocessing
+import os
+import queue
+import time
+
+DEFAULT_EXTRACTION_TIMEOUT = 120            # Seconds per file
+MIN_POOL_BYTES = 2 * 1024 * 1024            # Smaller batches are parsed inline (starting workers costs more)
+_POLL_INTERVAL = 0.02
+
+_started_queue = None                       # Worker -> parent "file started" notifications
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".xlsx", ".csv", ".txt", ".md")
+_TEXT_SNIFF_BYTES = 64 * 1024               # Prefix used to pick the encoding of streamed text files
+_TEXT_SEGMENT_CHARS = 64 * 1024             # Streamed text files are yielded in pieces of this size
+
+def is_supported(filename):
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+# Picks the encoding of a text stream (utf-8 -> latin-1) from its first bytes, then rewinds it
+def _sniff_encoding(stream):
+    prefix = stream.read(_TEXT_SNIFF_BYTES)
+    stream.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+# Opens a binary stream as text (utf-8 errors after the sniffed prefix are replaced)
+def _text_stream(stream):
+    return io.TextIOWrapper(stream, encoding=_sniff_encoding(stream), errors="replace", newline="")
+
+# Parses one file into text segments, one page/paragraph/row at a time (each one keeps where it came from)
+# Parsers are imported on first use (not needed to start the app)
+def iter_segments(filename, stream):
+    name = filename.lower()
+    if name.endswith(".pdf"):
+        from PyPDF2 import PdfReader
+        pdf_reader = PdfReader(stream)
+        for page_number, page in enumerate(pdf_reader.pages, start=1):
+            yield {"text": page.extract_text() or "", "page": page_number}
+    elif name.endswith(".docx"):
+        from docx import Document
+        doc = Document(stream)
+        for paragraph_number, para in enumerate(doc.paragraphs, start=1):
+            yield {"text": para.text + "\n", "paragraph": paragraph_number}
+    elif name.endswith(".xlsx"):
+        import openpyxl
+        wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)         # Rows are streamed from the XML
+        try:
+            for sheet in wb.worksheets:
+                for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                    yield {"text": ' '.join([str(cell) if cell is not None else '' for cell in row]) + "\n",
+                           "sheet": sheet.title, "row": row_number}
+        finally:
+            wb.close()
+    elif name.endswith(".csv"):
+        text_stream = _text_stream(stream)
+        try:
+            for row_number, row in enumerate(csv.reader(text_stream), start=1):
+                yield {"text": ' | '.join(row) + "\n", "row": row_number}
+        finally:
+            text_stream.detach()
+    elif name.endswith(".txt") or name.endswith(".md"):
+        text_stream = _text_stream(stream)
+        try:
+            while True:
+                piece = text_stream.read(_TEXT_SEGMENT_CHARS)
+                if not piece:
+                    break
+                yield {"text": piece}
+            yield {"text": "\n"}
+        finally:
+            text_stream.detach()
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+# Parses one file into a list of segments (None -> unsupported format)
+def extract_segments(filename, data):
+    if not is_supported(filename):
+        return None
+    return list(iter_segments(filename, io.BytesIO(data)))
+
+# Per-file result: {"name", "status" (ok/unsupported/error/timeout), "segments", "error"}
+def extract_file(filename, data):
+    try:
+        segments = extract_segments(filename, data)
+    except Exception as e:
+        return {"name": filename, "status": "error", "segments": [], "error": str(e)}
+    if segments is None:
+        return {"name": filename, "status": "unsupported", "segments": [], "error": None}
+    return {"name": filename, "status": "ok", "segments": segments, "error": None}
+
+def _init_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+def _extract_task(position, filename, data):
+    _started_queue.put(position)
+    return extract_file(filename, data)
+
+# Parses every file in a process pool (PDF/XLSX parsing is CPU-bound and holds the GIL)
+# files -> [(filename, bytes)]; results come back in the same order
+def extract_files(files, workers=None, timeout=None):
+    files = list(files)
+    if workers is None:
+        workers = int(os.getenv("RAGIFY_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+    if timeout is None:
+        timeout = float(os.getenv("RAGIFY_EXTRACTION_TIMEOUT", DEFAULT_EXTRACTION_TIMEOUT))
+
+    if workers <= 1 or len(files) <= 1 or sum(len(data) for _, data in files) < MIN_POOL_BYTES:
+        return [extract_file(filename, data) for filename, data in files]
+
+    results = [None] * len(files)
+    remaining = list(range(len(files)))
+    ctx = multiprocessing.get_context("spawn")          # No fork of the (multi-threaded) Streamlit process
+
+    # A file that exceeds the timeout kills the pool; the files still pending run in a new one
+    while remaining:
+        started_queue = ctx.Queue()
+        pool = ctx.Pool(processes=min(workers, len(remaining)), initializer=_init_worker, initargs=(started_queue,))
+        pending = {position: pool.apply_async(_extract_task, (position, *files[position])) for position in remaining}
+        started_at = {}
+        timed_out = False
+        try:
+            while pending and not timed_out:
+                while True:
+                    try:
+                        started_at[started_queue.get_nowait()] = time.monotonic()
+                    except queue.Empty:
+                        break
+                now = time.monotonic()
+                for position in list(pending):
+                    async_result = pending[position]
+                    if async_result.ready():
+                        try:
+                            results[position] = async_result.get()
+                        except Exception as e:
+                            results[position] = {"name": files[position][0], "status": "error", "segments": [], "error": str(e)}
+                        del pending[position]
+                    elif position in started_at and now - started_at[position] > timeout:
+                        results[position] = {"name": files[position][0], "status": "timeout", "segments": [],
+                                             "error": f"Timed out after {timeout:g}s"}
+                        del pending[position]
+                        timed_out = True
+                if pending and not timed_out:
+                    time.sleep(_POLL_INTERVAL)
+        finally:
+            if pending or timed_out:            # Hung worker(s) -> killed
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+        remaining = [position for position in remaining if results[position] is None]
+    return results
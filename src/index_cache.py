@@ -0,0 +1,198 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from chunk_store import ChunkStore, ChunkStoreFAISS
+from metrics import register_gauges, timed
+from segments import get_manifest_path, load_parts, read_manifest, save_segment, write_index
+from vector_index import EXACT_TYPES, build_index, estimate_index_bytes, get_index_type, reconstruct_all
+
+FAISS_INDEX_NAME = "index"              # Name of every user's index files (app, API, bulk ingestion)
+DEFAULT_INDEX_CACHE_MB = 1024
+_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+_LOAD_ATTEMPTS = 3
+
+_cache = None                           # Process-wide cache (shared by every Streamlit session)
+_cache_lock = threading.Lock()
+_migration_lock = threading.Lock()
+
+def get_chunk_store_path(user_faiss_dir_path, faiss_index_name_const):
+    return os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}_chunks.db")
+
+# Index version = size + mtime of the manifest (replaced on every save, from any process)
+def get_index_version(user_faiss_dir_path, faiss_index_name_const):
+    for file_path in (get_manifest_path(user_faiss_dir_path, faiss_index_name_const),
+                      os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.faiss")):        # Saved before segments
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    return None
+
+def index_exists(user_faiss_dir_path, faiss_index_name_const):
+    return get_index_version(user_faiss_dir_path, faiss_index_name_const) is not None
+
+# Saves the new vectors of a vectorstore as a new segment + its deletions (see segments.py)
+@timed("index_save")
+def save_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const):
+    return save_segment(vectorstore, user_faiss_dir_path, faiss_index_name_const)
+
+# Loads a user's index parts (base + segments) + opens its chunk store (texts stay on disk)
+# Parts are never modified once saved, so they are memory-mapped when their type allows it (pages shared between sessions)
+@timed("index_load")
+def load_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings):
+    manifest = read_manifest(user_faiss_dir_path, faiss_index_name_const)
+    base, segments = load_parts(user_faiss_dir_path, manifest, _MMAP_FLAGS)
+    chunk_store = ChunkStore(get_chunk_store_path(user_faiss_dir_path, faiss_index_name_const))
+    return ChunkStoreFAISS(embeddings, base, chunk_store, segments, manifest)
+
+# Empty vectorstore backed by the user's chunk store (the index is created on the first add)
+def create_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings):
+    os.makedirs(user_faiss_dir_path, exist_ok=True)
+    return ChunkStoreFAISS(embeddings, None, ChunkStore(get_chunk_store_path(user_faiss_dir_path, faiss_index_name_const)))
+
+# One-time conversion of an index saved by FAISS.save_local (index.pkl docstore) to the chunk store
+def migrate_pickled_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings):
+    pkl_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.pkl")
+    if not os.path.exists(pkl_path):
+        return False
+    with _migration_lock:
+        if not os.path.exists(pkl_path):            # Migrated by another session meanwhile
+            return False
+        faiss_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.faiss")
+        with open(pkl_path, "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)         # Written by this app (trusted)
+        old_index = faiss.read_index(faiss_path)
+        vector_ids = [vector_id for _, vector_id in sorted(index_to_docstore_id.items())]
+        docs = [docstore.search(vector_id) for vector_id in vector_ids]
+
+        chunk_store_path = get_chunk_store_path(user_faiss_dir_path, faiss_index_name_const)
+        if os.path.exists(chunk_store_path):            # Leftover of an interrupted migration
+            os.remove(chunk_store_path)
+        chunk_store = ChunkStore(chunk_store_path)
+        labels = chunk_store.add({vector_id: doc for vector_id, doc in zip(vector_ids, docs)})
+        chunk_store.close()
+        index_type = get_index_type(old_index)
+        if index_type in EXACT_TYPES:
+            vectors, positions = reconstruct_all(old_index)           # Plain index: labels = positions
+            vectors = vectors[np.argsort(positions)]
+        else:
+            vectors = np.array(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+        if labels:
+            index, _ = build_index(index_type, vectors, labels)
+        else:
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(old_index.d))
+        write_index(index, faiss_path)
+        os.remove(pkl_path)
+        return True
+
+def _estimate_bytes(vectorstore):
+    return sum(estimate_index_bytes(part) for part in vectorstore.parts())         # Texts stay in the on-disk chunk store
+
+# LRU cache of loaded per-user vectorstores: key -> (index version, vectorstore), bounded by a memory budget
+# Cached vectorstores are shared: they are only searched, never modified in place
+class IndexCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()           # key -> {"version", "vectorstore", "bytes"}
+        self._lock = threading.Lock()
+        self._key_locks = {}                    # One loader per key at a time
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, version):
+        entry = self._entries.get(key)
+        if entry is not None and entry["version"] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["vectorstore"]
+        return None
+
+    def get(self, key, version, loader):
+        with self._lock:
+            vectorstore = self._lookup(key, version)
+            if vectorstore is not None:
+                return vectorstore
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                vectorstore = self._lookup(key, version)            # Loaded by another session meanwhile
+                if vectorstore is not None:
+                    return vectorstore
+                self.misses += 1
+            vectorstore, size_bytes = loader()
+            self.put(key, version, vectorstore, size_bytes)
+            return vectorstore
+
+    def put(self, key, version, vectorstore, size_bytes):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {"version": version, "vectorstore": vectorstore, "bytes": size_bytes}
+            total = sum(entry["bytes"] for entry in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted["bytes"]
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+def get_index_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_mb = float(os.getenv("RAGIFY_INDEX_CACHE_MB", DEFAULT_INDEX_CACHE_MB))
+                _cache = IndexCache(max_mb * 1024 * 1024)
+                register_gauges("index_cache", _cache.get_stats)
+    return _cache
+
+# Shared, read-only vectorstore of a user (warm for every session/tab until the index changes)
+def get_cached_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings):
+    def loader():
+        # Retries if the manifest was replaced while loading (files of the old version may be gone)
+        for attempt in range(_LOAD_ATTEMPTS):
+            before = get_index_version(user_faiss_dir_path, faiss_index_name_const)
+            try:
+                vectorstore = load_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
+            except RuntimeError:
+                if attempt == _LOAD_ATTEMPTS - 1:
+                    raise
+                continue
+            if get_index_version(user_faiss_dir_path, faiss_index_name_const) == before:
+                break
+        return vectorstore, _estimate_bytes(vectorstore)
+
+    version = get_index_version(user_faiss_dir_path, faiss_index_name_const)
+    if version is None:
+        return None
+    return get_index_cache().get(user_faiss_dir_path, version, loader)
+
+# After a save: the saved (private) vectorstore becomes the cached one for its new version
+def update_cached_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const):
+    version = get_index_version(user_faiss_dir_path, faiss_index_name_const)
+    if version is None:
+        get_index_cache().invalidate(user_faiss_dir_path)
+    else:
+        get_index_cache().put(user_faiss_dir_path, version, vectorstore, _estimate_bytes(vectorstore))
+
+def invalidate_cached_vectorstore(user_faiss_dir_path):
+    get_index_cache().invalidate(user_faiss_dir_path)
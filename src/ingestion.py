@@ -0,0 +1,77 @@
+import os
+import uuid
+
+from extraction import is_supported, iter_segments
+from chunking import iter_chunks
+from metrics import timed
+from utils import delete_vectors
+
+DEFAULT_STREAMING_BATCH_CHUNKS = 256
+DEFAULT_STREAMING_MIN_MB = 20
+
+def _file_size(file):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+# Large uploads go through the streaming path (RAGIFY_STREAMING_MIN_MB=0 streams everything)
+def should_stream(uploaded_files):
+    min_bytes = float(os.getenv("RAGIFY_STREAMING_MIN_MB", DEFAULT_STREAMING_MIN_MB)) * 1024 * 1024
+    return any(_file_size(file) >= min_bytes for file in uploaded_files)
+
+def _add_batch(vectorstore, batch, file_chunk_ids):
+    ids = [str(uuid.uuid4()) for _ in batch]
+    metadatas = [metadata for _, metadata in batch]
+    batch = [chunk_text for chunk_text, _ in batch]
+    file_chunk_ids.extend(ids)
+    if not hasattr(vectorstore, "apply_pending_deletes"):         # In-memory (guest) index: duplicates inside the batch dropped
+        from dedup import drop_duplicates           # The chunk store vectorstore deduplicates itself (see chunk_store.py)
+        batch, metadatas, ids = drop_duplicates(batch, metadatas, ids)
+    if vectorstore is None:
+        from langchain.vectorstores import FAISS          # Imported on the first ingested batch (startup stays light)
+        from embeddings import get_embedding_engine
+        vectorstore = FAISS.from_texts(texts=batch, embedding=get_embedding_engine(), metadatas=metadatas, ids=ids)
+    else:
+        vectorstore.add_texts(texts=batch, metadatas=metadatas, ids=ids)
+    return vectorstore
+
+# Streaming ingestion: pages/rows are parsed one at a time, chunked as a stream and embedded + added
+# to the index in batches of `batch_size` chunks, so memory stays flat whatever the file size
+# on_progress(fraction, text) is called after every batch; on_error(file_name, status, error) for bad files
+# file_ids -> {file name: user_files ID} (stored in the chunk metadata, logged-in users only)
+@timed("ingestion_streaming")
+def ingest_files_streaming(uploaded_files, vectorstore=None, replace_vector_ids=None, batch_size=None, on_progress=None, on_error=None, file_ids=None):
+    if batch_size is None:
+        batch_size = int(os.getenv("RAGIFY_STREAMING_BATCH_CHUNKS", DEFAULT_STREAMING_BATCH_CHUNKS))
+    if vectorstore is not None and replace_vector_ids:         # Re-uploaded files -> old vectors dropped first
+        delete_vectors(vectorstore, replace_vector_ids)
+
+    chunk_ids_by_file = {}
+    chunks_embedded = 0
+    total_files = len(uploaded_files)
+    for file_number, file in enumerate(uploaded_files, start=1):
+        file_chunk_ids = chunk_ids_by_file.setdefault(file.name, [])
+        if not is_supported(file.name):
+            if on_error: on_error(file.name, "unsupported", None)
+            continue
+        file.seek(0)
+        try:
+            batch = []
+            base_metadata = {"source": file.name}
+            if file_ids and file_ids.get(file.name) is not None:
+                base_metadata["file_id"] = file_ids[file.name]
+            for chunk in iter_chunks(iter_segments(file.name, file), base_metadata):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    vectorstore = _add_batch(vectorstore, batch, file_chunk_ids)
+                    chunks_embedded += len(batch)
+                    batch = []
+                    if on_progress: on_progress((file_number - 1) / total_files, f"{file.name}: {chunks_embedded} chunks embedded")
+            if batch:
+                vectorstore = _add_batch(vectorstore, batch, file_chunk_ids)
+                chunks_embedded += len(batch)
+        except Exception as e:
+            if on_error: on_error(file.name, "error", str(e))
+        if on_progress: on_progress(file_number / total_files, f"{file.name}: {chunks_embedded} chunks embedded")
+    return vectorstore, chunk_ids_by_file
@@ -0,0 +1,135 @@
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from ingestion import ingest_files_streaming
+from metrics import count, trace
+from utils import open_user_vectorstore, save_user_vectorstore
+
+DEFAULT_INGESTION_WORKERS = 2
+INGESTION_SPOOL_PATH = "ingestion_spool"          # Uploaded files waiting for their job (survive a restart)
+
+logger = logging.getLogger(__name__)
+_runner = None
+_runner_lock = threading.Lock()
+
+# Spooled upload read back as a stream (same interface as Streamlit's UploadedFile: name, read, seek)
+class _SpooledFile(io.BufferedReader):
+    def __init__(self, spool_path, file_name):
+        super().__init__(io.FileIO(spool_path, "rb"))
+        self._file_name = file_name
+
+    @property
+    def name(self):
+        return self._file_name
+
+# Worker pool running ingestion jobs of logged-in users (state persisted in the "ingestion_jobs" tables)
+# Jobs of the same user run one at a time (they update the same index); other users' jobs run in parallel
+class IngestionJobRunner:
+    def __init__(self, faiss_index_name_const, workers=None, spool_path=None):
+        if workers is None:
+            workers = int(os.getenv("RAGIFY_INGESTION_WORKERS", DEFAULT_INGESTION_WORKERS))
+        self.faiss_index_name_const = faiss_index_name_const
+        self.spool_path = spool_path or os.getenv("RAGIFY_INGESTION_SPOOL_DIR", INGESTION_SPOOL_PATH)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingestion")
+        self._user_locks = {}
+        self._lock = threading.Lock()
+
+    # Jobs left queued/running by a previous server process
+    def resume(self):
+        job_ids = database.get_unfinished_ingestion_jobs()
+        for job_id in job_ids:
+            self._executor.submit(self._run_job, job_id)
+        return job_ids
+
+    # Spools the uploaded files to disk and queues a job for them -> job ID
+    def submit(self, user_id, uploaded_files):
+        job_dir = os.path.join(self.spool_path, str(user_id))
+        os.makedirs(job_dir, exist_ok=True)
+        files = []
+        for file in uploaded_files:
+            safe_name = re.sub(r"[^\w.-]", "_", file.name)
+            spool_path = os.path.join(job_dir, f"{os.urandom(8).hex()}_{safe_name}")
+            file.seek(0)
+            with open(spool_path, "wb") as f:
+                shutil.copyfileobj(file, f)             # Copied in blocks (no second copy of the upload in memory)
+            files.append((file.name, spool_path))
+        job_id = database.create_ingestion_job(user_id, files)
+        self._executor.submit(self._run_job, job_id)
+        return job_id
+
+    # Serializes the changes of one user's index (jobs, file removals from the API)
+    def user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _run_job(self, job_id):
+        job = database.get_ingestion_job(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        with self.user_lock(job["user_id"]):
+            database.update_ingestion_job(job_id, status="running", message="Starting...")
+            try:
+                duplicates = self._process_files(job_id, job["user_id"])
+                database.update_ingestion_job(job_id, status="done", progress=1.0,
+                                              message=f"Done ({duplicates} duplicate chunks skipped)" if duplicates else "Done")
+            except Exception as e:
+                logger.exception("Ingestion job %s failed", job_id)
+                database.update_ingestion_job(job_id, status="failed", error=str(e))
+            for job_file in database.get_ingestion_job_files(job_id):
+                if os.path.exists(job_file["spool_path"]): os.remove(job_file["spool_path"])
+
+    # Files are ingested (streamed, see ingestion.py) and saved one at a time: a restart only redoes the current one
+    # -> duplicate chunks found (referenced instead of embedded again, see dedup.py)
+    def _process_files(self, job_id, user_id):
+        user_faiss_dir_path = database.get_user_faiss_path(user_id)
+        job_files = database.get_ingestion_job_files(job_id)
+        vectorstore = open_user_vectorstore(user_faiss_dir_path, self.faiss_index_name_const)
+        file_ids = database.add_user_file_records(            # One transaction for every file of the job
+            user_id, [job_file["filename"] for job_file in job_files if job_file["status"] == "queued"], user_faiss_dir_path
+        )
+
+        for file_number, job_file in enumerate(job_files):
+            if job_file["status"] != "queued":            # Already processed before a restart
+                continue
+            file_name = job_file["filename"]
+            database.update_ingestion_job_file(job_file["id"], "running")
+            errors = []
+
+            def on_progress(fraction, text):
+                database.update_ingestion_job(job_id, progress=(file_number + fraction) / len(job_files), message=text)
+
+            replace_vector_ids = database.get_user_file_vector_ids(user_id, file_name)      # Re-uploaded file -> old vectors replaced
+            file_id = file_ids[file_name]
+            with trace("ingestion", source="job", format=os.path.splitext(file_name)[1].lower()):
+                with _SpooledFile(job_file["spool_path"], file_name) as file:
+                    vectorstore, chunk_ids_by_file = ingest_files_streaming(
+                        [file], vectorstore=vectorstore, replace_vector_ids=replace_vector_ids,
+                        on_progress=on_progress, on_error=lambda name, status, error: errors.append((status, error)),
+                        file_ids={file_name: file_id}
+                    )
+                chunk_ids = chunk_ids_by_file.get(file_name, [])
+                if chunk_ids or replace_vector_ids:
+                    save_user_vectorstore(vectorstore, user_faiss_dir_path, self.faiss_index_name_const)
+                    database.set_file_vectors(file_id, chunk_ids)
+                count("ingested_chunks", len(chunk_ids))
+            if errors:
+                status, error = errors[0]
+                database.update_ingestion_job_file(job_file["id"], "unsupported" if status == "unsupported" else "failed", len(chunk_ids), error)
+            else:
+                database.update_ingestion_job_file(job_file["id"], "done", len(chunk_ids))
+        return vectorstore.dedup_stats["exact"] + vectorstore.dedup_stats["near"]
+
+def get_ingestion_runner(faiss_index_name_const):
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = IngestionJobRunner(faiss_index_name_const)
+                _runner.resume()
+    return _runner
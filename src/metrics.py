@@ -0,0 +1,314 @@
+import contextvars
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pipeline instrumentation: stage timings (extraction, chunking, embedding, index I/O, retrieval, LLM calls),
+# token counts and cache hits, recorded per request (trace) and process-wide (rolling window + Prometheus counters)
+#   trace(kind)   -> one request (question / ingestion); stages timed inside it are attached to it
+#   span(stage) / @timed(stage) / observe(stage, seconds) -> stage timing
+#   count(name, value, **labels) -> counter (tokens, cache hits...)
+#   observe_value(name, value) -> distribution of a size (batch sizes, queue depths)
+# Stage times can overlap (e.g. "embedding" runs inside "ingestion_streaming")
+DEFAULT_METRICS_WINDOW = 1000               # Recent traces / observations per stage kept for the percentiles
+DEFAULT_METRICS_PORT = 9464                 # Prometheus text endpoint (0 disables it)
+DEFAULT_METRICS_HOST = "127.0.0.1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)       # Seconds
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LLM_TAG_PREFIX = "ragify_"                  # LLM tags naming the call: ragify_answer -> stage "llm_answer"
+
+logger = logging.getLogger(__name__)
+_current_trace = contextvars.ContextVar("ragify_trace", default=None)
+_store = None
+_store_lock = threading.Lock()
+_server = None
+_server_lock = threading.Lock()
+
+# One request: {"kind", "labels", "started_at", "total_time", "stages": {stage: seconds}, "counts": {name: value}}
+class Trace:
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = dict(labels)
+        self.started_at = time.time()
+        self.total_time = None
+        self.stages = {}                    # Summed over the calls of a stage
+        self.counts = {}
+        self._lock = threading.Lock()       # Stages can be recorded from worker threads (streamed answers)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {"kind": self.kind, "labels": dict(self.labels), "started_at": self.started_at, "total_time": self.total_time,
+                    "stages": dict(self.stages), "counts": dict(self.counts)}
+
+# Linear interpolation between the closest ranks (numpy's default, without importing numpy here)
+def _percentile(values, fraction):
+    values = sorted(values)
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return round(float(values[lower] + (values[upper] - values[lower]) * (position - lower)), 4)
+
+def _prometheus_name(name):
+    return "ragify_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+# Process-wide metrics: per-stage histograms (cumulative, Prometheus) + recent observations (percentiles),
+# counters, recent traces and gauges read from the caches' get_stats() when rendered
+class MetricsStore:
+    def __init__(self, window=DEFAULT_METRICS_WINDOW):
+        self.window = max(1, int(window))
+        self._histograms = {}               # stage -> {"buckets": [count per LATENCY_BUCKETS], "sum", "count"}
+        self._recent = {}                   # stage -> deque of seconds
+        self._counters = {}                 # (name, ((label, value), ...)) -> value
+        self._distributions = {}            # name -> {"bounds", "buckets", "sum", "count", "recent"} (sizes, not seconds)
+        self._traces = deque(maxlen=self.window)
+        self._gauges = {}                   # group -> get_stats function
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+                self._recent[stage] = deque(maxlen=self.window)
+            for position, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][position] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            self._recent[stage].append(seconds)
+
+    def observe_value(self, name, value, buckets=SIZE_BUCKETS):
+        with self._lock:
+            distribution = self._distributions.get(name)
+            if distribution is None:
+                distribution = self._distributions[name] = {"bounds": tuple(buckets), "buckets": [0] * len(buckets), "sum": 0.0,
+                                                            "count": 0, "recent": deque(maxlen=self.window)}
+            for position, bound in enumerate(distribution["bounds"]):
+                if value <= bound:
+                    distribution["buckets"][position] += 1
+            distribution["sum"] += value
+            distribution["count"] += 1
+            distribution["recent"].append(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_trace(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def register_gauges(self, group, get_stats):
+        with self._lock:
+            self._gauges[group] = get_stats
+
+    def recent_traces(self, limit=None):
+        with self._lock:
+            traces = list(self._traces)
+        return [trace.to_dict() for trace in traces[-limit if limit else 0:]]
+
+    def _gauge_values(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+        values = {}
+        for group, get_stats in gauges.items():
+            try:
+                stats = get_stats()
+            except Exception:
+                logger.exception("Metrics of %s unavailable", group)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, dict):         # Nested stats (e.g. the embedding engine's cache)
+                    values.update({f"{group}_{key}_{sub_key}": sub_value for sub_key, sub_value in value.items()})
+                else:
+                    values[f"{group}_{key}"] = value
+        return {name: value for name, value in values.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+    # Rolling summary (recent observations): {"stages": {stage: {"calls", "p50", "p95", "total_calls"}}, "requests",
+    # "distributions": {name: {"count", "p50", "p95", "max", "mean"}}, "counters", "gauges"}
+    def get_stats(self):
+        with self._lock:
+            recent = {stage: list(values) for stage, values in self._recent.items()}
+            distributions = {name: (list(distribution["recent"]), distribution["sum"], distribution["count"])
+                             for name, distribution in self._distributions.items()}
+            total_calls = {stage: histogram["count"] for stage, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+            traces = list(self._traces)
+        stages = {stage: {"calls": len(values), "p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95),
+                          "total_calls": total_calls[stage]} for stage, values in sorted(recent.items()) if values}
+        requests = {}
+        for kind in sorted({trace.kind for trace in traces}):
+            totals = [trace.total_time for trace in traces if trace.kind == kind and trace.total_time is not None]
+            requests[kind] = {"requests": len(totals), "p50": _percentile(totals, 0.5), "p95": _percentile(totals, 0.95)} if totals else {"requests": 0}
+        return {
+            "stages": stages,
+            "requests": requests,
+            "distributions": {name: {"count": total_count, "p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95),
+                                     "max": max(values), "mean": round(total / total_count, 3)}
+                              for name, (values, total, total_count) in sorted(distributions.items()) if values},
+            "counters": {name + _prometheus_labels(labels): value for (name, labels), value in sorted(counters.items())},
+            "gauges": self._gauge_values(),
+        }
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render_prometheus(self):
+        with self._lock:
+            histograms = {stage: {"buckets": list(histogram["buckets"]), "sum": histogram["sum"], "count": histogram["count"]}
+                          for stage, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+            distributions = {name: {"bounds": distribution["bounds"], "buckets": list(distribution["buckets"]), "sum": distribution["sum"],
+                                    "count": distribution["count"]} for name, distribution in self._distributions.items()}
+        lines = ["# HELP ragify_stage_seconds Time spent per pipeline stage", "# TYPE ragify_stage_seconds histogram"]
+        for stage, histogram in sorted(histograms.items()):
+            for bound, bucket_count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f'ragify_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {bucket_count}')
+            lines.append(f'ragify_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'ragify_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+            lines.append(f'ragify_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        for name, distribution in sorted(distributions.items()):
+            metric = _prometheus_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, bucket_count in zip(distribution["bounds"], distribution["buckets"]):
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {bucket_count}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {distribution["count"]}')
+            lines.append(f"{metric}_sum {distribution['sum']:g}")
+            lines.append(f"{metric}_count {distribution['count']}")
+        for name in sorted({name for name, _ in counters}):
+            metric = _prometheus_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{_prometheus_labels(labels)} {value}" for (counter, labels), value in sorted(counters.items()) if counter == name)
+        for name, value in sorted(self._gauge_values().items()):
+            metric = _prometheus_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+def get_metrics_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetricsStore(int(os.getenv("RAGIFY_METRICS_WINDOW", DEFAULT_METRICS_WINDOW)))
+    return _store
+
+def current_trace():
+    return _current_trace.get()
+
+# Times a request; stages/counts recorded meanwhile (this thread, or threads started with its context) are attached to it
+@contextmanager
+def trace(kind, **labels):
+    request_trace = Trace(kind, labels)
+    token = _current_trace.set(request_trace)
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        yield request_trace
+        status = "ok"
+    finally:
+        request_trace.total_time = time.perf_counter() - t0
+        request_trace.labels.setdefault("status", status)
+        _current_trace.reset(token)
+        store = get_metrics_store()
+        store.observe(kind, request_trace.total_time)
+        store.inc("requests", kind=kind, status=request_trace.labels["status"])
+        store.record_trace(request_trace)
+
+def observe(stage, seconds):
+    get_metrics_store().observe(stage, seconds)
+    request_trace = _current_trace.get()
+    if request_trace is not None:
+        request_trace.add_stage(stage, seconds)
+
+@contextmanager
+def span(stage):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1, **labels):
+    if not value:
+        return
+    get_metrics_store().inc(name, value, **labels)
+    request_trace = _current_trace.get()
+    if request_trace is not None:
+        request_trace.add_count(name + _prometheus_labels(sorted(labels.items())), value)
+
+def observe_value(name, value, buckets=SIZE_BUCKETS):
+    get_metrics_store().observe_value(name, value, buckets)
+
+def register_gauges(group, get_stats):
+    get_metrics_store().register_gauges(group, get_stats)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        data = get_metrics_store().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+# Serves /metrics (Prometheus text format) from a background thread, once per process -> URL or None
+# RAGIFY_METRICS_PORT=0 disables it; a port already taken (another app process) is logged and skipped
+def start_metrics_server():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server or None
+        port = int(os.getenv("RAGIFY_METRICS_PORT", DEFAULT_METRICS_PORT))
+        _server = False
+        if port <= 0:
+            return None
+        host = os.getenv("RAGIFY_METRICS_HOST", DEFAULT_METRICS_HOST)
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        except OSError as e:
+            logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        _server = f"http://{host}:{server.server_address[1]}/metrics"
+        return _server
+
+def get_metrics_url():
+    return _server or None
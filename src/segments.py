@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+import faiss
+import numpy as np
+from filelock import FileLock
+
+from chunk_store import ChunkStore
+from metrics import timed
+from vector_index import EXACT_TYPES, build_index, choose_index_type, get_index_type, index_labels, reconstruct_all
+
+# Compaction thresholds (segments are merged into the base index once one is crossed)
+DEFAULT_MAX_SEGMENTS = 8
+DEFAULT_MAX_SEGMENT_FRACTION = 0.25         # Vectors in segments / vectors in the base index
+DEFAULT_MAX_DELETED_FRACTION = 0.2          # Tombstoned vectors / all vectors
+
+logger = logging.getLogger(__name__)
+_compacting = set()                         # Index directories with a compaction running (this process)
+_compacting_lock = threading.Lock()
+
+# A user's index on disk:
+#   <name>_manifest.json -> {"generation", "content_version", "base": {"file", "vectors"} | None, "segments": [{"file", "vectors"}], "deleted"}
+#   (generation: every manifest update; content_version: uploads/removals only, compaction keeps it)
+#   <name>_base_<generation>.faiss / <name>_seg_<generation>.faiss -> immutable index files listed by the manifest
+# The manifest is replaced atomically: readers see either the old or the new set of files, never a mix
+def get_manifest_path(user_faiss_dir_path, faiss_index_name_const):
+    return os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}_manifest.json")
+
+# Serializes manifest updates of an index (uploads from several sessions/processes + compaction)
+def get_index_lock(user_faiss_dir_path, faiss_index_name_const):
+    os.makedirs(user_faiss_dir_path, exist_ok=True)
+    return FileLock(os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.lock"))
+
+def read_manifest(user_faiss_dir_path, faiss_index_name_const):
+    manifest_path = get_manifest_path(user_faiss_dir_path, faiss_index_name_const)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    legacy_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.faiss")
+    if os.path.exists(legacy_path):                 # Single index file saved before segments
+        return {"generation": 0, "base": {"file": os.path.basename(legacy_path), "vectors": read_index(legacy_path).ntotal},
+                "segments": [], "deleted": 0}
+    return None
+
+def write_manifest(user_faiss_dir_path, faiss_index_name_const, manifest):
+    manifest_path = get_manifest_path(user_faiss_dir_path, faiss_index_name_const)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def _new_manifest():
+    return {"generation": 0, "base": None, "segments": [], "deleted": 0}
+
+def write_index(index, file_path):
+    faiss.write_index(index, file_path + ".tmp")
+    os.replace(file_path + ".tmp", file_path)
+
+def read_index(file_path, mmap_flags=None):
+    if mmap_flags is not None:
+        try:
+            return faiss.read_index(file_path, mmap_flags)
+        except RuntimeError:            # Index type without mmap support
+            pass
+    return faiss.read_index(file_path)
+
+# (base index, [(segment file, segment index)]) listed by a manifest
+def load_parts(user_faiss_dir_path, manifest, mmap_flags=None):
+    base = None
+    if manifest["base"]:
+        base = read_index(os.path.join(user_faiss_dir_path, manifest["base"]["file"]), mmap_flags)
+    segments = [(segment["file"], read_index(os.path.join(user_faiss_dir_path, segment["file"]), mmap_flags))
+                for segment in manifest["segments"]]
+    return base, segments
+
+# Saves the vectors added to `vectorstore` since it was loaded as a new segment (cost ~ new data only)
+# and its deletions as tombstones. Returns True when `vectorstore` matches the saved manifest
+# (False: another writer saved meanwhile, its segments are not in this copy)
+def save_segment(vectorstore, user_faiss_dir_path, faiss_index_name_const):
+    with get_index_lock(user_faiss_dir_path, faiss_index_name_const):
+        manifest = read_manifest(user_faiss_dir_path, faiss_index_name_const) or _new_manifest()
+        up_to_date = manifest["generation"] == (vectorstore.manifest or _new_manifest())["generation"]
+        manifest["generation"] += 1
+        segment = vectorstore.new_segment
+        if segment is not None and segment.ntotal > 0:
+            segment_file = f"{faiss_index_name_const}_seg_{manifest['generation']}.faiss"
+            write_index(segment, os.path.join(user_faiss_dir_path, segment_file))
+            manifest["segments"].append({"file": segment_file, "vectors": segment.ntotal})
+            vectorstore.segments.append((segment_file, segment))
+        manifest["deleted"] += len(vectorstore.pending_tombstones)
+        manifest["content_version"] = uuid.uuid4().hex          # Random: never reused after the index is cleared
+        write_manifest(user_faiss_dir_path, faiss_index_name_const, manifest)
+    vectorstore.new_segment = None
+    vectorstore.manifest = manifest
+    vectorstore.apply_pending_deletes()         # Chunk rows dropped once the tombstones are recorded
+    return up_to_date
+
+def needs_compaction(manifest):
+    if manifest is None or not (manifest["segments"] or manifest["deleted"]):
+        return False
+    max_segments = int(os.getenv("RAGIFY_MAX_SEGMENTS", DEFAULT_MAX_SEGMENTS))
+    max_segment_fraction = float(os.getenv("RAGIFY_MAX_SEGMENT_FRACTION", DEFAULT_MAX_SEGMENT_FRACTION))
+    max_deleted_fraction = float(os.getenv("RAGIFY_MAX_DELETED_FRACTION", DEFAULT_MAX_DELETED_FRACTION))
+    base_vectors = manifest["base"]["vectors"] if manifest["base"] else 0
+    segment_vectors = sum(segment["vectors"] for segment in manifest["segments"])
+    return (len(manifest["segments"]) > max_segments
+            or segment_vectors > max_segment_fraction * base_vectors
+            or manifest["deleted"] > max_deleted_fraction * (base_vectors + segment_vectors))
+
+# Vectors + labels of one part (quantized indexes only hold approximations -> texts embedded again)
+def _part_vectors(index, chunk_store, embeddings):
+    if get_index_type(index) in EXACT_TYPES:
+        return reconstruct_all(index)
+    labels = index_labels(index)
+    texts_by_label = chunk_store.texts_for(labels)
+    labels = np.array([label for label in labels if int(label) in texts_by_label], dtype=np.int64)
+    texts = [texts_by_label[int(label)] for label in labels]
+    return np.array(embeddings.embed_documents(texts), dtype=np.float32).reshape(-1, index.d), labels
+
+# Merges the segments (and drops the tombstones) of a manifest snapshot into a new base index
+# Index type chosen for the resulting size (flat -> IVF -> SQ8/PQ, see vector_index.py)
+def _merge(user_faiss_dir_path, faiss_index_name_const, manifest, chunk_store, embeddings):
+    base, segments = load_parts(user_faiss_dir_path, manifest)
+    live_labels = chunk_store.all_labels()
+    segment_vectors, segment_labels = [], []
+    for _, segment in segments:
+        vectors, labels = reconstruct_all(segment)
+        keep = np.isin(labels, live_labels)
+        segment_vectors.append(vectors[keep])
+        segment_labels.append(labels[keep])
+
+    base_labels = index_labels(base) if base is not None else np.zeros(0, dtype=np.int64)
+    dead_base_labels = base_labels[~np.isin(base_labels, live_labels)]
+    n_live = len(base_labels) - len(dead_base_labels) + sum(len(labels) for labels in segment_labels)
+    current_type = get_index_type(base) if base is not None else None
+    target_type = choose_index_type(n_live, current_type)
+
+    report = None
+    if base is not None and target_type == current_type and current_type != "hnsw":
+        # Same type: the trained base index is reused (tombstones removed, segment vectors appended)
+        if len(dead_base_labels):
+            base.remove_ids(dead_base_labels)
+        for vectors, labels in zip(segment_vectors, segment_labels):
+            if len(labels):
+                base.add_with_ids(vectors, labels)
+        new_base = base
+    else:
+        parts = [_part_vectors(base, chunk_store, embeddings)] if base is not None else []
+        parts += list(zip(segment_vectors, segment_labels))
+        vectors = np.concatenate([part_vectors for part_vectors, _ in parts]) if parts else np.zeros((0, 0), dtype=np.float32)
+        labels = np.concatenate([part_labels for _, part_labels in parts]) if parts else np.zeros(0, dtype=np.int64)
+        keep = np.isin(labels, live_labels)
+        if not keep.any():
+            return None, None
+        new_base, report = build_index(target_type, vectors[keep], labels[keep])
+        if current_type is not None:
+            report["migrated_from"] = current_type
+    return new_base, report
+
+# Merges the current segments into a new base index; uploads keep adding segments meanwhile
+@timed("compaction")
+def compact_segments(user_faiss_dir_path, faiss_index_name_const, embeddings):
+    lock = get_index_lock(user_faiss_dir_path, faiss_index_name_const)
+    with lock:
+        snapshot = read_manifest(user_faiss_dir_path, faiss_index_name_const)
+    if not needs_compaction(snapshot):
+        return False
+
+    chunk_store = ChunkStore(os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}_chunks.db"))
+    try:
+        new_base, report = _merge(user_faiss_dir_path, faiss_index_name_const, snapshot, chunk_store, embeddings)
+    finally:
+        chunk_store.close()
+
+    with lock:
+        manifest = read_manifest(user_faiss_dir_path, faiss_index_name_const)
+        if manifest is None or manifest["base"] != snapshot["base"]:            # Cleared/compacted meanwhile
+            return False
+        manifest["generation"] += 1
+        if new_base is not None:
+            base_file = f"{faiss_index_name_const}_base_{manifest['generation']}.faiss"
+            write_index(new_base, os.path.join(user_faiss_dir_path, base_file))
+            manifest["base"] = {"file": base_file, "vectors": new_base.ntotal}
+        else:
+            manifest["base"] = None
+        merged_files = {segment["file"] for segment in snapshot["segments"]}
+        manifest["segments"] = [segment for segment in manifest["segments"] if segment["file"] not in merged_files]
+        manifest["deleted"] = max(0, manifest["deleted"] - snapshot["deleted"])        # Tombstones added meanwhile
+        write_manifest(user_faiss_dir_path, faiss_index_name_const, manifest)
+        if report is not None:
+            with open(os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}_report.json"), "w") as f:
+                json.dump(report, f, indent=2)              # Recall vs latency of the new index
+        remove_unreferenced_files(user_faiss_dir_path, faiss_index_name_const, manifest)
+    return True
+
+# Index files no longer listed by the manifest (merged segments, previous base)
+def remove_unreferenced_files(user_faiss_dir_path, faiss_index_name_const, manifest):
+    referenced = {segment["file"] for segment in manifest["segments"]}
+    if manifest["base"]:
+        referenced.add(manifest["base"]["file"])
+    for file_name in os.listdir(user_faiss_dir_path):
+        if file_name.startswith(faiss_index_name_const) and file_name.endswith(".faiss") and file_name not in referenced:
+            try:
+                os.remove(os.path.join(user_faiss_dir_path, file_name))
+            except OSError:             # Still memory-mapped (Windows) -> removed by a later compaction
+                pass
+
+# Runs compact_segments in a background thread when a threshold is crossed (one at a time per index)
+def schedule_compaction(user_faiss_dir_path, faiss_index_name_const, embeddings, manifest):
+    if not needs_compaction(manifest):
+        return False
+    with _compacting_lock:
+        if user_faiss_dir_path in _compacting:
+            return False
+        _compacting.add(user_faiss_dir_path)
+
+    def run():
+        try:
+            compact_segments(user_faiss_dir_path, faiss_index_name_const, embeddings)
+        except Exception:
+            logger.exception("Compaction of %s failed", user_faiss_dir_path)
+        finally:
+            with _compacting_lock:
+                _compacting.discard(user_faiss_dir_path)
+
+    threading.Thread(target=run, name=f"compaction-{user_faiss_dir_path}", daemon=True).start()
+    return True
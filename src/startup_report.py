@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Cold start report: import cost of the app per module (python -X importtime in a fresh interpreter)
+#   python src/startup_report.py [--top 25] [--json report.json]
+# Streamlit is imported first (its cost is the same for any app), then app.py as `streamlit run` does.
+# Heavy stacks (parsers, LangChain, FAISS, torch) are expected to be absent: they are imported on first use
+HEAVY_PACKAGES = ("langchain", "langchain_core", "langchain_community", "faiss", "torch", "transformers",
+                  "sentence_transformers", "numpy", "PyPDF2", "docx", "openpyxl")
+DEFAULT_TOP = 25
+DEFAULT_MAX_SECONDS = 1.0           # Login page budget (app import + init_db)
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = """
+import sys, time
+import streamlit, dotenv
+sys.path.insert(0, {src_dir!r})
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+import database
+database.init_db()
+t2 = time.perf_counter()
+print("RAGIFY_TIMINGS", t1 - t0, t2 - t1)
+"""
+
+# -X importtime lines -> [(module, self seconds, cumulative seconds, depth)] in import order
+def parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return rows
+
+# Modules imported by `import app` (after streamlit): everything after the "app" block starts
+def _app_rows(rows):
+    for i, (name, _, _, depth) in enumerate(rows):
+        if name == "app" and depth == 0:
+            start = i
+            while start > 0 and rows[start - 1][3] > 0:         # Children are listed before their parent
+                start -= 1
+            return rows[start:i + 1]
+    return []
+
+def run_probe():
+    with tempfile.TemporaryDirectory(prefix="ragify-startup-") as workdir:      # init_db() writes in the working directory
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(src_dir=_SRC_DIR)],
+                                 cwd=workdir, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing the app failed:\n{process.stderr[-2000:]}")
+    timings = next(line.split()[1:] for line in process.stdout.splitlines() if line.startswith("RAGIFY_TIMINGS"))
+    return parse_importtime(process.stderr), float(timings[0]), float(timings[1])
+
+def build_report(top=DEFAULT_TOP):
+    rows, app_import, init_db = run_probe()
+    app_rows = _app_rows(rows)
+    packages = {}
+    for name, self_seconds, _, _ in app_rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + self_seconds
+    local_modules = {file_name[:-3] for file_name in os.listdir(_SRC_DIR) if file_name.endswith(".py")}
+    return {
+        "app_import_seconds": round(app_import, 4),
+        "init_db_seconds": round(init_db, 4),
+        "startup_seconds": round(app_import + init_db, 4),
+        "modules_imported": len(app_rows),
+        "heavy_packages_loaded": sorted({name.split(".")[0] for name, _, _, _ in app_rows} & set(HEAVY_PACKAGES)),
+        "app_modules": sorted(({"module": name, "self_seconds": round(self_seconds, 4), "cumulative_seconds": round(cumulative, 4)}
+                               for name, self_seconds, cumulative, _ in app_rows if name in local_modules),
+                              key=lambda module: -module["cumulative_seconds"]),
+        "packages": [{"package": package, "self_seconds": round(seconds, 4)}
+                     for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]],
+    }
+
+def print_report(report, max_seconds):
+    print(f"App import: {report['app_import_seconds'] * 1000:.0f} ms ({report['modules_imported']} modules), "
+          f"init_db: {report['init_db_seconds'] * 1000:.0f} ms")
+    print(f"\n{'App module':<24}{'self ms':>10}{'cumulative ms':>16}")
+    for module in report["app_modules"]:
+        print(f"{module['module']:<24}{module['self_seconds'] * 1000:>10.1f}{module['cumulative_seconds'] * 1000:>16.1f}")
+    print(f"\n{'Package':<32}{'self ms':>10}")
+    for package in report["packages"]:
+        print(f"{package['package']:<32}{package['self_seconds'] * 1000:>10.1f}")
+    print()
+    if report["heavy_packages_loaded"]:
+        print(f"WARNING: heavy packages imported at startup: {', '.join(report['heavy_packages_loaded'])}")
+    if report["startup_seconds"] > max_seconds:
+        print(f"WARNING: startup took {report['startup_seconds']:.2f} s (budget {max_seconds:.2f} s)")
+    return not report["heavy_packages_loaded"] and report["startup_seconds"] <= max_seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import cost of the RAGIFY app per module (cold start)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Packages listed")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS, help="Startup budget (exit code 1 when exceeded)")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = build_report(args.top)
+    within_budget = print_report(report, args.max_seconds)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if within_budget else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
 import streamlit as st
 import os
 import io
+import re
+import time
+from datetime import datetime, timezone
 
 import database
-from utils import extract_text_from_files, get_text_chunks
+from html_templates import bot_template, user_template
+from metrics import count, get_metrics_store, get_metrics_url, observe, trace
+from utils import extract_text_per_file, get_file_chunks, remove_file_vectors, clear_user_vectorstore, set_retrieval_files
 
 # UI Sign Up/Login
 def display_auth_ui():
@@ -60,28 +65,250 @@ def display_auth_ui():
         st.sidebar.subheader(f"Logged in as: {st.session_state.username}")
         if st.sidebar.button("Logout", key="logout_button_sidebar"):
             for key in list(st.session_state.keys()):
-                if key in ["logged_in_user_id", "username", "conversation", "chat_history", "vectorstore_loaded_for_user", "processed_files_session"]:
+                if key in ["logged_in_user_id", "username", "conversation", "chat_history", "vectorstore_loaded_for_user", "processed_files_session", "watched_ingestion_jobs", "ingestion_notices", "last_answer_latency", "chat_history_cursor", "question_file_ids"]:
                     if key in st.session_state:
                         del st.session_state[key]
             st.sidebar.info("Logout successful.")
             st.rerun()
 
+# Chat history UI: only the last page of turns is loaded (keyset pagination, see database.load_chat_page),
+# older pages on demand; each message's HTML is rendered once and kept with the message
+DEFAULT_CHAT_PAGE_TURNS = 20
+_DB_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"              # CURRENT_TIMESTAMP (UTC)
+
+def _display_time(timestamp):
+    try:
+        moment = datetime.strptime(timestamp, _DB_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).astimezone()
+    except (TypeError, ValueError):
+        return ""
+    return moment.strftime("%H:%M") if moment.date() == datetime.now().date() else moment.strftime("%d/%m/%Y %H:%M")
+
+def _render_message(template, content, msg_id, shown_time):
+    return template.replace("{{MSG}}", content).replace("{{MSG_ID}}", msg_id).replace("{{TIMESTAMP}}", shown_time)
+
+# One stored turn -> [HumanMessage, AIMessage] with their HTML ("html") and UTC time ("timestamp") in additional_kwargs
+def make_chat_messages(turn_id, user_message, ai_response, timestamp, cached=False):
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    shown_time = _display_time(timestamp)
+    messages = []
+    if user_message:
+        messages.append(HumanMessage(content=user_message, additional_kwargs={
+            "timestamp": timestamp, "html": _render_message(user_template, user_message, f"user_{turn_id}", shown_time)}))
+    if ai_response:
+        bot_time = f"{shown_time} · cached" if cached else shown_time          # Answered from the answer cache
+        messages.append(AIMessage(content=ai_response, additional_kwargs={
+            "timestamp": timestamp, "cached": cached, "html": _render_message(bot_template, ai_response, f"bot_{turn_id}", bot_time)}))
+    return messages
+
+def _page_size():
+    return int(os.getenv("RAGIFY_CHAT_PAGE_TURNS", DEFAULT_CHAT_PAGE_TURNS))
+
+# Rows of load_chat_page (newest first) -> messages in chat order + keyset cursor of the next (older) page, None if none left
+def _messages_from_page(rows):
+    messages = []
+    for row in reversed(rows):
+        messages += make_chat_messages(row["id"], row["user_message"], row["ai_response"], row["timestamp"])
+    cursor = (rows[-1]["timestamp"], rows[-1]["id"]) if len(rows) == _page_size() else None
+    return messages, cursor
+
+# Last page of a logged-in user's history (session state "chat_history" / "chat_history_cursor")
+def load_recent_chat_history(user_id):
+    st.session_state.chat_history, st.session_state.chat_history_cursor = _messages_from_page(
+        database.load_chat_page(user_id, limit=_page_size())
+    )
+
+def _load_older_chat_history():
+    older_messages, st.session_state.chat_history_cursor = _messages_from_page(
+        database.load_chat_page(st.session_state.logged_in_user_id, before=st.session_state.chat_history_cursor, limit=_page_size())
+    )
+    st.session_state.chat_history = older_messages + st.session_state.chat_history
+
+# Loaded messages written as a single element (HTML rendered when the message was loaded/answered)
+def display_chat_history():
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    if st.session_state.get("logged_in_user_id") and st.session_state.get("chat_history_cursor"):
+        if st.button("Load older messages", key="load_older_chat_history"):
+            _load_older_chat_history()
+    html_parts = []
+    for i, message in enumerate(st.session_state.chat_history):
+        additional_kwargs = getattr(message, 'additional_kwargs', {})
+        if "html" not in additional_kwargs:         # Message built elsewhere (no stored turn)
+            template = user_template if isinstance(message, HumanMessage) or (i % 2 == 0 and not isinstance(message, AIMessage)) else bot_template
+            additional_kwargs["html"] = _render_message(template, getattr(message, 'content', str(message)), f"msg_{i}", "")
+        html_parts.append(additional_kwargs["html"])
+    st.write("".join(html_parts), unsafe_allow_html=True)
+
 # Processes user question, interactss with conversation_chain and FAISS
-def handle_user_input(user_question, get_conversation_chain_func, save_chat_message_func):
+# file_ids -> question restricted to these user_files (None: whole knowledge base)
+def handle_user_input(user_question, get_conversation_chain_func, save_chat_message_func, file_ids=None):
     
     if "conversation" not in st.session_state or st.session_state.conversation is None:
         st.warning("Please process some files first or check if the knowledge has been loaded.")
         return
+    set_retrieval_files(st.session_state.conversation, file_ids)
 
-    # conversation_chain called by (st.session_state.conversation)
-    response = st.session_state.conversation({'question': user_question})
-    st.session_state.chat_history = response['chat_history'] 
+    with trace("question", user="user" if st.session_state.get("logged_in_user_id") else "guest") as request_trace:
+        _answer_question(user_question, save_chat_message_func, file_ids, request_trace)
 
-    if st.session_state.get("logged_in_user_id") and len(st.session_state.chat_history) >= 2:
-        if hasattr(st.session_state.chat_history[-2], 'content') and hasattr(st.session_state.chat_history[-1], 'content'):
-            last_user_msg = st.session_state.chat_history[-2].content
-            last_ai_msg = st.session_state.chat_history[-1].content
-            save_chat_message_func(st.session_state.logged_in_user_id, last_user_msg, last_ai_msg)
+# One question -> answer turn (stages timed inside the "question" trace, see metrics.py)
+def _answer_question(user_question, save_chat_message_func, file_ids, request_trace):
+    from answer_cache import get_answer_cache
+    from answer_streaming import StreamedAnswer
+
+    # conversation_chain called by (st.session_state.conversation), answer shown token by token as llama3 generates it
+    timestamp = datetime.now().strftime("%H:%M")
+    st.write(user_template.replace("{{MSG}}", user_question).replace("{{MSG_ID}}", "user_pending")
+            .replace("{{TIMESTAMP}}", timestamp), unsafe_allow_html=True)
+    answer_placeholder = st.empty()
+
+    t0 = time.perf_counter()
+    answer_cache = get_answer_cache()
+    cache_key = _get_answer_cache_key(user_question, file_ids) if answer_cache is not None else None
+    cached = answer_cache.lookup(*cache_key, user_question) if cache_key else None
+    count("answer_cache_lookups", result="hit" if cached else "miss" if cache_key else "bypass")
+    if cached:              # Same (or near-duplicate) question already answered on this knowledge base version
+        answer = cached["answer"]
+        st.session_state.conversation.memory.save_context({'question': user_question}, {'answer': answer})
+        elapsed = time.perf_counter() - t0
+        latency = {"mode": "cache", "cached": cached["match"], "time_to_first_token": elapsed, "total_time": elapsed}
+    else:
+        streamed_answer = StreamedAnswer(st.session_state.conversation, user_question)
+        answer_text = ""
+        for token in streamed_answer:
+            answer_text += token
+            answer_placeholder.write(bot_template.replace("{{MSG}}", answer_text + "▌").replace("{{MSG_ID}}", "bot_pending")
+                                    .replace("{{TIMESTAMP}}", timestamp), unsafe_allow_html=True)
+        answer = streamed_answer.response['answer']
+        latency = streamed_answer.latency
+        if cache_key:
+            answer_cache.store(*cache_key, user_question, answer)
+
+    # Saved once the whole answer has been generated
+    turn_id = f"new_{len(st.session_state.chat_history)}"
+    if st.session_state.get("logged_in_user_id"):
+        turn_id = save_chat_message_func(st.session_state.logged_in_user_id, user_question, answer)
+
+    # Displayed history (the chain's memory may only hold the recent turns + a summary, see chat_memory.py)
+    st.session_state.chat_history = st.session_state.chat_history + make_chat_messages(
+        turn_id, user_question, answer, datetime.now(timezone.utc).strftime(_DB_TIMESTAMP_FORMAT), cached=bool(cached)
+    )
+    st.session_state.last_answer_latency = latency
+    request_trace.labels["mode"] = latency.get("mode", "unknown")
+    observe("time_to_first_token", latency["time_to_first_token"])
+
+# Answer cache key of a question: (user's index directory, version of the index the conversation searches + files searched)
+# None for guests and for questions that depend on the conversation ("and its price?" after another question)
+def _get_answer_cache_key(user_question, file_ids=None):
+    from answer_cache import get_answer_cache_key
+
+    user_id = st.session_state.get("logged_in_user_id")
+    if not user_id:
+        return None
+    conversation = st.session_state.conversation
+    vectorstore = getattr(conversation.retriever, "vectorstore", None)
+    chat_history = conversation.memory.load_memory_variables({})[conversation.memory.memory_key]
+    return get_answer_cache_key(database.get_user_faiss_path(user_id), vectorstore, user_question, file_ids, chat_history)
+
+# Files a logged-in user can restrict the next question to -> selected user_files IDs (None: all files)
+def display_file_scope_ui():
+    user_id = st.session_state.get("logged_in_user_id")
+    if not user_id:
+        return None
+    file_names = {db_file['id']: db_file['filename'] for db_file in database.get_user_files(user_id)}
+    if len(file_names) < 2:
+        return None
+    st.session_state.question_file_ids = [file_id for file_id in st.session_state.get("question_file_ids", []) if file_id in file_names]
+    selected = st.multiselect("Search only in (all files if empty):", options=list(file_names), format_func=file_names.get,
+                              key="question_file_ids")
+    return selected or None
+
+# UI of the background ingestion jobs (jobs submitted in this session + any job still active for the user)
+def display_ingestion_jobs_ui(on_jobs_finished):
+    user_id = st.session_state.get("logged_in_user_id")
+    if not user_id:
+        return
+
+    for notice_type, notice in st.session_state.pop("ingestion_notices", []):          # Results of the jobs finished on the last run
+        getattr(st, notice_type)(notice)
+
+    watched_jobs = st.session_state.watched_ingestion_jobs
+    for job in database.get_user_ingestion_jobs(user_id):
+        if job["status"] in ("queued", "running") and job["id"] not in watched_jobs:
+            watched_jobs.append(job["id"])
+    if watched_jobs:
+        _ingestion_jobs_progress(on_jobs_finished)
+
+# Refreshed on its own every 2s (the rest of the page, chat included, stays usable)
+@st.fragment(run_every=2)
+def _ingestion_jobs_progress(on_jobs_finished):
+    st.subheader("Processing files:")
+    all_finished = True
+    notices = []
+    for job_id in st.session_state.watched_ingestion_jobs:
+        job = database.get_ingestion_job(job_id)
+        if job is None:
+            continue
+        job_files = database.get_ingestion_job_files(job_id)
+        if job["status"] in ("queued", "running"):
+            all_finished = False
+            st.progress(job["progress"], text=job["message"] or "Queued...")
+            for job_file in job_files:
+                st.caption(f"{job_file['filename']}: {job_file['status']}")
+        elif job["status"] == "failed":
+            notices.append(("error", f"Error processing the files: {job['error']}"))
+        else:
+            for job_file in job_files:
+                if job_file["status"] == "unsupported":
+                    notices.append(("warning", f"Formato de arquivo não suportado: {job_file['filename']}"))
+                elif job_file["status"] == "failed":
+                    notices.append(("error", f"Erro ao processar o arquivo {job_file['filename']}: {job_file['error']}"))
+            if any(job_file["chunks"] for job_file in job_files):
+                notices.append(("success", "Files processed and knowledge saved/updated!"))
+            else:
+                notices.append(("warning", "No text extracted from the files. Check the formats or content."))
+
+    if all_finished:
+        st.session_state.watched_ingestion_jobs = []
+        st.session_state.ingestion_notices = notices
+        on_jobs_finished()              # New index version -> conversation reloaded
+        st.rerun()                      # Full page (file list)
+
+# Pipeline metrics of this process (see metrics.py), in the sidebar of admins (RAGIFY_ADMIN_USERS: comma-separated usernames)
+def display_metrics_panel():
+    admins = {username.strip() for username in os.getenv("RAGIFY_ADMIN_USERS", "").split(",") if username.strip()}
+    if not st.session_state.get("logged_in_user_id") or st.session_state.get("username") not in admins:
+        return
+
+    store = get_metrics_store()
+    stats = store.get_stats()
+    with st.sidebar.expander("📊 Pipeline metrics (admin)"):
+        for kind, request_stats in stats["requests"].items():
+            if request_stats["requests"]:
+                st.caption(f"{kind}: {request_stats['requests']} recent, p50 {request_stats['p50']:.2f}s, p95 {request_stats['p95']:.2f}s")
+        if stats["stages"]:
+            st.dataframe([{"stage": stage, "calls": stage_stats["total_calls"], "p50 (ms)": round(stage_stats["p50"] * 1000, 1),
+                           "p95 (ms)": round(stage_stats["p95"] * 1000, 1)} for stage, stage_stats in stats["stages"].items()],
+                         hide_index=True)
+        for name, distribution in stats["distributions"].items():
+            st.caption(f"{name}: mean {distribution['mean']:g}, p95 {distribution['p95']:g}, max {distribution['max']:g} ({distribution['count']} recorded)")
+        hit_rates = [f"{name.removesuffix('_hit_rate')} {value:.0%}" for name, value in stats["gauges"].items() if name.endswith("hit_rate")]
+        if hit_rates:
+            st.caption("Cache hit rates: " + ", ".join(hit_rates))
+        tokens = [" ".join(re.findall(r'="([^"]*)"', name)) + f" {value}" for name, value in stats["counters"].items() if name.startswith("llm_tokens")]
+        if tokens:
+            st.caption("LLM tokens: " + ", ".join(tokens))
+        dedup = {re.findall(r'="([^"]*)"', name)[0]: value for name, value in stats["counters"].items() if name.startswith("dedup_chunks")}
+        if dedup:
+            st.caption(f"Ingested chunks: {dedup.get('unique', 0)} unique, {dedup.get('exact', 0)} exact + {dedup.get('near', 0)} near duplicates skipped")
+        for recent_trace in reversed(store.recent_traces(5)):
+            slowest = sorted(recent_trace["stages"].items(), key=lambda item: item[1], reverse=True)[:3]
+            st.caption(f"{datetime.fromtimestamp(recent_trace['started_at']):%H:%M:%S} {recent_trace['kind']} "
+                       f"({recent_trace['labels'].get('mode') or recent_trace['labels'].get('status')}) {recent_trace['total_time']:.2f}s: "
+                       + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in slowest))
+        if get_metrics_url():
+            st.caption(f"Prometheus: {get_metrics_url()}")
 
 # UI to display files in the sidebar
 def display_uploaded_files_ui(handle_file_removal_func, faiss_index_name_const):
@@ -120,22 +347,38 @@ def handle_file_removal_logic(file_identifier, file_name_for_display, source, fa
 
     # IF user logged in, data -> DB
     if source == 'db' and user_id:
-        if database.delete_user_file(file_identifier):
-            st.sidebar.success(f"File '{file_name_for_display}' successfully removed!")
-            
-            user_faiss_dir_path = database.get_user_faiss_path(user_id)
-            faiss_file_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.faiss")          # .faiss index
-            pkl_file_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.pkl")              # .pkl index/file
-            
-            if os.path.exists(faiss_file_path): os.remove(faiss_file_path)
-            if os.path.exists(pkl_file_path): os.remove(pkl_file_path)
+        from ingestion_jobs import get_ingestion_runner
+
+        with get_ingestion_runner(faiss_index_name_const).user_lock(user_id):         # No ingestion job of this user running meanwhile
+            vector_ids = database.get_file_vector_ids(file_identifier)
+            tracked_vectors = database.count_user_vectors(user_id)
+            if database.delete_user_file(file_identifier):
+                st.sidebar.success(f"File '{file_name_for_display}' successfully removed!")
             
-            st.warning("Your knowledge base has been cleared. Please process the desired files again!")
-            st.session_state.conversation = None
-            st.session_state.chat_history = []
-            st.session_state.vectorstore_loaded_for_user = False
-        else:
-            st.sidebar.error(f"Error removing '{file_name_for_display}' from the record.")
+                user_faiss_dir_path = database.get_user_faiss_path(user_id)
+                vectorstore = get_vectorstore_func(user_id=user_id, for_update=True)            # Private copy of the saved index
+
+                # Only this file's vectors are removed (the rest of the knowledge base is kept)
+                if vectorstore is not None and vectorstore.count_vectors() <= tracked_vectors:
+                    vectorstore = remove_file_vectors(vectorstore, vector_ids, user_faiss_dir_path, faiss_index_name_const)
+                    if vectorstore:
+                        st.session_state.conversation = get_conversation_chain_func(vectorstore, initial_chat_history=st.session_state.chat_history, user_id=user_id)
+                        st.session_state.vectorstore_loaded_for_user = True
+                    else:
+                        st.info("Your knowledge base is now empty. Upload files to start again!")
+                        st.session_state.conversation = None
+                        st.session_state.vectorstore_loaded_for_user = False
+
+                # Index built before vectors were linked to files -> can't remove one file, cleared instead
+                elif vectorstore is not None:
+                    clear_user_vectorstore(user_faiss_dir_path, faiss_index_name_const)          # .faiss index + chunk store
+                
+                    st.warning("Your knowledge base has been cleared. Please process the desired files again!")
+                    st.session_state.conversation = None
+                    st.session_state.chat_history = []
+                    st.session_state.vectorstore_loaded_for_user = False
+            else:
+                st.sidebar.error(f"Error removing '{file_name_for_display}' from the record.")
 
     # IF user NOT logged in, data -> session
     elif source == 'session' and not user_id:
@@ -156,10 +399,13 @@ def handle_file_removal_logic(file_identifier, file_name_for_display, source, fa
                     bytes_io_obj.name = file_data['name'] 
                     mock_uploaded_files.append(bytes_io_obj)
 
-                raw_text = extract_text_from_files(mock_uploaded_files) 
-                if raw_text and raw_text.strip():
-                    text_chunks = get_text_chunks(raw_text) 
-                    vectorstore = get_vectorstore_func(text_chunks=text_chunks, user_id=None)
+                text_chunks, chunk_metadatas = [], []
+                for file_result in extract_text_per_file(mock_uploaded_files):
+                    file_chunks, file_chunk_metadatas = get_file_chunks(file_result["segments"], file_result["name"])
+                    text_chunks.extend(file_chunks)
+                    chunk_metadatas.extend(file_chunk_metadatas)
+                if text_chunks:
+                    vectorstore = get_vectorstore_func(text_chunks=text_chunks, user_id=None, chunk_metadatas=chunk_metadatas)
                     if vectorstore:
                         st.session_state.conversation = get_conversation_chain_func(vectorstore, initial_chat_history=[]) 
                         st.session_state.chat_history = []
@@ -1,84 +1,80 @@
 import streamlit as st
-from PyPDF2 import PdfReader
-from docx import Document
-import openpyxl
-import csv
-import io
 import os
 
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.chat_models import ChatOllama
-from langchain.embeddings import HuggingFaceEmbeddings          # nomic-embed
-from langchain.vectorstores import FAISS
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain.prompts import PromptTemplate
+from extraction import extract_files
+from chunking import iter_chunks
+from metrics import timed
+
+# The LLM stack (LangChain chains, ChatOllama) and the vector stack (FAISS, embeddings, chunk store) are imported
+# inside the functions using them: importing this module (login page) stays cheap
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+def get_ollama_url():
+    return os.getenv("RAGIFY_OLLAMA_URL", DEFAULT_OLLAMA_URL)
+
+# Data Collection (per file, parsed in parallel) -> [{"name", "status", "text", "segments", "error"}]
+@timed("extraction")
+def extract_text_per_file(uploaded_files):
+    results = extract_files([(file.name, file.getvalue()) for file in uploaded_files])
+    for result in results:
+        if result["status"] != "ok":
+            report_extraction_error(result["name"], result["status"], result["error"])
+        result["text"] = "".join(segment["text"] for segment in result["segments"])
+    return results
+
+# Extraction feedback (unsupported format / parsing error / timeout)
+def report_extraction_error(file_name, status, error):
+    if status == "unsupported":
+        st.warning(f"Formato de arquivo não suportado: {file_name}")
+    else:
+        st.error(f"Erro ao processar o arquivo {file_name}: {error}")
 
 # Data Collection (Multiple Files (.pdf; .docx; .xlsx; .csv; .txt; .md) -> text)
 def extract_text_from_files(uploaded_files):
-    text = ""
-    for file in uploaded_files:
-        filename = file.name.lower()
-        try:
-            if filename.endswith(".pdf"):
-                pdf_reader = PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() or ""
-            elif filename.endswith(".docx"):
-                doc = Document(file)
-                for para in doc.paragraphs:
-                    text += para.text + "\n"
-            elif filename.endswith(".xlsx"):
-                wb = openpyxl.load_workbook(file, data_only=True)
-                for sheet in wb.worksheets:
-                    for row in sheet.iter_rows(values_only=True):
-                        text += ' '.join([str(cell) if cell is not None else '' for cell in row]) + "\n"
-            elif filename.endswith(".csv"):
-                try:
-                    decoded = file.read().decode("utf-8")           # .csv (utf-8)
-                except UnicodeDecodeError:
-                    file.seek(0) 
-                    try:
-                        decoded = file.read().decode("latin-1")     # .csv (latin-1)
-                    except UnicodeDecodeError:
-                        file.seek(0)
-                        decoded = file.read().decode("utf-8", errors='replace')
-                reader = csv.reader(io.StringIO(decoded))
-                for row in reader:
-                    text += ' | '.join(row) + "\n"
-            elif filename.endswith(".txt") or filename.endswith(".md"):
-                try:
-                    text += file.read().decode("utf-8") + "\n"                  # .txt/.md (utf-8)
-                except UnicodeDecodeError:
-                    file.seek(0)
-                    try:
-                        text += file.read().decode("latin-1") + "\n"            # .txt/.md (latin-1)
-                    except UnicodeDecodeError:
-                        file.seek(0)
-                        text += file.read().decode("utf-8", errors='replace') + "\n"
-            else:
-                st.warning(f"Formato de arquivo não suportado: {file.name}")
-                text += f"\n[Unsupported file format: {file.name}]\n"
-        except Exception as e:
-            st.error(f"Erro ao processar o arquivo {file.name}: {e}")
-            text += f"\n[Error processing file: {file.name}]\n"
-    return text
-
-# Chunking
+    parts = []
+    for result in extract_text_per_file(uploaded_files):
+        if result["status"] == "unsupported":
+            parts.append(f"\n[Unsupported file format: {result['name']}]\n")
+        elif result["status"] != "ok":
+            parts.append(f"\n[Error processing file: {result['name']}]\n")
+        else:
+            parts.append(result["text"])
+    return "".join(parts)
+
+# Chunking (structure-aware, token budget -> chunking.py)
+@timed("chunking")
 def get_text_chunks(text):
-    text_splitter = CharacterTextSplitter(separator="\n", chunk_size=1000, chunk_overlap=200, length_function=len)
-    chunks = text_splitter.split_text(text)
-    return chunks
+    return [chunk_text for chunk_text, _ in iter_chunks([{"text": text}])]
+
+# Chunking of one extracted file -> (chunk texts, chunk metadatas (source, file ID, page, sheet, rows))
+@timed("chunking")
+def get_file_chunks(segments, source, file_id=None):
+    base_metadata = {"source": source}
+    if file_id is not None:
+        base_metadata["file_id"] = file_id
+    chunks = list(iter_chunks(segments, base_metadata))
+    return [chunk_text for chunk_text, _ in chunks], [metadata for _, metadata in chunks]
 
 # "Conversation Chain" creation
-def get_conversation_chain(vectorstore, initial_chat_history=None):
-    llm = ChatOllama(model="llama3", temperature=0.1)                       # Using llama3 (llama serve)
+# answer_mode: how follow-up questions are condensed (see answer_modes.py, default RAGIFY_ANSWER_MODE)
+# user_id: logged-in user whose memory (summary + recent turns) is loaded from the DB, see chat_memory.py
+def get_conversation_chain(vectorstore, initial_chat_history=None, answer_mode=None, user_id=None):
+    from langchain_community.chat_models import ChatOllama
+    from langchain.prompts import PromptTemplate
+    from answer_modes import ANSWER_MODES, TimedConversationalRetrievalChain, get_answer_mode, get_condense_model
+    from answer_streaming import ANSWER_LLM_TAG, llm_metrics_handler
+    from chat_memory import create_chat_memory
 
-    memory = ConversationBufferMemory(memory_key='chat_history', return_messages=True, output_key='answer')         # Conversation Memory
-    
-    # Caso exista histórico de conversa
-    if initial_chat_history: 
-        memory.chat_memory.messages = initial_chat_history
+    answer_mode = answer_mode if answer_mode in ANSWER_MODES else get_answer_mode()
+    ollama_url = get_ollama_url()
+    callbacks = [llm_metrics_handler]           # Duration + tokens of every LLM call (answer_streaming.py)
+    llm = ChatOllama(model="llama3", temperature=0.1, tags=[ANSWER_LLM_TAG], base_url=ollama_url, callbacks=callbacks)            # Using llama3 (llama serve), answer streamed
+    condense_question_llm = ChatOllama(model=get_condense_model(answer_mode), temperature=0.1, tags=["ragify_condense"],
+                                       base_url=ollama_url, callbacks=callbacks)          # Rephrases follow-up questions (not streamed)
+
+    summary_llm = ChatOllama(model="llama3", temperature=0.1, tags=["ragify_summary"], base_url=ollama_url, callbacks=callbacks)
+    memory = create_chat_memory(summary_llm, user_id, initial_chat_history)          # Conversation Memory
 
     # Prompt Template
     CUSTOM_PROMPT_TEMPLATE = """
@@ -105,8 +101,10 @@ def get_conversation_chain(vectorstore, initial_chat_history=None):
         input_variables=["chat_history", "question", "context"]
     )
     
-    conversation_chain = ConversationalRetrievalChain.from_llm(
+    conversation_chain = TimedConversationalRetrievalChain.from_llm(
         llm=llm, 
+        answer_mode=answer_mode,
+        condense_question_llm=condense_question_llm,
         retriever=vectorstore.as_retriever(), 
         memory=memory, 
         combine_docs_chain_kwargs={"prompt": prompt},
@@ -114,11 +112,22 @@ def get_conversation_chain(vectorstore, initial_chat_history=None):
     )
     return conversation_chain
 
+# Restricts the conversation's searches to some of the user's files (user_files IDs, None -> whole knowledge base)
+def set_retrieval_files(conversation, file_ids=None):
+    if file_ids:
+        conversation.retriever.search_kwargs["file_ids"] = list(file_ids)
+    else:
+        conversation.retriever.search_kwargs.pop("file_ids", None)
+
 # Document embeddings / "Vectorstore" creation (FAISS)
-def get_vectorstore(text_chunks=None, user_id=None, db_get_user_faiss_path_func=None, faiss_index_name_const=None, session_state=None, st_feedback_obj=None):
+def get_vectorstore(text_chunks=None, user_id=None, db_get_user_faiss_path_func=None, faiss_index_name_const=None, session_state=None, st_feedback_obj=None,
+                    chunk_metadatas=None, chunk_ids=None, replace_vector_ids=None, for_update=False):
     
-    # Using nomic-embed-text-v1 (Hugging Face API)
-    embeddings = HuggingFaceEmbeddings(model_name="nomic-ai/nomic-embed-text-v1", model_kwargs={"trust_remote_code": True})
+    from embeddings import get_embedding_engine
+    from index_cache import create_vectorstore, get_cached_vectorstore, index_exists, migrate_pickled_vectorstore
+
+    # Using nomic-embed-text-v1 (shared engine, loaded once per process)
+    embeddings = get_embedding_engine()
     
     if user_id: 
         if not all([db_get_user_faiss_path_func, faiss_index_name_const, session_state, st_feedback_obj]):
@@ -127,7 +136,6 @@ def get_vectorstore(text_chunks=None, user_id=None, db_get_user_faiss_path_func=
             return None
 
         user_faiss_dir_path = db_get_user_faiss_path_func(user_id)
-        faiss_index_file_path = os.path.join(user_faiss_dir_path, f"{faiss_index_name_const}.faiss")
 
         if text_chunks: 
             if not os.path.exists(user_faiss_dir_path):
@@ -135,25 +143,29 @@ def get_vectorstore(text_chunks=None, user_id=None, db_get_user_faiss_path_func=
             
             vectorstore = None          # VectorStore INIT
 
-            if os.path.exists(faiss_index_file_path):
-                try:        # IF vectorstore exists, it is loaded
-                    local_vectorstore = FAISS.load_local(user_faiss_dir_path, embeddings, faiss_index_name_const, allow_dangerous_deserialization=True)
-                    local_vectorstore.add_texts(texts=text_chunks) 
-                    local_vectorstore.save_local(user_faiss_dir_path, faiss_index_name_const)
-                    vectorstore = local_vectorstore
-                except Exception as e:
-                    st_feedback_obj.error(f"Error updating FAISS index: {e}. Creating a new index.")
-                    vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-                    vectorstore.save_local(user_faiss_dir_path, faiss_index_name_const)
-            else:           # IF NOT, creates a new one
-                vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-                vectorstore.save_local(user_faiss_dir_path, faiss_index_name_const)
+            try:        # Existing vectorstore (if any) is loaded, new chunks are added to it
+                local_vectorstore = open_user_vectorstore(user_faiss_dir_path, faiss_index_name_const)
+                if replace_vector_ids:          # Re-uploaded files -> old vectors are dropped first
+                    delete_vectors(local_vectorstore, replace_vector_ids)
+                local_vectorstore.add_texts(texts=text_chunks, metadatas=chunk_metadatas, ids=chunk_ids) 
+                save_user_vectorstore(local_vectorstore, user_faiss_dir_path, faiss_index_name_const)
+                vectorstore = local_vectorstore
+            except Exception as e:
+                st_feedback_obj.error(f"Error updating FAISS index: {e}. Creating a new index.")
+                clear_user_vectorstore(user_faiss_dir_path, faiss_index_name_const)
+                vectorstore = create_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
+                vectorstore.add_texts(texts=text_chunks, metadatas=chunk_metadatas, ids=chunk_ids)
+                save_user_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const)
             return vectorstore
         
         else: # No text chunk, just loads
-            if os.path.exists(faiss_index_file_path):
+            if index_exists(user_faiss_dir_path, faiss_index_name_const):
                 try:
-                    vectorstore = FAISS.load_local(user_faiss_dir_path, embeddings, faiss_index_name_const, allow_dangerous_deserialization=True)
+                    if for_update:          # Private copy (will be modified and saved)
+                        vectorstore = open_user_vectorstore(user_faiss_dir_path, faiss_index_name_const)
+                    else:                   # Shared copy from the process-wide index cache (read-only)
+                        migrate_pickled_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
+                        vectorstore = get_cached_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
                     session_state.vectorstore_loaded_for_user = True 
                     return vectorstore
                 except Exception as e:
@@ -166,6 +178,78 @@ def get_vectorstore(text_chunks=None, user_id=None, db_get_user_faiss_path_func=
                 
     else: # User not logged in (Default flow)
         if text_chunks:
-            vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
+            from langchain.vectorstores import FAISS
+            from dedup import drop_duplicates
+            text_chunks, chunk_metadatas, chunk_ids = drop_duplicates(text_chunks, chunk_metadatas, chunk_ids)
+            vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings, metadatas=chunk_metadatas, ids=chunk_ids)
             return vectorstore
-        return None
\ No newline at end of file
+        return None
+
+# Private (modifiable) vectorstore of a user: a copy of its saved one (parts shared with the index cache),
+# or an empty one backed by a new chunk store
+def open_user_vectorstore(user_faiss_dir_path, faiss_index_name_const):
+    from embeddings import get_embedding_engine
+    from index_cache import create_vectorstore, get_cached_vectorstore, migrate_pickled_vectorstore
+
+    embeddings = get_embedding_engine()
+    migrate_pickled_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)        # Index saved before the chunk store
+    vectorstore = get_cached_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
+    if vectorstore is not None:
+        return vectorstore.for_update()
+    return create_vectorstore(user_faiss_dir_path, faiss_index_name_const, embeddings)
+
+# Removes a user's saved index (manifest first, then index files + recall report) and empties its chunk store
+def clear_user_vectorstore(user_faiss_dir_path, faiss_index_name_const):
+    from answer_cache import invalidate_cached_answers
+    from chunk_store import ChunkStore
+    from index_cache import get_chunk_store_path, invalidate_cached_vectorstore
+    from segments import get_manifest_path
+
+    file_paths = [get_manifest_path(user_faiss_dir_path, faiss_index_name_const)]
+    if os.path.isdir(user_faiss_dir_path):
+        file_paths += [os.path.join(user_faiss_dir_path, file_name) for file_name in os.listdir(user_faiss_dir_path)
+                       if file_name.startswith(faiss_index_name_const) and file_name.endswith((".faiss", ".pkl", "_report.json"))]
+    for file_path in file_paths:
+        try:
+            if os.path.exists(file_path): os.remove(file_path)
+        except OSError:             # Still memory-mapped (Windows) -> unreferenced, overwritten/removed later
+            pass
+    chunk_store_path = get_chunk_store_path(user_faiss_dir_path, faiss_index_name_const)
+    if os.path.exists(chunk_store_path):
+        chunk_store = ChunkStore(chunk_store_path)
+        chunk_store.clear()
+        chunk_store.close()
+    invalidate_cached_vectorstore(user_faiss_dir_path)
+    invalidate_cached_answers(user_faiss_dir_path)
+
+# Removes vectors (FAISS index + docstore) by ID, ignoring IDs that are no longer stored
+def delete_vectors(vectorstore, vector_ids):
+    if not hasattr(vectorstore, "apply_pending_deletes"):          # In-memory (guest) vectorstore: flat index
+        vector_ids = [vector_id for vector_id in dict.fromkeys(vector_ids) if vector_id in vectorstore.index_to_docstore_id.values()]
+        if vector_ids:
+            vectorstore.delete(vector_ids)
+        return len(vector_ids)
+    return vectorstore.delete(vector_ids)
+
+# Saves a user's vectorstore (new segment + tombstones); segments are merged in the background once
+# thresholds are crossed, migrating the base index to the type that fits its size (flat -> IVF -> SQ8/PQ)
+def save_user_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const):
+    from answer_cache import invalidate_cached_answers
+    from index_cache import invalidate_cached_vectorstore, save_vectorstore, update_cached_vectorstore
+    from segments import schedule_compaction
+
+    if save_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const):
+        update_cached_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const)
+    else:                   # Another session saved meanwhile -> reloaded from disk on next use
+        invalidate_cached_vectorstore(user_faiss_dir_path)
+    invalidate_cached_answers(user_faiss_dir_path)            # New knowledge base version
+    schedule_compaction(user_faiss_dir_path, faiss_index_name_const, vectorstore.embedding_function, vectorstore.manifest)
+
+# Removes one file's vectors from the user's saved index (no re-embedding of the other files)
+def remove_file_vectors(vectorstore, vector_ids, user_faiss_dir_path, faiss_index_name_const):
+    delete_vectors(vectorstore, vector_ids)
+    if vectorstore.count_vectors() <= 0:           # Nothing left -> index files removed
+        clear_user_vectorstore(user_faiss_dir_path, faiss_index_name_const)
+        return None
+    save_user_vectorstore(vectorstore, user_faiss_dir_path, faiss_index_name_const)
+    return vectorstore
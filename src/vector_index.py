@@ -0,0 +1,197 @@
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_sq8", "ivf_pq")
+
+# Automatic selection by number of vectors: (up to, index type)
+INDEX_TYPE_THRESHOLDS = [
+    (20000, "flat"),                # Exact search is cheap enough
+    (200000, "ivf_flat"),           # Searches ~nprobe/nlist of the vectors, no compression
+    (1000000, "ivf_sq8"),           # 8-bit scalar quantization (4x less RAM)
+    (None, "ivf_pq"),               # Product quantization (~32x less RAM)
+]
+DOWNGRADE_FACTOR = 0.5              # Shrinking knowledge bases only migrate back well below a threshold
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+_TRAIN_POINTS_PER_LIST = 256
+_MIN_VECTORS_FOR_ANN = 1000                        # Forced ANN types need enough vectors to train
+EXACT_TYPES = ("flat", "ivf_flat", "hnsw")          # reconstruct() returns the original vectors
+_MAX_FILTERED_EF_SEARCH = 1024
+
+# Flat/HNSW indexes are wrapped in an IndexIDMap2 (vectors are labeled with their chunk store ID)
+def _unwrap(index):
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def get_index_type(index):
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def _auto_index_type(n_vectors):
+    for limit, index_type in INDEX_TYPE_THRESHOLDS:
+        if limit is None or n_vectors < limit:
+            return index_type
+
+# Index type for a knowledge base of n_vectors (RAGIFY_INDEX_TYPE forces one; default "auto")
+def choose_index_type(n_vectors, current_type=None):
+    forced = os.getenv("RAGIFY_INDEX_TYPE", "auto")
+    if forced in INDEX_TYPES:
+        return forced if n_vectors >= _MIN_VECTORS_FOR_ANN else "flat"
+    chosen = _auto_index_type(n_vectors)
+    if current_type in INDEX_TYPES and current_type != "hnsw":
+        ranks = [index_type for _, index_type in INDEX_TYPE_THRESHOLDS]
+        if ranks.index(chosen) < ranks.index(current_type) and _auto_index_type(int(n_vectors / DOWNGRADE_FACTOR)) != chosen:
+            return current_type             # Hysteresis: avoids flapping around a threshold
+    return chosen
+
+def _ivf_params(n_vectors):
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+    nprobe = min(nlist, max(16, nlist // 16))
+    return nlist, nprobe
+
+def _pq_subquantizers(dim):
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+# Creates (and trains) an empty index of the given type for these vectors
+# Every type is filled with add_with_ids (IVF stores the labels natively, flat/HNSW through an IndexIDMap2)
+def create_index(index_type, vectors):
+    n_vectors, dim = vectors.shape
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim)), {}
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(index), {"M": HNSW_M, "efSearch": HNSW_EF_SEARCH}
+
+    nlist, nprobe = _ivf_params(n_vectors)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_sq8":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), 8)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    train_size = min(n_vectors, nlist * _TRAIN_POINTS_PER_LIST)
+    sample = vectors if train_size == n_vectors else vectors[np.random.default_rng(0).choice(n_vectors, train_size, replace=False)]
+    index.train(sample)
+    index.nprobe = nprobe
+    return index, {"nlist": nlist, "nprobe": nprobe}
+
+# Approximate RAM used by an index
+def estimate_index_bytes(index):
+    index_type = get_index_type(index)
+    n_vectors, dim = index.ntotal, index.d
+    if index_type == "ivf_pq":
+        return n_vectors * (_unwrap(index).pq.M + 8)
+    if index_type == "ivf_sq8":
+        return n_vectors * (dim + 8)
+    if index_type == "hnsw":
+        return n_vectors * (dim * 4 + HNSW_M * 2 * 4 + 8)
+    return n_vectors * (dim * 4 + 8)                # Flat / IVF flat (vector + label)
+
+# Labels of every vector of an index
+def index_labels(index):
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        labels = [faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+                  for list_no in range(index.nlist) if invlists.list_size(list_no)]
+        return np.concatenate(labels).astype(np.int64) if labels else np.zeros(0, dtype=np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)              # Plain index: labels = positions
+
+# Search parameters restricting a search to the labels of `selector` (checked inside the index: only those vectors
+# are scored and returned). selectivity = selected / indexed vectors: the narrower the selection, the more IVF lists /
+# HNSW candidates are visited so that k selected neighbors are still found
+def selection_params(index, selector, selectivity):
+    inner = _unwrap(index)
+    selectivity = max(selectivity, 1e-6)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(inner.nlist, math.ceil(inner.nprobe / selectivity)))
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_search = min(_MAX_FILTERED_EF_SEARCH, max(inner.hnsw.efSearch, math.ceil(inner.hnsw.efSearch / selectivity)))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    return faiss.SearchParameters(sel=selector)
+
+# All vectors of an index + their labels (lossy for the quantized types)
+def reconstruct_all(index):
+    labels = index_labels(index)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32), labels
+    if isinstance(index, faiss.IndexIDMap):
+        return _unwrap(index).reconstruct_n(0, index.ntotal), labels
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)        # Labels are arbitrary -> hashtable lookup
+        vectors = index.reconstruct_batch(labels)
+        index.set_direct_map_type(faiss.DirectMap.NoMap)
+        return vectors, labels
+    return index.reconstruct_n(0, index.ntotal), labels
+
+# Vectors of some labels of an index (lossy for the quantized types)
+def reconstruct_labels(index, labels):
+    labels = np.asarray(labels, dtype=np.int64)
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        vectors = index.reconstruct_batch(labels)
+        index.set_direct_map_type(faiss.DirectMap.NoMap)
+        return vectors
+    return np.array([index.reconstruct(int(label)) for label in labels], dtype=np.float32)
+
+# Recall@k of `index` against exact search, on a sample of the indexed vectors
+def recall_report(index, vectors, labels, k=10, n_queries=100, params=None):
+    n_vectors = len(vectors)
+    k = min(k, n_vectors)
+    queries = vectors[np.random.default_rng(1).choice(n_vectors, min(n_queries, n_vectors), replace=False)]
+
+    t0 = time.perf_counter()
+    _, exact_positions = faiss.knn(queries, vectors, k)
+    exact_ids = labels[exact_positions]
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    t0 = time.perf_counter()
+    _, approx_ids = index.search(queries, k)
+    approx_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    hits = sum(len(set(exact_row) & set(approx_row)) for exact_row, approx_row in zip(exact_ids, approx_ids))
+    return {
+        "index_type": get_index_type(index),
+        "n_vectors": n_vectors,
+        "params": params or {},
+        f"recall_at_{k}": round(hits / (k * len(queries)), 4),
+        "search_ms_per_query": round(approx_ms, 3),
+        "exact_search_ms_per_query": round(exact_ms, 3),
+        "index_bytes": estimate_index_bytes(index),
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+# Builds an index of the given type holding `vectors` (labeled `labels`) + its recall/latency report
+def build_index(index_type, vectors, labels):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    labels = np.ascontiguousarray(labels, dtype=np.int64)
+    t0 = time.perf_counter()
+    index, params = create_index(index_type, vectors)
+    index.add_with_ids(vectors, labels)
+    build_seconds = time.perf_counter() - t0
+    report = recall_report(index, vectors, labels, params=params)
+    report["build_seconds"] = round(build_seconds, 3)
+    return index, report
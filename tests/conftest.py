@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Modules under src/ import each other by name (as `streamlit run src/app.py` does)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# The app writes sqlite3.db / faiss_user_index in the working directory -> one temporary directory per test
+# (absolute paths: connections and cached indexes of a previous test are never reused)
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    import database
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "sqlite3.db"))
+    monkeypatch.setattr(database, "FAISS_BASE_PATH", str(tmp_path / "faiss_user_index"))
+    monkeypatch.setattr(database, "_initialized", False)
+    return tmp_path
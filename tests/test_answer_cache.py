@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+from answer_cache import AnswerCache, get_answer_cache_key
+
+# Deterministic embeddings: questions sharing their first word are "similar"
+class WordEmbeddings:
+    def embed_query(self, text):
+        vector = [0.0] * 8
+        vector[sum(map(ord, text.split()[0])) % 8] = 1.0
+        return vector
+
+def _key(version, file_ids=None):
+    manifest = {"generation": version + 10, "content_version": version}
+    return get_answer_cache_key("faiss/user_1", SimpleNamespace(manifest=manifest), "What is the deadline?", file_ids)
+
+def test_exact_and_similar_hits():
+    cache = AnswerCache(WordEmbeddings(), similarity=0.9)
+    cache.store("scope", 1, "What is the deadline?", "Friday")
+    assert cache.lookup("scope", 1, "what is the deadline")["match"] == "exact"
+    assert cache.lookup("scope", 1, "What deadline applies?")["match"] == "similar"
+    assert cache.lookup("scope", 1, "Who signed it?") is None
+
+def test_file_scopes_do_not_evict_each_other():
+    cache = AnswerCache(WordEmbeddings())
+    whole, scoped = _key(3), _key(3, [2, 1])
+    assert scoped == (("faiss/user_1", (1, 2)), 3)
+    cache.store(*whole, "What is the deadline?", "Friday")
+    cache.store(*scoped, "What is the deadline?", "Monday (file 1)")
+    assert cache.lookup(*whole, "What is the deadline?")["answer"] == "Friday"
+    assert cache.lookup(*scoped, "What is the deadline?")["answer"] == "Monday (file 1)"
+
+def test_new_version_drops_every_scope_of_the_index():
+    cache = AnswerCache(WordEmbeddings())
+    cache.store(*_key(3), "What is the deadline?", "Friday")
+    cache.store(*_key(3, [1]), "What is the deadline?", "Monday")
+    cache.store("faiss/user_2", 7, "What is the deadline?", "Other user")
+    cache.store(*_key(4), "Who signed it?", "Alice")
+    assert cache.get_stats()["entries"] == 2
+    assert cache.lookup(*_key(4, [1]), "What is the deadline?") is None
+    assert cache.lookup("faiss/user_2", 7, "What is the deadline?")["answer"] == "Other user"
+
+def test_invalidate_drops_all_scopes_of_the_directory():
+    cache = AnswerCache(WordEmbeddings())
+    cache.store(*_key(3), "What is the deadline?", "Friday")
+    cache.store(*_key(3, [1]), "What is the deadline?", "Monday")
+    cache.invalidate("faiss/user_1")
+    assert cache.get_stats()["entries"] == 0
+
+def test_expired_and_conversational_questions():
+    cache = AnswerCache(WordEmbeddings(), ttl_seconds=0)
+    cache.store("scope", 1, "What is the deadline?", "Friday")
+    assert cache.lookup("scope", 1, "What is the deadline?") is None
+    assert get_answer_cache_key("faiss/user_1", SimpleNamespace(manifest=None), "What is the deadline?") is None
+
+def test_only_follow_up_questions_bypass_the_cache():
+    vectorstore = SimpleNamespace(manifest={"generation": 5, "content_version": "v1"})
+    history = [("Who are the parties of the lease agreement?", "Acme and Bob.")]
+    for question in ("What is this contract about?", "Is there more than one signatory?", "What does it say about penalties?"):
+        assert get_answer_cache_key("faiss/user_1", vectorstore, question) == (("faiss/user_1", ()), "v1")
+        assert get_answer_cache_key("faiss/user_1", vectorstore, question, chat_history=[]) is not None
+    assert get_answer_cache_key("faiss/user_1", vectorstore, "And its price?", chat_history=history) is None
+    assert get_answer_cache_key("faiss/user_1", vectorstore, "What is the notice period of the lease agreement?",
+                                chat_history=history) is not None
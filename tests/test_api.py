@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from werkzeug.security import generate_password_hash
+
+import database
+from benchmark import FakeOllamaServer, StubEmbeddings
+from embeddings import EmbeddingEngine, set_embedding_engine
+
+@pytest.fixture
+def ollama(workdir, monkeypatch):
+    monkeypatch.setenv("RAGIFY_METRICS_PORT", "0")
+    monkeypatch.setenv("RAGIFY_API_LLM_CONCURRENCY", "2")
+    set_embedding_engine(EmbeddingEngine(model_name="stub", base_embeddings=StubEmbeddings(32)))
+    server = FakeOllamaServer(answer_tokens=10, token_delay=0.001).start()
+    monkeypatch.setenv("RAGIFY_OLLAMA_URL", server.url)
+    database.init_db()
+    database.add_user("api", generate_password_hash("pw"))
+    yield server
+    server.stop()
+
+def _run(scenario):
+    import api
+
+    async def main():
+        client = TestClient(TestServer(api.create_app()))
+        await client.start_server()
+        try:
+            await scenario(client)
+        finally:
+            await client.close()
+    asyncio.run(main())
+
+async def _login(client):
+    response = await client.post("/login", json={"username": "api", "password": "pw"})
+    assert response.status == 200
+    return {"Authorization": f"Bearer {(await response.json())['token']}"}
+
+async def _upload(client, headers, files):
+    data = aiohttp.FormData()
+    for name, content in files:
+        data.add_field("files", content, filename=name)
+    response = await client.post("/files", data=data, headers=headers)
+    assert response.status == 202
+    job_id = (await response.json())["job_id"]
+    while True:
+        job = await (await client.get(f"/jobs/{job_id}", headers=headers)).json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.05)
+
+def test_requests_need_a_valid_token(ollama):
+    async def scenario(client):
+        assert (await client.post("/ask", json={"question": "x"})).status == 401
+        assert (await client.post("/login", json={"username": "api", "password": "bad"})).status == 401
+        headers = await _login(client)
+        assert (await client.get("/files", headers=headers)).status == 200
+        assert (await client.post("/logout", headers=headers)).status == 200
+        assert (await client.get("/files", headers=headers)).status == 401
+    _run(scenario)
+
+def test_upload_ask_and_delete(ollama):
+    async def scenario(client):
+        headers = await _login(client)
+        response = await client.post("/ask", json={"question": "x"}, headers=headers)
+        assert response.status == 409                       # No knowledge base yet
+
+        job = await _upload(client, headers, [("a.txt", b"The contract deadline is March 3.\n" * 20),
+                                              ("b.md", b"Budget review meeting in Lisbon.\n" * 20)])
+        assert job["status"] == "done"
+        files = (await (await client.get("/files", headers=headers)).json())["files"]
+        assert sorted(file["filename"] for file in files) == ["a.txt", "b.md"]
+
+        question = {"question": "When is the contract deadline?"}
+        first = await (await client.post("/ask", json=question, headers=headers)).json()
+        assert first["answer"] and not first["cached"]
+        again = await (await client.post("/ask", json=question, headers=headers)).json()
+        assert again["cached"] and again["answer"] == first["answer"]
+
+        response = await client.post("/ask", json={"question": "Who is in the meeting?", "stream": True,
+                                                   "file_ids": [files[0]["id"]]}, headers=headers)
+        assert response.status == 200
+        lines = [json.loads(line) for line in (await response.text()).splitlines()]
+        assert len(lines) > 1 and "answer" in lines[-1]
+
+        response = await client.delete(f"/files/{files[0]['id']}", headers=headers)
+        assert response.status == 200
+        assert (await client.delete("/files/99999", headers=headers)).status == 404
+        remaining = (await (await client.get("/files", headers=headers)).json())["files"]
+        assert [file["id"] for file in remaining] == [files[1]["id"]]
+    _run(scenario)
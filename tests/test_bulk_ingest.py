@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bulk_ingest
+import database
+from benchmark import StubEmbeddings
+from embeddings import EmbeddingEngine, set_embedding_engine
+
+@pytest.fixture
+def user_id(workdir, monkeypatch):
+    monkeypatch.setenv("RAGIFY_METRICS_PORT", "0")
+    set_embedding_engine(EmbeddingEngine(model_name="stub", base_embeddings=StubEmbeddings(32)))
+    database.init_db()
+    return database.add_user("alice", "secret")
+
+def test_cli_does_not_import_the_streamlit_app():
+    script = "import sys, bulk_ingest; print(sorted({'app', 'ui_handlers'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(bulk_ingest.__file__),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+# Second run over the same directory: nothing is read twice, empty files included
+def test_resume_skips_ingested_and_empty_files(user_id, workdir, monkeypatch):
+    docs = workdir / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("\n\n".join(f"Paragraph {i} about invoices number {i * 7}." for i in range(20)))
+    (docs / "empty.txt").write_text("   \n\n  ")
+    files = bulk_ingest.collect_files([str(docs)])
+
+    first = bulk_ingest.bulk_ingest(user_id, files, workers=1)
+    assert (first["ingested"], first["empty"], first["skipped"]) == (1, 1, 0)
+
+    parsed = []
+    extract_files = bulk_ingest.extract_files
+    monkeypatch.setattr(bulk_ingest, "extract_files", lambda items, workers=None: parsed.extend(items) or extract_files(items, workers))
+    second = bulk_ingest.bulk_ingest(user_id, files, workers=1)
+    assert (second["ingested"], second["empty"], second["skipped"]) == (0, 0, 2)
+    assert parsed == []
+    assert [file["filename"] for file in database.get_user_files(user_id)] == ["docs/a.txt"]
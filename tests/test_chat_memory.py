@@ -0,0 +1,57 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import database
+from chat_memory import _MAX_SUMMARY_CHARS, _bound_summary, create_chat_memory
+
+# LLM stub: the summary lists the questions folded so far
+class SummaryLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        summary = prompt.rsplit("Current summary:\n", 1)[1].split("\n\nNew lines of conversation:", 1)[0]
+        questions = [line[len("Human: "):] for line in prompt.splitlines() if line.startswith("Human: Question")]
+        return SimpleNamespace(content=" ".join(filter(None, [summary] + questions)))
+
+def _wait_for_fold(memory):
+    for _ in range(500):
+        if not memory._folding:
+            return
+        time.sleep(0.01)
+    raise AssertionError("summary fold still running")
+
+@pytest.fixture
+def user_id(workdir, monkeypatch):
+    monkeypatch.setenv("RAGIFY_MEMORY_MODE", "summary")
+    monkeypatch.setenv("RAGIFY_MEMORY_TURNS", "6")
+    database.init_db()
+    return database.add_user("alice", "secret")
+
+def test_long_summary_is_cut_at_a_sentence_boundary():
+    summary = " ".join(f"Fact number {i} about the lease." for i in range(200))
+    bounded = _bound_summary(summary)
+    assert len(bounded) <= _MAX_SUMMARY_CHARS
+    assert bounded.startswith("Fact number 0 ") and bounded.endswith("lease.")
+    assert _bound_summary("Short summary.") == "Short summary."
+    assert _bound_summary("x" * 10 + " " + "y" * (_MAX_SUMMARY_CHARS * 2)) == "x" * 10
+
+# History saved before summaries existed: every old turn ends up in the summary, none is skipped
+def test_old_history_is_folded_in_batches(user_id):
+    for i in range(60):
+        database.save_chat_message(user_id, f"Question{i}?", f"Answer {i}.")
+    llm = SummaryLLM()
+    memory = create_chat_memory(llm, user_id)
+    _wait_for_fold(memory)
+
+    summary, summarized_turns = database.get_chat_summary(user_id)
+    assert summarized_turns == 60 - 6 and memory.catch_up_turns == 0
+    assert summary.split() == [f"Question{i}?" for i in range(summarized_turns)]
+    assert "at most" in llm.prompts[0]
+    assert [question for question, _ in memory.turns] == [f"Question{i}?" for i in range(summarized_turns, 60)]
+
+    reloaded = create_chat_memory(llm, user_id)
+    assert (reloaded.summary, reloaded.summarized_turns, reloaded.catch_up_turns) == (summary, summarized_turns, 0)
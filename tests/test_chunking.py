@@ -0,0 +1,26 @@
+from chunking import count_tokens, iter_chunks
+
+def test_chunks_stay_within_budget():
+    segments = [{"text": f"Line {i} of the document with a few words.\n"} for i in range(200)]
+    chunks = list(iter_chunks(segments, {"source": "a.txt"}, max_tokens=50))
+    assert len(chunks) > 1
+    assert all(count_tokens(text) <= 50 for text, _ in chunks)
+    assert all(metadata["source"] == "a.txt" for _, metadata in chunks)
+
+def test_unbroken_long_token_is_split():
+    text = ",".join(map(str, range(3000)))             # No whitespace: one "word" of ~6000 tokens
+    chunks = list(iter_chunks([{"text": text}], max_tokens=200))
+    assert all(count_tokens(chunk) <= 200 for chunk, _ in chunks)
+    assert "".join(chunk for chunk, _ in chunks) == text
+
+def test_long_row_is_split_and_keeps_row_metadata():
+    row = {"text": "|".join(f"cell{i}" for i in range(500)), "sheet": "Data", "row": 7}
+    chunks = list(iter_chunks([row], max_tokens=100))
+    assert len(chunks) > 1
+    assert all(count_tokens(text) <= 100 for text, _ in chunks)
+    assert all(metadata["sheet"] == "Data" and metadata["row_start"] == 7 for _, metadata in chunks)
+
+def test_pages_are_chunk_boundaries():
+    segments = [{"text": "First page text.", "page": 1}, {"text": "Second page text.", "page": 2}]
+    chunks = list(iter_chunks(segments, max_tokens=100))
+    assert [metadata["page"] for _, metadata in chunks] == [1, 2]
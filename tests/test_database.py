@@ -0,0 +1,66 @@
+import sqlite3
+
+import database
+
+# Schema of a DB file created before the migrations (no user_version, duplicated file rows allowed)
+_BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL);
+CREATE TABLE chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                           user_message TEXT, ai_response TEXT);
+CREATE TABLE user_files (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, filename TEXT NOT NULL,
+                         faiss_index_subpath TEXT, processed_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+INSERT INTO users (username, password_hash) VALUES ('alice', 'hash');
+INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (1, 'Hi?', 'Hello!');
+INSERT INTO user_files (user_id, filename, faiss_index_subpath) VALUES (1, 'a.pdf', 'faiss_user_index/1');
+INSERT INTO user_files (user_id, filename, faiss_index_subpath) VALUES (1, 'a.pdf', 'faiss_user_index/1');
+INSERT INTO user_files (user_id, filename, faiss_index_subpath) VALUES (1, 'b.pdf', 'faiss_user_index/1');
+"""
+
+def _schema_version():
+    return database.get_db_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def _columns(table):
+    return [row[1] for row in database.get_db_connection().execute(f"PRAGMA table_info({table})")]
+
+def test_new_database(workdir):
+    database.init_db()
+    assert _schema_version() == len(database._MIGRATIONS)
+    assert (workdir / "faiss_user_index").is_dir()
+    user_id = database.add_user("alice", "hash")
+    assert database.add_user("alice", "other") is None
+    file_ids = database.add_user_file_records(user_id, ["a.pdf", "b.pdf"], database.get_user_faiss_path(user_id))
+    database.set_file_vectors(file_ids["a.pdf"], ["v1", "v2"])
+    assert database.get_file_vector_ids(file_ids["a.pdf"]) == ["v1", "v2"]
+    assert database.count_user_vectors(user_id) == 2
+
+def test_baseline_database_is_migrated(workdir):
+    conn = sqlite3.connect(database.DB_NAME)
+    conn.executescript(_BASELINE_SCHEMA)
+    conn.close()
+
+    database.init_db()
+    assert _schema_version() == len(database._MIGRATIONS)
+    assert database.get_user("alice")["password_hash"] == "hash"
+    assert database.count_chat_turns(1) == 1
+    assert sorted(file["filename"] for file in database.get_user_files(1)) == ["a.pdf", "b.pdf"]     # Duplicates merged
+    assert "content_hash" in _columns("user_files")
+    for table in ("file_vectors", "chat_summaries", "ingestion_jobs", "ingestion_job_files", "api_tokens", "empty_file_hashes"):
+        assert _columns(table), table
+
+    database.add_api_token(1, "token-hash")
+    assert database.get_api_token_user("token-hash", max_age_hours=1) == 1
+    database.set_file_hashes({database.get_user_files(1)[0]["id"]: "sha"})
+    assert database.get_user_file_hashes(1) == {"sha"}
+
+def test_partially_migrated_database_resumes(workdir, monkeypatch):
+    migrations = database._MIGRATIONS
+    monkeypatch.setattr(database, "_MIGRATIONS", migrations[:2])
+    database.init_db()
+    assert _schema_version() == 2 and "content_hash" not in _columns("user_files")
+
+    monkeypatch.setattr(database, "_MIGRATIONS", migrations)           # Next release: remaining migrations only
+    monkeypatch.setattr(database, "_initialized", False)
+    database.init_db()
+    database.create_tables()            # Up to date: no-op
+    assert _schema_version() == len(database._MIGRATIONS)
+    assert "content_hash" in _columns("user_files")
@@ -0,0 +1,155 @@
+import random
+import sqlite3
+import uuid
+
+import pytest
+from langchain_core.documents import Document
+
+from benchmark import StubEmbeddings
+from chunk_store import ChunkStore
+from dedup import content_hash, find_duplicates, minhash
+from index_cache import create_vectorstore, load_vectorstore
+from segments import save_segment
+
+_WORDS = [f"term{i}" for i in range(400)]
+
+def _text(seed, words=150):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+def _revise(text):
+    words = text.split()
+    words[len(words) // 2] = "EUR 12,500"            # One amount changed in a ~150-word clause
+    return " ".join(words)
+
+def _ids(n):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+@pytest.fixture
+def index(tmp_path):
+    embeddings = StubEmbeddings(32)
+    directory = str(tmp_path / "index")
+
+    def reopen(vectorstore=None):
+        if vectorstore is not None:
+            save_segment(vectorstore, directory, "index")
+            vectorstore.docstore.close()
+        return load_vectorstore(directory, "index", embeddings)
+
+    return create_vectorstore(directory, "index", embeddings), reopen
+
+def test_exact_duplicates_within_batch_and_store(monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    texts = [_text(1), "  " + _text(1).replace(" ", "\n "), _text(2)]
+    _, _, matches = find_duplicates(texts)
+    assert matches == [None, ("batch", 0, "exact"), None]
+
+def test_case_is_not_ignored(monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    _, _, matches = find_duplicates(["Payment to ACME due in May", "payment to acme due in may"])
+    assert matches == [None, None]
+
+def test_revision_is_not_a_duplicate_by_default(index, monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    vectorstore, reopen = index
+    clause = _text(3)
+    vectorstore.add_texts([clause], [{"source": "v1.pdf", "file_id": 1}], _ids(1))
+    vectorstore = reopen(vectorstore)
+    vectorstore.add_texts([_revise(clause)], [{"source": "v2.pdf", "file_id": 2}], _ids(1))
+    assert vectorstore.dedup_stats == {"unique": 1, "exact": 0, "near": 0}
+    vectorstore = reopen(vectorstore)
+    docs = vectorstore.similarity_search(_revise(clause), k=1, file_ids=[2])
+    assert docs[0].page_content == _revise(clause)
+
+def test_near_mode_only_within_one_file(monkeypatch):
+    monkeypatch.setenv("RAGIFY_DEDUP", "near")
+    clause = _text(4)
+    texts = [clause, _revise(clause), _revise(clause) + " x"]
+    _, _, matches = find_duplicates(texts, [{"file_id": 1}, {"file_id": 2}, {"file_id": 2}])
+    assert matches[0] is None and matches[1] is None            # Other file: kept (revision)
+    assert matches[2] == ("batch", 1, "near")                   # Same file: collapsed
+
+def test_near_mode_checks_the_stored_chunks_of_the_file(index, monkeypatch):
+    monkeypatch.setenv("RAGIFY_DEDUP", "near")
+    vectorstore, reopen = index
+    clause, first_ids = _text(12), _ids(1)
+    vectorstore.add_texts([clause], [{"source": "a.xlsx", "file_id": 1}], first_ids)
+    vectorstore = reopen(vectorstore)
+    ids = _ids(2)
+    vectorstore.add_texts([_revise(clause), _revise(clause)], [{"source": "a.xlsx", "file_id": 1},
+                                                               {"source": "b.xlsx", "file_id": 2}], ids)
+    assert vectorstore.dedup_stats == {"unique": 1, "exact": 0, "near": 1}
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.count_vectors() == 2
+    assert vectorstore.docstore.labels_for(ids)[ids[0]] == 1    # Same file: reference to the stored chunk
+
+    assert vectorstore.docstore.find_near_duplicates([minhash(clause)], [1]) == [1]
+    vectorstore.delete(first_ids + ids[:1])                     # File removed: its bands go with the chunk
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.docstore.find_near_duplicates([minhash(clause)], [1]) == [None]
+
+def test_shared_chunk_survives_until_its_last_file_is_removed(index, monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    vectorstore, reopen = index
+    shared, own_a, own_b = _text(5), _text(6), _text(7)
+    ids_a, ids_b = _ids(2), _ids(2)
+    vectorstore.add_texts([shared, own_a], [{"source": "a", "file_id": 1}] * 2, ids_a)
+    vectorstore = reopen(vectorstore)
+    vectorstore.add_texts([shared, own_b], [{"source": "b", "file_id": 2}] * 2, ids_b)
+    assert vectorstore.dedup_stats["exact"] == 1
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.count_vectors() == 3
+    assert len(vectorstore.docstore.labels_for_files([2])) == 2
+
+    assert vectorstore.delete(ids_a) == 2                       # File A removed: only its own chunk is a tombstone
+    assert len(vectorstore.pending_tombstones) == 1
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.count_vectors() == 2
+    docs = vectorstore.similarity_search(shared, k=1, file_ids=[2])
+    assert docs[0].page_content == shared
+    assert docs[0].metadata == {"source": "b", "file_id": 2}     # Alias took the chunk over
+    assert docs[0].id == ids_b[0]
+
+    vectorstore.delete(ids_b)
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.count_vectors() == 0
+    assert vectorstore.docstore.count() == 0
+    assert vectorstore.docstore.labels_for(ids_a + ids_b) == {}
+
+def test_reupload_is_not_matched_with_its_tombstoned_chunks(index, monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    vectorstore, reopen = index
+    texts, ids = [_text(8), _text(9)], _ids(2)
+    vectorstore.add_texts(texts, [{"file_id": 1}] * 2, ids)
+    vectorstore = reopen(vectorstore)
+    vectorstore.delete(ids)
+    vectorstore.add_texts(texts, [{"file_id": 1}] * 2, _ids(2))
+    assert vectorstore.dedup_stats["unique"] == 2
+    vectorstore = reopen(vectorstore)
+    assert vectorstore.count_vectors() == 2 and vectorstore.docstore.count() == 2
+
+def test_store_created_before_dedup_is_hashed(tmp_path):
+    db_path = str(tmp_path / "old_chunks.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE chunks (label INTEGER PRIMARY KEY AUTOINCREMENT, vector_id TEXT UNIQUE NOT NULL, "
+                 "text TEXT NOT NULL, metadata TEXT NOT NULL, file_id INTEGER)")
+    conn.execute("INSERT INTO chunks (vector_id, text, metadata, file_id) VALUES ('v1', ?, '{}', 1)", (_text(10),))
+    conn.commit()
+    conn.close()
+    chunk_store = ChunkStore(db_path)
+    _, _, matches = find_duplicates([_text(10), _text(11)], chunk_store=chunk_store)
+    assert matches == [("store", 1, "exact"), None]
+    chunk_store.close()
+
+def test_lowercased_hashes_are_recomputed(tmp_path):
+    db_path = str(tmp_path / "chunks.db")
+    chunk_store = ChunkStore(db_path)
+    chunk_store.add({"v1": Document(page_content="Invoice ACME", metadata={})}, hashes=["lowercased"])
+    chunk_store.close()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA user_version = 0")                     # Store written by the case-insensitive version
+    conn.commit()
+    conn.close()
+    chunk_store = ChunkStore(db_path)
+    assert chunk_store.find_duplicates([content_hash("Invoice ACME"), content_hash("invoice acme")]) == [1, None]
+    chunk_store.close()
@@ -0,0 +1,23 @@
+from embedding_cache import EmbeddingCache
+
+def _size_on_disk(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+def test_round_trip_and_hit_rate(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    key = EmbeddingCache.make_key("model", "text")
+    cache.put_many([(key, [0.5, 1.0, 2.0])])
+    assert cache.get_many([key, EmbeddingCache.make_key("model", "other")]) == {key: [0.5, 1.0, 2.0]}
+    assert cache.get_stats()["hit_rate"] == 0.5
+
+def test_overwritten_keys_are_not_counted_twice(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    keys = [EmbeddingCache.make_key("model", str(i)) for i in range(10)]
+    cache.put_many([(key, [1.0] * 16) for key in keys])
+    cache.put_many([(key, [2.0] * 16) for key in keys] + [(keys[0], [3.0] * 16)])
+    assert cache.get_stats()["size_bytes"] == _size_on_disk(cache) == 10 * 16 * 4
+
+def test_eviction_keeps_the_cache_under_budget(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_bytes=100 * 64)
+    cache.put_many([(EmbeddingCache.make_key("model", str(i)), [1.0] * 16) for i in range(150)])
+    assert cache.get_stats()["size_bytes"] == _size_on_disk(cache) <= 100 * 64
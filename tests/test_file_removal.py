@@ -0,0 +1,77 @@
+import os
+import threading
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import database
+import ingestion_jobs
+from benchmark import StubEmbeddings
+from embeddings import EmbeddingEngine, set_embedding_engine
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "app.py")
+
+@pytest.fixture
+def user_with_files(workdir, monkeypatch):
+    from bulk_ingest import bulk_ingest
+
+    monkeypatch.setenv("RAGIFY_METRICS_PORT", "0")
+    monkeypatch.setattr(ingestion_jobs, "_runner", None)
+    set_embedding_engine(EmbeddingEngine(model_name="stub", base_embeddings=StubEmbeddings(32)))
+    database.init_db()
+    user_id = database.add_user("alice", "secret")
+    files = []
+    for name, topic in (("a.txt", "invoices"), ("b.txt", "contracts"), ("c.txt", "payroll")):
+        (workdir / name).write_text("\n\n".join(f"Paragraph {i} about {topic} number {i * 7}." for i in range(30)))
+        files.append((str(workdir / name), name))
+    bulk_ingest(user_id, files, workers=1)
+    return user_id
+
+def _saved_vectorstore(user_id):
+    from index_cache import FAISS_INDEX_NAME
+    from utils import open_user_vectorstore
+
+    return open_user_vectorstore(database.get_user_faiss_path(user_id), FAISS_INDEX_NAME)
+
+# Trash button of one file in a 3-file knowledge base: only that file's vectors go
+def test_remove_one_file_from_the_sidebar(user_with_files):
+    user_id = user_with_files
+    files = {file["filename"]: file["id"] for file in database.get_user_files(user_id)}
+    kept_ids = {name: database.get_file_vector_ids(files[name]) for name in ("b.txt", "c.txt")}
+    removed_ids = database.get_file_vector_ids(files["a.txt"])
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state["logged_in_user_id"] = user_id
+    at.session_state["username"] = "alice"
+    at.run()
+    at.button(key=f"remove_db_{files['a.txt']}").click().run()
+    assert not at.exception
+
+    assert sorted(file["filename"] for file in database.get_user_files(user_id)) == ["b.txt", "c.txt"]
+    vectorstore = _saved_vectorstore(user_id)
+    for name, vector_ids in kept_ids.items():
+        assert len(vectorstore.docstore.labels_for(vector_ids)) == len(vector_ids), name
+    assert not vectorstore.docstore.labels_for(removed_ids)
+    assert vectorstore.count_vectors() == sum(len(vector_ids) for vector_ids in kept_ids.values())
+
+# A removal waits for the user's running ingestion job (index saved, file vectors not linked yet)
+def test_removal_waits_for_the_ingestion_lock(user_with_files):
+    from index_cache import FAISS_INDEX_NAME
+
+    user_id = user_with_files
+    files = {file["filename"]: file["id"] for file in database.get_user_files(user_id)}
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state["logged_in_user_id"] = user_id
+    at.session_state["username"] = "alice"
+    at.run()
+
+    lock = ingestion_jobs.get_ingestion_runner(FAISS_INDEX_NAME).user_lock(user_id)
+    with lock:
+        removal = threading.Thread(target=lambda: at.button(key=f"remove_db_{files['a.txt']}").click().run())
+        removal.start()
+        removal.join(1)
+        assert removal.is_alive()
+        assert "a.txt" in {file["filename"] for file in database.get_user_files(user_id)}
+    removal.join(60)
+    assert not at.exception
+    assert sorted(file["filename"] for file in database.get_user_files(user_id)) == ["b.txt", "c.txt"]
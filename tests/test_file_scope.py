@@ -0,0 +1,91 @@
+import uuid
+
+import faiss
+import numpy as np
+import pytest
+
+from benchmark import StubEmbeddings
+from index_cache import create_vectorstore, load_vectorstore
+from segments import compact_segments, save_segment
+from vector_index import build_index, reconstruct_labels, selection_params
+
+def _ids(n):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+def _add_file(vectorstore, file_id, n=5):
+    texts = [f"file {file_id} paragraph {i} about topic {i * 7 + file_id}" for i in range(n)]
+    vectorstore.add_texts(texts, [{"source": f"f{file_id}.txt", "file_id": file_id}] * n, _ids(n))
+    return texts
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("RAGIFY_DEDUP", raising=False)
+    monkeypatch.setenv("RAGIFY_MAX_SEGMENTS", "1")
+    return str(tmp_path / "index")
+
+def test_search_is_limited_to_the_selected_files(index_dir):
+    embeddings = StubEmbeddings(32)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    for file_id in (1, 2):
+        _add_file(vectorstore, file_id)
+        save_segment(vectorstore, index_dir, "index")
+        vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    assert compact_segments(index_dir, "index", embeddings)
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    texts = _add_file(vectorstore, 3)                    # Segment on top of the compacted base
+    save_segment(vectorstore, index_dir, "index")
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    assert len(vectorstore.parts()) == 2
+
+    docs = vectorstore.similarity_search(texts[0], k=10, file_ids=[2, 3])
+    assert len(docs) == 10
+    assert {doc.metadata["file_id"] for doc in docs} == {2, 3}
+    assert docs[0].page_content == texts[0]
+    assert {doc.metadata["file_id"] for doc in vectorstore.similarity_search(texts[0], k=10, file_ids=[1])} == {1}
+    assert vectorstore.similarity_search(texts[0], k=10, file_ids=[99]) == []
+
+def test_shared_chunk_is_found_from_every_file(index_dir):
+    embeddings = StubEmbeddings(32)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    text = "a clause uploaded in two files"
+    vectorstore.add_texts([text], [{"source": "a.txt", "file_id": 1}], _ids(1))
+    vectorstore.add_texts([text], [{"source": "b.txt", "file_id": 2}], _ids(1))
+    _add_file(vectorstore, 3)
+    save_segment(vectorstore, index_dir, "index")
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    for file_id in (1, 2):
+        docs = vectorstore.similarity_search(text, k=3, file_ids=[file_id])
+        assert [doc.page_content for doc in docs] == [text]
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_selector_restricts_every_index_type(index_type):
+    rng = np.random.RandomState(0)
+    vectors = rng.rand(2000, 16).astype(np.float32)
+    labels = np.arange(1000, 3000, dtype=np.int64)
+    index, _ = build_index(index_type, vectors, labels)
+    selected = labels[::50]
+    params = selection_params(index, faiss.IDSelectorBatch(selected), len(selected) / len(labels))
+    _, found = index.search(vectors[:1], 10, params=params)
+    found = [label for label in found[0] if label != -1]
+    assert found and set(found) <= set(selected.tolist())
+
+def test_mmr_search_through_a_retriever(index_dir):
+    embeddings = StubEmbeddings(32)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    _add_file(vectorstore, 1)
+    save_segment(vectorstore, index_dir, "index")
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    texts = _add_file(vectorstore, 2)                    # Unsaved segment
+    retriever = vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 3, "fetch_k": 8})
+    docs = retriever.invoke(texts[0])
+    assert len(docs) == 3 and docs[0].page_content == texts[0]
+    assert len({doc.page_content for doc in docs}) == 3
+
+    scoped = vectorstore.max_marginal_relevance_search(texts[0], k=3, fetch_k=8, file_ids=[1])
+    assert len(scoped) == 3 and {doc.metadata["file_id"] for doc in scoped} == {1}
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_reconstruct_labels(index_type):
+    vectors = np.random.RandomState(0).rand(2000, 16).astype(np.float32)
+    index, _ = build_index(index_type, vectors, np.arange(1000, 3000, dtype=np.int64))
+    assert np.allclose(reconstruct_labels(index, [2999, 1000]), vectors[[1999, 0]])
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import database
+import ingestion_jobs
+from benchmark import StubEmbeddings
+from embeddings import EmbeddingEngine, set_embedding_engine
+from ingestion_jobs import IngestionJobRunner, get_ingestion_runner
+from utils import open_user_vectorstore
+
+INDEX_NAME = "index"
+
+@pytest.fixture
+def user_id(workdir, monkeypatch):
+    monkeypatch.setenv("RAGIFY_METRICS_PORT", "0")
+    monkeypatch.setattr(ingestion_jobs, "_runner", None)
+    set_embedding_engine(EmbeddingEngine(model_name="stub", base_embeddings=StubEmbeddings(32)))
+    database.init_db()
+    return database.add_user("alice", "secret")
+
+def _spool(workdir, name, topic):
+    path = workdir / f"spooled_{name}"
+    path.write_text("\n\n".join(f"Paragraph {i} about {topic} number {i * 7}." for i in range(20)))
+    return str(path)
+
+def _wait(runner):
+    runner._executor.shutdown(wait=True)
+
+# Server stopped while the job was on its second file: the first one is not ingested again
+def test_interrupted_job_resumes_after_restart(user_id, workdir):
+    job_id = database.create_ingestion_job(user_id, [("a.txt", _spool(workdir, "a.txt", "invoices")),
+                                                     ("b.txt", _spool(workdir, "b.txt", "contracts"))])
+    first_file, second_file = database.get_ingestion_job_files(job_id)
+    database.update_ingestion_job(job_id, status="running")
+    database.update_ingestion_job_file(first_file["id"], "done", 0)
+    database.update_ingestion_job_file(second_file["id"], "running")
+
+    runner = IngestionJobRunner(INDEX_NAME, workers=1)
+    assert runner.resume() == [job_id]
+    _wait(runner)
+
+    assert database.get_ingestion_job(job_id)["status"] == "done"
+    assert [row["status"] for row in database.get_ingestion_job_files(job_id)] == ["done", "done"]
+    files = database.get_user_files(user_id)
+    assert [file["filename"] for file in files] == ["b.txt"]
+    vectorstore = open_user_vectorstore(database.get_user_faiss_path(user_id), INDEX_NAME)
+    assert vectorstore.count_vectors() == len(database.get_file_vector_ids(files[0]["id"])) > 0
+    assert not (workdir / "spooled_b.txt").exists()
+    assert database.get_unfinished_ingestion_jobs() == []
+
+def test_jobs_wait_for_the_user_lock(user_id, workdir, monkeypatch):
+    monkeypatch.setenv("RAGIFY_INGESTION_WORKERS", "2")
+    runner = get_ingestion_runner(INDEX_NAME)
+    with runner.user_lock(user_id):             # e.g. a file removal in progress
+        job_id = database.create_ingestion_job(user_id, [("a.txt", _spool(workdir, "a.txt", "invoices"))])
+        runner._executor.submit(runner._run_job, job_id)
+        started = threading.Event()
+        runner._executor.submit(started.set)
+        assert started.wait(5)
+        assert database.get_ingestion_job(job_id)["status"] == "queued"
+    _wait(runner)
+    assert database.get_ingestion_job(job_id)["status"] == "done"
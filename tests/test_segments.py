@@ -0,0 +1,83 @@
+import uuid
+
+import pytest
+
+from benchmark import StubEmbeddings
+from index_cache import create_vectorstore, load_vectorstore
+from segments import compact_segments, needs_compaction, read_manifest, save_segment
+
+def _add(vectorstore, prefix, n, file_id=1):
+    ids = [str(uuid.uuid4()) for _ in range(n)]
+    vectorstore.add_texts([f"{prefix} chunk {i} about topic {i * 13}" for i in range(n)], [{"file_id": file_id}] * n, ids)
+    return ids
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAGIFY_MAX_SEGMENTS", "2")
+    return str(tmp_path / "index")
+
+def test_saves_append_segments_and_tombstones(index_dir):
+    embeddings = StubEmbeddings(16)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    first_ids = _add(vectorstore, "first", 10)
+    assert save_segment(vectorstore, index_dir, "index")
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    _add(vectorstore, "second", 5)
+    vectorstore.delete(first_ids[:3])
+    save_segment(vectorstore, index_dir, "index")
+
+    manifest = read_manifest(index_dir, "index")
+    assert [segment["vectors"] for segment in manifest["segments"]] == [10, 5]
+    assert manifest["deleted"] == 3
+    assert load_vectorstore(index_dir, "index", embeddings).count_vectors() == 12
+
+def test_deleting_unsaved_vectors_is_not_a_tombstone(index_dir):
+    embeddings = StubEmbeddings(16)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    _add(vectorstore, "saved", 6)
+    save_segment(vectorstore, index_dir, "index")
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    assert vectorstore.delete(_add(vectorstore, "unsaved", 3, file_id=2)) == 3
+    assert vectorstore.count_vectors() == 6
+    save_segment(vectorstore, index_dir, "index")
+
+    manifest = read_manifest(index_dir, "index")
+    assert manifest["deleted"] == 0 and [segment["vectors"] for segment in manifest["segments"]] == [6]
+    assert load_vectorstore(index_dir, "index", embeddings).count_vectors() == 6
+
+def test_concurrent_writer_is_detected(index_dir):
+    embeddings = StubEmbeddings(16)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    _add(vectorstore, "first", 4)
+    save_segment(vectorstore, index_dir, "index")
+    copy_a = load_vectorstore(index_dir, "index", embeddings)
+    copy_b = load_vectorstore(index_dir, "index", embeddings)
+    _add(copy_a, "a", 2)
+    _add(copy_b, "b", 2)
+    assert save_segment(copy_a, index_dir, "index")
+    assert not save_segment(copy_b, index_dir, "index")            # Saved, but copy_a's segment is not in copy_b
+    assert load_vectorstore(index_dir, "index", embeddings).count_vectors() == 8
+
+def test_compaction_merges_segments_and_drops_tombstones(index_dir):
+    embeddings = StubEmbeddings(16)
+    vectorstore = create_vectorstore(index_dir, "index", embeddings)
+    ids = []
+    for batch in range(3):
+        ids += _add(vectorstore, f"batch{batch}", 6)
+        save_segment(vectorstore, index_dir, "index")
+        vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    vectorstore.delete(ids[:4])
+    save_segment(vectorstore, index_dir, "index")
+    assert needs_compaction(read_manifest(index_dir, "index"))
+
+    content_version = read_manifest(index_dir, "index")["content_version"]
+    assert compact_segments(index_dir, "index", embeddings)
+    manifest = read_manifest(index_dir, "index")
+    assert manifest["content_version"] == content_version           # Same chunks: cached answers stay valid
+    assert manifest["segments"] == [] and manifest["deleted"] == 0
+    assert manifest["base"]["vectors"] == 14
+    vectorstore = load_vectorstore(index_dir, "index", embeddings)
+    assert vectorstore.count_vectors() == 14
+    hit = vectorstore.similarity_search("batch2 chunk 5 about topic 65", k=1)[0]
+    assert hit.page_content == "batch2 chunk 5 about topic 65"
+    assert not needs_compaction(manifest)